@@ -0,0 +1,216 @@
+import codecs
+import csv
+import io
+import json
+
+from utils.finance import annuity_factor
+from .underwriting import UNDERWRITING_RATE, UNDERWRITING_TENURE_MONTHS
+
+# Same rules, thresholds and wording as underwriting.evaluate_loan
+MIN_CREDIT_SCORE = 700
+MAX_EMI_TO_SALARY = 0.5
+
+DECISIONS = ("REJECT", "APPROVE", "REQUEST_SALARY_SLIP")
+REASONS = (
+    "Credit score below 700",
+    "Within pre-approved limit",
+    "Salary supports EMI",
+    "EMI exceeds 50% of monthly salary",
+    "Amount > limit but <= 2x limit. Need salary slip.",
+    "Amount exceeds 2x pre-approved limit",
+)
+REJECT, APPROVE, REQUEST_SALARY_SLIP = range(3)
+(LOW_SCORE, WITHIN_LIMIT, SALARY_SUPPORTS_EMI, EMI_TOO_HIGH,
+ NEED_SALARY_SLIP, ABOVE_2X_LIMIT) = range(6)
+
+
+def evaluate_loans(credit_score, requested_amount, pre_approved_limit, monthly_salary=None) -> dict:
+    """
+    Vectorized `underwriting.evaluate_loan` over whole columns of applications.
+    Returns arrays of decision codes (index into DECISIONS), reason codes (index
+    into REASONS), the EMI and the affordable amount, each NaN where the scalar
+    function omits it.
+    """
+    import numpy as np
+
+    credit_score = np.asarray(credit_score, dtype=np.float64)
+    requested_amount = np.asarray(requested_amount, dtype=np.float64)
+    pre_approved_limit = np.asarray(pre_approved_limit, dtype=np.float64)
+    if monthly_salary is None:
+        monthly_salary = np.zeros_like(requested_amount)
+    monthly_salary = np.asarray(monthly_salary, dtype=np.float64)
+
+    # Same cached factor as the scalar path, so EMIs match bit for bit
+    factor = annuity_factor(UNDERWRITING_RATE, UNDERWRITING_TENURE_MONTHS)
+    emi = requested_amount * factor
+
+    low_score = credit_score < MIN_CREDIT_SCORE
+    within_limit = ~low_score & (requested_amount <= pre_approved_limit)
+    within_2x = ~low_score & ~within_limit & (requested_amount <= 2 * pre_approved_limit)
+    has_salary = within_2x & (monthly_salary > 0)
+    affordable = has_salary & (emi <= MAX_EMI_TO_SALARY * monthly_salary)
+
+    decision = np.select(
+        [low_score, within_limit, affordable, has_salary, within_2x],
+        [REJECT, APPROVE, APPROVE, REJECT, REQUEST_SALARY_SLIP],
+        default=REJECT
+    ).astype(np.int8)
+    reason = np.select(
+        [low_score, within_limit, affordable, has_salary, within_2x],
+        [LOW_SCORE, WITHIN_LIMIT, SALARY_SUPPORTS_EMI, EMI_TOO_HIGH, NEED_SALARY_SLIP],
+        default=ABOVE_2X_LIMIT
+    ).astype(np.int8)
+
+    too_high = has_salary & ~affordable
+    with np.errstate(divide="ignore", invalid="ignore"):
+        max_affordable = MAX_EMI_TO_SALARY * monthly_salary / factor
+
+    return {
+        "decision": decision,
+        "reason": reason,
+        "emi": np.where(has_salary, emi, np.nan),
+        "max_affordable_amount": np.where(too_high, max_affordable, np.nan)
+    }
+
+
+def to_records(result: dict) -> list:
+    """Converts `evaluate_loans` output into dicts identical to `evaluate_loan`'s."""
+    records = []
+    columns = zip(
+        result["decision"].tolist(), result["reason"].tolist(),
+        result["emi"].tolist(), result["max_affordable_amount"].tolist()
+    )
+    for decision, reason, emi, max_affordable in columns:
+        record = {"decision": DECISIONS[decision], "reason": REASONS[reason]}
+        # NaN marks fields the scalar function leaves out
+        if emi == emi:
+            record["emi"] = round(emi, 2)
+        if max_affordable == max_affordable:
+            record["max_affordable_amount"] = round(max_affordable, 2)
+        records.append(record)
+    return records
+
+
+# Column names accepted in batch input; the short forms match /agent/underwrite's query parameters
+FIELD_ALIASES = {
+    "credit_score": "credit_score", "score": "credit_score",
+    "requested_amount": "requested_amount", "amount": "requested_amount",
+    "pre_approved_limit": "pre_approved_limit", "limit": "pre_approved_limit",
+    "monthly_salary": "monthly_salary", "salary": "monthly_salary",
+}
+REQUIRED_FIELDS = ("credit_score", "requested_amount", "pre_approved_limit")
+ID_FIELDS = ("id", "application_id")
+CSV_OUTPUT_HEADER = "row,id,decision,reason,emi,max_affordable_amount\n"
+
+
+class BatchUnderwriter:
+    """
+    Incremental CSV/NDJSON underwriting.
+    Feed raw body chunks with `feed`; every `chunk_rows` complete rows are
+    evaluated in one vectorized pass and returned as formatted output.
+    Call `finish` once the input ends to flush the remainder.
+    """
+
+    def __init__(self, input_format: str = "ndjson", output_format: str = None, chunk_rows: int = 10000):
+        if input_format not in ("csv", "ndjson"):
+            raise ValueError(f"Unsupported input format {input_format}")
+        self.input_format = input_format
+        self.output_format = output_format or input_format
+        if self.output_format not in ("csv", "ndjson"):
+            raise ValueError(f"Unsupported output format {self.output_format}")
+        self.chunk_rows = chunk_rows
+        self.rows_read = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._remainder = ""
+        self._header = None
+        self._pending = []  # (row number, id, values dict or None, error)
+        self._started = False
+
+    def _parse_line(self, line: str):
+        if self.input_format == "ndjson":
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        else:
+            values = next(csv.reader([line]))
+            if self._header is None:
+                self._header = [name.strip() for name in values]
+                return None
+            record = dict(zip(self._header, values))
+        return record
+
+    def _accept(self, line: str):
+        if not line.strip():
+            return
+        try:
+            record = self._parse_line(line)
+        except ValueError as e:
+            self.rows_read += 1
+            self._pending.append((self.rows_read, None, None, f"Unparseable row: {e}"))
+            return
+        if record is None:
+            return
+        self.rows_read += 1
+
+        row_id = next((record[key] for key in ID_FIELDS if record.get(key) not in (None, "")), None)
+        values = {}
+        for key, value in record.items():
+            field = FIELD_ALIASES.get(str(key).strip())
+            if field is not None and value not in (None, ""):
+                values[field] = value
+        try:
+            missing = [field for field in REQUIRED_FIELDS if field not in values]
+            if missing:
+                raise ValueError(f"Missing {', '.join(missing)}")
+            values = {field: float(value) for field, value in values.items()}
+        except (TypeError, ValueError) as e:
+            self._pending.append((self.rows_read, row_id, None, str(e)))
+            return
+        self._pending.append((self.rows_read, row_id, values, None))
+
+    def _format(self, row: int, row_id, record: dict) -> str:
+        if self.output_format == "ndjson":
+            return json.dumps({"row": row, "id": row_id, **record}) + "\n"
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow([
+            row, "" if row_id is None else row_id,
+            record.get("decision", "ERROR"), record.get("reason", record.get("error", "")),
+            record.get("emi", ""), record.get("max_affordable_amount", "")
+        ])
+        return buffer.getvalue()
+
+    def _flush(self) -> str:
+        out = []
+        if not self._started and self.output_format == "csv":
+            out.append(CSV_OUTPUT_HEADER)
+        self._started = True
+
+        rows = self._pending
+        self._pending = []
+        valid = [values for _, _, values, _ in rows if values is not None]
+        records = iter(to_records(evaluate_loans(
+            [values["credit_score"] for values in valid],
+            [values["requested_amount"] for values in valid],
+            [values["pre_approved_limit"] for values in valid],
+            [values.get("monthly_salary", 0.0) for values in valid],
+        )))
+        # Results go out in input order, with invalid rows reported in place
+        for row, row_id, values, error in rows:
+            record = next(records) if values is not None else {"error": error}
+            out.append(self._format(row, row_id, record))
+        return "".join(out)
+
+    def feed(self, data: bytes) -> str:
+        text = self._remainder + self._decoder.decode(data)
+        lines = text.split("\n")
+        self._remainder = lines.pop()
+        for line in lines:
+            self._accept(line.rstrip("\r"))
+        if len(self._pending) >= self.chunk_rows:
+            return self._flush()
+        return ""
+
+    def finish(self) -> str:
+        self._accept((self._remainder + self._decoder.decode(b"", final=True)).rstrip("\r"))
+        self._remainder = ""
+        return self._flush()
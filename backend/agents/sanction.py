@@ -1,28 +1,66 @@
-from utils.pdf_generator import create_sanction_letter
+from utils.pdf_generator import render_batch, render_sanction_letter_offloaded
+from utils.document_store import document_store
+from utils.metrics import histogram
+from utils.finance import emi as calculate_emi, schedule_rows
 
-def generate_sanction(customer_name: str, amount: float, tenure_months: int, interest_rate: float):
+PDF_RENDER_SECONDS = histogram("pdf_render_duration_seconds", "Sanction letter PDF rendering latency")
+
+def generate_sanction(customer_name: str, amount: float, tenure_months: int, interest_rate: float,
+                      include_schedule: bool = False):
     """
-    Calculates EMI and generates the sanction letter.
+    Calculates EMI and generates the sanction letter, optionally with the full
+    month-by-month repayment schedule.
+    The PDF is kept in the document store; only its handle is returned so the
+    letter never travels through the LLM context or the event stream.
     """
-    # Calculate EMI
-    r = interest_rate / 12 / 100
-    n = tenure_months
-    if r > 0:
-        emi = amount * r * ((1 + r)**n) / (((1 + r)**n) - 1)
-    else:
-        emi = amount / n
+    emi = calculate_emi(amount, interest_rate, tenure_months)
+    schedule = schedule_rows(amount, interest_rate, tenure_months) if include_schedule else None
 
     # Generate PDF
-    pdf_base64 = create_sanction_letter(
-        customer_name=customer_name,
-        amount=amount,
-        tenure=tenure_months,
-        interest_rate=interest_rate,
-        emi=emi
-    )
+    with PDF_RENDER_SECONDS.time():
+        pdf_bytes = render_sanction_letter_offloaded(
+            customer_name=customer_name,
+            amount=amount,
+            tenure=tenure_months,
+            interest_rate=interest_rate,
+            emi=emi,
+            schedule=schedule
+        )
+    document_id = document_store.put(pdf_bytes)
     
     return {
         "success": True,
-        "pdf_base64": pdf_base64,
+        "document_id": document_id,
+        "document_url": f"/documents/{document_id}",
         "emi": round(emi, 2)
     }
+
+def generate_sanctions_batch(applications: list) -> list:
+    """
+    Sanction letters for a whole run. Each application has customer_name,
+    amount, tenure_months and interest_rate; letters are rendered across the
+    PDF worker pool and each result carries its own render time.
+    """
+    letters = []
+    for application in applications:
+        emi = calculate_emi(application["amount"], application["interest_rate"], application["tenure_months"])
+        letters.append({
+            "customer_name": application["customer_name"],
+            "amount": application["amount"],
+            "tenure": application["tenure_months"],
+            "interest_rate": application["interest_rate"],
+            "emi": emi
+        })
+
+    results = []
+    for kwargs, (pdf_bytes, render_ms) in zip(letters, render_batch(letters)):
+        PDF_RENDER_SECONDS.observe(render_ms / 1000)
+        document_id = document_store.put(pdf_bytes)
+        results.append({
+            "success": True,
+            "document_id": document_id,
+            "document_url": f"/documents/{document_id}",
+            "emi": round(kwargs["emi"], 2),
+            "render_ms": round(render_ms, 3)
+        })
+    return results
@@ -1,3 +1,9 @@
+from utils.finance import emi as calculate_emi, max_affordable_amount
+
+# EMI used to check affordability: 5 years at 14%
+UNDERWRITING_RATE = 14.0
+UNDERWRITING_TENURE_MONTHS = 60
+
 def evaluate_loan(credit_score: int, requested_amount: float, pre_approved_limit: float, monthly_salary: float = 0.0):
     """
     Evaluates loan application based on credit score, limits, and salary.
@@ -17,12 +23,7 @@ def evaluate_loan(credit_score: int, requested_amount: float, pre_approved_limit
     if requested_amount <= 2 * pre_approved_limit:
         if monthly_salary > 0:
             # Check EMI logic (approximate EMI for 5 years at 14%)
-            # P * r * (1+r)^n / ((1+r)^n - 1)
-            # 5 years = 60 months
-            annual_rate = 14.0
-            r = annual_rate / 12 / 100
-            n = 60
-            emi = requested_amount * r * ((1 + r)**n) / (((1 + r)**n) - 1)
+            emi = calculate_emi(requested_amount, UNDERWRITING_RATE, UNDERWRITING_TENURE_MONTHS)
             
             if emi <= 0.5 * monthly_salary:
                 return {
@@ -34,7 +35,11 @@ def evaluate_loan(credit_score: int, requested_amount: float, pre_approved_limit
                 return {
                     "decision": "REJECT",
                     "reason": "EMI exceeds 50% of monthly salary",
-                    "emi": round(emi, 2)
+                    "emi": round(emi, 2),
+                    # Lets the sales agent offer an amount the salary does support
+                    "max_affordable_amount": round(max_affordable_amount(
+                        monthly_salary, UNDERWRITING_RATE, UNDERWRITING_TENURE_MONTHS
+                    ), 2)
                 }
         else:
             return {
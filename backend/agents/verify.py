@@ -1,5 +1,32 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from mock_servers.crm import get_customer_by_phone
-from utils.otp_manager import otp_manager
+from mock_servers.offer import get_offer
+from mock_servers.credit import get_credit_score
+from utils.otp_manager import OTPRateLimited, otp_manager
+
+PREFETCH_TIMEOUT_SECONDS = float(os.getenv("PREFETCH_TIMEOUT_SECONDS", "10"))
+
+# Offer and credit lookups for a freshly verified customer run side by side here
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PREFETCH_WORKERS", "32")), thread_name_prefix="prefetch"
+)
+
+def _fetch(future):
+    try:
+        return future.result(timeout=PREFETCH_TIMEOUT_SECONDS)
+    except Exception as e:
+        return {"error": f"Lookup failed: {e}"}
+
+def prefetch_profile(customer_id: str) -> dict:
+    """
+    Fetches the pre-approved offer and the credit score concurrently.
+    A failed lookup comes back as an {"error": ...} entry; the other is still returned.
+    """
+    offer_future = prefetch_executor.submit(get_offer, customer_id)
+    credit_future = prefetch_executor.submit(get_credit_score, customer_id)
+    return {"offer": _fetch(offer_future), "credit": _fetch(credit_future)}
 
 def send_otp(phone: str):
     """
@@ -10,25 +37,49 @@ def send_otp(phone: str):
         # For security, we might want to pretend we sent it, but for this mock app, explicit failure is fine.
         return {"status": "FAILED", "message": "Phone number not found in our records."}
     
-    otp_manager.generate_otp(phone)
+    try:
+        otp_manager.generate_otp(phone)
+    except OTPRateLimited as e:
+        return {
+            "status": "FAILED",
+            "message": f"Too many OTP requests for this number. Please try again in {e.retry_after:.0f} seconds.",
+            "retry_after_seconds": round(e.retry_after)
+        }
     return {"status": "SUCCESS", "message": f"OTP sent to {phone}. Please enter the code."}
 
 def verify_otp(phone: str, code: str):
     """
-    Validates the OTP and returns customer details if successful.
+    Validates the OTP and returns customer details if successful, together
+    with the customer's pre-approved offer and credit score.
     """
-    is_valid = otp_manager.validate_otp(phone, code)
+    try:
+        is_valid = otp_manager.validate_otp(phone, code)
+    except OTPRateLimited as e:
+        return {
+            "verified": False,
+            "message": f"Too many incorrect attempts. Please request a new OTP in {e.retry_after:.0f} seconds.",
+            "retry_after_seconds": round(e.retry_after)
+        }
     
     if is_valid:
         customer = get_customer_by_phone(phone)
-        return {
+        profile = prefetch_profile(customer["id"])
+        result = {
             "verified": True,
             "message": "OTP Verified Successfully.",
             "customer_id": customer["id"],
             "customer_name": customer["name"],
             # Return address for context if needed, but primary verification is done
-            "address": customer["address"] 
+            "address": customer["address"],
+            # Prefetched so the next steps need no separate offer or credit calls. Only
+            # these fields go back to the model; the rest of each lookup is not needed
+            "pre_approved_limit": profile["offer"].get("pre_approved_limit"),
+            "credit_score": profile["credit"].get("credit_score"),
         }
+        errors = {name: lookup["error"] for name, lookup in profile.items() if "error" in lookup}
+        if errors:
+            result["lookup_errors"] = errors
+        return result
     else:
         return {
             "verified": False,
@@ -1,15 +1,44 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+import asyncio
+import contextlib
+import json
+import math
 import os
+import time
 
-from master.orchestrator import get_or_create_session
-from utils.file_upload import save_salary_slip
+from master.orchestrator import CHAT_TIMEOUT_SECONDS, KEYED_TURN_TIMEOUT_SECONDS, get_or_create_session, init_llm, llm_status, sessions, turn_stats
+from master import funnel, llm_scheduler, orchestrator, tool_cache
+from utils.file_upload import UPLOAD_MAX_BYTES, UploadTooLarge, extract_salary, save_salary_slip
+from utils.document_store import document_store
+from utils.idempotency import idempotency_cache
+from utils.metrics import gauge, histogram, registry
+from utils.otp_manager import otp_manager
+from utils.state_backend import WORKER_ID
 from mock_servers import crm, offer, credit
-from agents import sales, verify, underwriting, sanction
+from streaming.producer import producer
+from agents import sales, verify, underwriting, sanction, bulk_underwriting
 
-app = FastAPI(title="NBFC Chatbot Backend", version="1.0")
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy clients are created here rather than on import, so scripts and
+    # worker processes that only import the app never pay for them
+    await run_in_threadpool(init_llm)
+    # Chats are created on the event loop and only read the cache's name; the API calls happen here and in the background
+    await run_in_threadpool(orchestrator.prompt_cache.refresh)
+    producer.start()
+    orchestrator.sessions.start()
+    otp_manager.start()
+    yield
+    otp_manager.close()
+    orchestrator.sessions.close()
+    await run_in_threadpool(producer.close)
+
+app = FastAPI(title="NBFC Chatbot Backend", version="1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,57 +46,267 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Affinity"],
 )
 
+HTTP_SECONDS = histogram("http_request_duration_seconds", "HTTP handler latency", ["method", "route", "status"])
+
+gauge("sessions_live", "Chat sessions held in memory", function=lambda: len(sessions))
+gauge("session_store_events_total", "Session store lookups and evictions since start", ["outcome"],
+      function=lambda: {(key,): sessions.stats()[key] for key in ("hits", "misses", "rehydrations", "evictions")})
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep the series bounded
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status
+        )
+
+@app.middleware("http")
+async def session_affinity(request: Request, call_next):
+    # Tells a load balancer which worker already holds the session live, so it
+    # can send the next turn back here; any worker can still serve it
+    hint = request.headers.get("x-session-affinity")
+    if hint:
+        sessions.note_affinity(hint)
+    response = await call_next(request)
+    response.headers["X-Session-Affinity"] = WORKER_ID
+    return response
+
+# Room for the multipart boundaries and form fields around the file
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Refuse oversized slips before the form parser spools them; chunked
+    # bodies without a length are still capped while they are saved
+    if request.url.path == "/upload/salary_slip":
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"Salary slip exceeds {UPLOAD_MAX_BYTES} bytes"})
+    return await call_next(request)
+
 class ChatRequest(BaseModel):
     session_id: str
     user_id: str
     message: str
     requested_amount: Optional[float] = None
     tenure_months: Optional[int] = None
+    # Client-generated id for this message; a retry with the same id gets the original reply
+    message_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     reply: str
     next_action: Optional[str] = None
     metadata: Optional[dict] = None
 
+# The model is saturated or rate limited; the client can send the same message again
+BUSY_REPLY = "We're helping a lot of customers right now. Please send your message again in a few seconds."
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, idempotency_key: Optional[str] = Header(None)):
     session = get_or_create_session(request.session_id)
     
     # Simple logic: If user sends explicit amount/tenure, update session context separately?
     # For now, we trust the message contains the intent, as per "Conversational Master Agent" goal.
     
+    message_id = request.message_id or idempotency_key
     try:
-        reply = session.process_message(request.message)
-        return ChatResponse(reply=reply)
+        if message_id:
+            # The turn runs to completion even if this caller times out, so a retry can pick up its reply
+            reply = await idempotency_cache.run(
+                "chat", (request.session_id, message_id),
+                lambda: session.process_message_async(request.message, timeout=KEYED_TURN_TIMEOUT_SECONDS),
+                timeout=CHAT_TIMEOUT_SECONDS
+            )
+        else:
+            reply = await session.process_message_async(request.message)
+        return ChatResponse(reply=reply, metadata={"stage": funnel.stage(session.customer_data)})
+    except asyncio.TimeoutError:
+        print(f"Timed out processing message for session {request.session_id}")
+        return ChatResponse(reply="I'm sorry, this is taking longer than expected. Please try again in a moment.", metadata={"error": "timeout"})
+    except llm_scheduler.LLMBusy as e:
+        print(f"Model busy for session {request.session_id}: {e}")
+        return ChatResponse(reply=BUSY_REPLY, metadata={"error": "busy", "retry_after_seconds": math.ceil(e.retry_after)})
     except Exception as e:
         print(f"Error processing message: {e}")
         return ChatResponse(reply="I apologize, but I'm currently facing some technical difficulties. Please try again later.", metadata={"error": str(e)})
 
+# Streamed turns outliving their request; held so they are not garbage collected mid-turn
+_background_turns = set()
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Server-Sent Events version of /chat. Emits `tool` progress events and `text`
+    chunks as they are produced, then a final `done` event with the full reply
+    and time-to-first-byte / total latency.
+    A retried `message_id` gets the original reply as one `text` event and a `done` marked `replayed`.
+    """
+    session = get_or_create_session(request.session_id)
+    message_id = request.message_id or idempotency_key
+    key = (request.session_id, message_id)
+
+    async def run_turn(relay: asyncio.Queue, future):
+        # Runs to the end of the turn even if the client goes away, and settles
+        # the idempotency entry itself, so a retry joins or replays it
+        try:
+            timeout = KEYED_TURN_TIMEOUT_SECONDS if future is not None else CHAT_TIMEOUT_SECONDS
+            async for kind, data in session.stream_message(request.message, timeout=timeout):
+                if kind == "done" and future is not None:
+                    idempotency_cache.complete(key, future, data["reply"])
+                relay.put_nowait((kind, data))
+        except Exception as e:
+            relay.put_nowait(("error", e))
+        finally:
+            if future is not None and not future.done():
+                # Failed or timed out: let a retry run the message again
+                idempotency_cache.fail("chat", key, future, RuntimeError("Streamed turn did not complete"))
+
+    async def events():
+        future, owner = idempotency_cache.claim("chat", key) if message_id else (None, True)
+        try:
+            if not owner:
+                reply = await asyncio.wait_for(asyncio.shield(future), timeout=CHAT_TIMEOUT_SECONDS)
+                yield sse_event("text", {"text": reply})
+                yield sse_event("done", {"reply": reply, "replayed": True})
+                return
+            relay = asyncio.Queue()
+            task = asyncio.ensure_future(run_turn(relay, future))
+            _background_turns.add(task)
+            task.add_done_callback(_background_turns.discard)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + CHAT_TIMEOUT_SECONDS
+            while True:
+                kind, data = await asyncio.wait_for(relay.get(), timeout=max(deadline - loop.time(), 0))
+                if kind == "error":
+                    raise data
+                yield sse_event(kind, data if kind != "text" else {"text": data})
+                if kind == "done":
+                    return
+        except asyncio.TimeoutError:
+            print(f"Timed out streaming message for session {request.session_id}")
+            yield sse_event("error", {"error": "timeout", "reply": "I'm sorry, this is taking longer than expected. Please try again in a moment."})
+        except llm_scheduler.LLMBusy as e:
+            print(f"Model busy for session {request.session_id}: {e}")
+            yield sse_event("error", {"error": "busy", "retry_after_seconds": math.ceil(e.retry_after), "reply": BUSY_REPLY})
+        except Exception as e:
+            print(f"Error streaming message: {e}")
+            yield sse_event("error", {"error": str(e), "reply": "I apologize, but I'm currently facing some technical difficulties. Please try again later."})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/upload/salary_slip")
 async def upload_salary(
     file: UploadFile = File(...), 
-    session_id: str = Form(...)
+    session_id: str = Form(...),
+    message_id: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    try:
-        file_path = save_salary_slip(file, session_id)
+    """
+    `message_id` (or an Idempotency-Key header) makes retries safe: the slip is
+    processed once and retries get the original response.
+    """
+    async def process(timeout: float = None):
+        upload = await save_salary_slip(file, session_id)
+        salary = await extract_salary(upload)
         
         # Notify the agent about the upload
         session = get_or_create_session(session_id)
         # We inject a system message into the conversation
-        sys_msg = f"User has uploaded a salary slip." 
-        # Ideally we pass this file path to process_message, but let's do it via next chat or internal state?
-        # The orchestrator `process_message` handles `attachment_path`.
-        # But `process_message` expects a user message.
-        # We can trigger a "hidden" message loop.
+        reply = await session.process_message_async(message="[SYSTEM: User uploaded salary slip]", salary=salary, timeout=timeout)
         
-        reply = session.process_message(message="[SYSTEM: User uploaded salary slip]", attachment_path=file_path)
-        
-        return {"status": "success", "file_path": file_path, "agent_reply": reply}
+        return {
+            "status": "success",
+            "file_path": str(upload.path),
+            "sha256": upload.sha256,
+            "size": upload.size,
+            "deduplicated": upload.deduplicated,
+            "salary": salary,
+            "agent_reply": reply,
+            "stage": funnel.stage(session.customer_data)
+        }
+
+    upload_id = message_id or idempotency_key
+    try:
+        if upload_id:
+            return await idempotency_cache.run(
+                "upload", (session_id, upload_id), lambda: process(timeout=KEYED_TURN_TIMEOUT_SECONDS), timeout=CHAT_TIMEOUT_SECONDS
+            )
+        return await process()
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing salary slip")
+    except llm_scheduler.LLMBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/documents/{document_id}")
+def get_document(document_id: str):
+    path = document_store.path(document_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return FileResponse(path, media_type="application/pdf", filename=f"sanction_letter_{document_id[:12]}.pdf")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/sessions/stats")
+def session_stats():
+    return {**sessions.stats(), "turns": turn_stats, "tool_cache": tool_cache.stats(), "prompt_cache": orchestrator.prompt_cache.describe() if orchestrator.prompt_cache else None,
+            "llm_scheduler": llm_scheduler.scheduler.stats(),
+            "idempotency": idempotency_cache.stats()}
+
+def _probe(check) -> dict:
+    try:
+        return {"ready": True, **(check() or {})}
+    except Exception as e:
+        return {"ready": False, "error": str(e)}
+
+def _check_documents():
+    if not os.access(document_store.root, os.W_OK):
+        raise OSError(f"{document_store.root} is not writable")
+
+def _check_sessions():
+    if sessions.backend is not None:
+        sessions.backend.ping()
+    return {"backend": type(sessions.backend).__name__ if sessions.backend else "memory"}
+
+@app.get("/ready")
+def ready():
+    """Readiness per subsystem; 503 until all of them can serve. Kafka being down is not fatal (events spool)."""
+    events = producer.stats()
+    subsystems = {
+        "llm": llm_status(),
+        "events": {"ready": events["started"], "connected": events["connected"], "mode": events["mode"]},
+        "sessions": _probe(_check_sessions),
+        "otp": _probe(lambda: {"pending": otp_manager.pending()}),
+        "documents": _probe(_check_documents),
+    }
+    is_ready = all(subsystem["ready"] for subsystem in subsystems.values())
+    return JSONResponse({"ready": is_ready, "subsystems": subsystems}, status_code=200 if is_ready else 503)
+
+@app.get("/events/stats")
+def event_stats():
+    return producer.stats()
+
 # Mock Endpoints (exposed as requested)
 
 @app.get("/mock/crm/customer/{phone}")
@@ -103,10 +342,52 @@ def agent_sales(amount: float, limit: float):
 def agent_underwrite(score: int, amount: float, limit: float, salary: float = 0):
     return underwriting.evaluate_loan(score, amount, limit, salary)
 
+BATCH_READ_BYTES = 1 << 20
+
+@app.post("/agent/underwrite/batch")
+async def agent_underwrite_batch(request: Request, format: Optional[str] = None):
+    """
+    Underwrites a CSV (text/csv) or NDJSON body of applications with the
+    vectorized engine and streams one result per row back, a chunk at a time.
+    Columns: credit_score|score, requested_amount|amount, pre_approved_limit|limit,
+    optional monthly_salary|salary and id. `format` selects csv or ndjson output.
+    """
+    input_format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    try:
+        underwriter = bulk_underwriting.BatchUnderwriter(input_format, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The body is read up front (reading it after the response has started is not
+    # portable across ASGI servers); results are produced and sent chunk by chunk.
+    body = await request.body()
+
+    async def results():
+        for offset in range(0, len(body), BATCH_READ_BYTES):
+            out = await run_in_threadpool(underwriter.feed, body[offset:offset + BATCH_READ_BYTES])
+            if out:
+                yield out
+        yield await run_in_threadpool(underwriter.finish)
+
+    media_type = "text/csv" if underwriter.output_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(results(), media_type=media_type)
+
 @app.post("/agent/sanction")
 def agent_sanction(name: str, amount: float, tenure: int, rate: float):
     return sanction.generate_sanction(name, amount, tenure, rate)
 
+class SanctionApplication(BaseModel):
+    customer_name: str
+    amount: float
+    tenure_months: int
+    interest_rate: float
+
+@app.post("/agent/sanction/batch")
+def agent_sanction_batch(applications: List[SanctionApplication]):
+    """Renders and stores sanction letters for a batch; each result includes its render_ms."""
+    results = sanction.generate_sanctions_batch([application.model_dump() for application in applications])
+    return {"count": len(results), "results": results}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,55 @@
+"""
+Cost of EMI maths and repayment schedules, alone and inside the sanction letter.
+
+    python -m benchmarks.amortization --loans 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils import finance
+from utils.pdf_generator import render_sanction_letter
+
+
+def best_of(func, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def run(loans: int):
+    rng = np.random.default_rng(1)
+    amounts = rng.integers(1, 40, loans) * 25000.0
+    rates = rng.choice([12.0, 14.0], loans)
+    tenures = rng.choice([12, 24, 36, 48, 60], loans)
+
+    finance.annuity_factor.cache_clear()
+    cold_ms = best_of(lambda: finance.annuity_factor(13.5, 48), repeat=1)
+    warm_ms = best_of(lambda: [finance.emi(500000, 12.0, 60) for _ in range(10000)]) / 10000
+    print(f"annuity factor: cold {cold_ms * 1000:.2f}us, cached emi() {warm_ms * 1000:.3f}us")
+
+    one_ms = best_of(lambda: finance.schedule_rows(500000, 12.0, 60))
+    print(f"schedule_rows, 1 loan x 60 months: {one_ms:.3f}ms")
+
+    many_ms = best_of(lambda: finance.amortization_schedule(amounts, rates, tenures), repeat=3)
+    print(f"amortization_schedule, {loans:,} loans: {many_ms:.1f}ms ({loans / many_ms * 1000:,.0f} loans/s)")
+
+    schedule = finance.schedule_rows(500000, 12.0, 60)
+    emi = finance.emi(500000, 12.0, 60)
+    plain_ms = best_of(lambda: render_sanction_letter("Arjun Sharma", 500000, 60, 12.0, emi))
+    with_ms = best_of(lambda: render_sanction_letter("Arjun Sharma", 500000, 60, 12.0, emi, schedule=schedule))
+    print(f"sanction letter: {plain_ms:.2f}ms plain, {with_ms:.2f}ms with 60-month schedule")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=100000)
+    run(parser.parse_args().loans)
+
+
+if __name__ == "__main__":
+    main()
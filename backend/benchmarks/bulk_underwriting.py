@@ -0,0 +1,60 @@
+"""
+Rows per second of the vectorized underwriting engine against the scalar loop.
+
+    python -m benchmarks.bulk_underwriting --rows 100000,1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from agents.bulk_underwriting import evaluate_loans, to_records
+from agents.underwriting import evaluate_loan
+
+
+def synthetic_applications(n: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    limits = rng.integers(1, 20, n) * 50000.0
+    return {
+        "credit_score": rng.integers(600, 850, n),
+        "requested_amount": np.round(limits * rng.uniform(0.2, 2.5, n), -3),
+        "pre_approved_limit": limits,
+        "monthly_salary": np.where(rng.random(n) < 0.5, 0.0, np.round(rng.uniform(20000, 300000, n), -2)),
+    }
+
+
+def run(rows, scalar_max):
+    for n in rows:
+        apps = synthetic_applications(n)
+
+        start = time.perf_counter()
+        result = evaluate_loans(**apps)
+        vector_s = time.perf_counter() - start
+        records = to_records(result)
+        records_s = time.perf_counter() - start
+
+        line = (
+            f"{n:>9} rows  vectorized {n / vector_s:>14,.0f} rows/s  "
+            f"with dict output {n / records_s:>12,.0f} rows/s"
+        )
+
+        if n <= scalar_max:
+            columns = [apps[key].tolist() for key in ("credit_score", "requested_amount", "pre_approved_limit", "monthly_salary")]
+            start = time.perf_counter()
+            expected = [evaluate_loan(*row) for row in zip(*columns)]
+            scalar_s = time.perf_counter() - start
+            mismatches = sum(1 for a, b in zip(records, expected) if a != b)
+            line += f"  scalar {n / scalar_s:>12,.0f} rows/s  speedup {scalar_s / vector_s:,.0f}x  mismatches={mismatches}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000")
+    parser.add_argument("--scalar-max", type=int, default=1000000, help="Skip the scalar loop above this many rows")
+    args = parser.parse_args()
+    run([int(n) for n in args.rows.split(",")], args.scalar_max)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Customer lookup latency for the JSON and SQLite customer stores.
+
+    python -m benchmarks.customer_lookup --sizes 10000,1000000,5000000
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from mock_servers.customer_store import JSONCustomerStore, SQLiteCustomerStore, build_sqlite
+
+CITIES = ["Mumbai", "Delhi", "Bangalore", "Pune", "Chennai", "Ahmedabad"]
+
+
+def synthetic_customers(n: int):
+    rnd = random.Random(42)
+    for i in range(n):
+        yield {
+            "id": f"CUST{i:08d}",
+            "name": f"Customer {i}",
+            "age": rnd.randint(21, 65),
+            "city": rnd.choice(CITIES),
+            "phone": f"{7000000000 + i}",
+            "address": f"{i}, Synthetic Street",
+            "current_loan": rnd.choice([0, 50000, 200000]),
+            "credit_score": rnd.randint(600, 850),
+            "pre_approved_limit": rnd.randrange(100000, 1000000, 50000),
+        }
+
+
+def time_lookups(lookup, keys):
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        lookup(key)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "p50_us": round(statistics.median(samples), 2),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1], 2),
+    }
+
+
+def legacy_lookup(path):
+    # What crm.get_customer_by_phone used to do: parse the whole file and scan it
+    def _lookup(phone):
+        with open(path, "r") as f:
+            for cust in json.load(f):
+                if cust["phone"] == phone:
+                    return cust
+        return None
+    return _lookup
+
+
+def run(sizes, backends, lookups, json_max, legacy_max):
+    rnd = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            phones = [f"{7000000000 + rnd.randrange(n)}" for _ in range(lookups)]
+            ids = [f"CUST{rnd.randrange(n):08d}" for _ in range(lookups)]
+            json_path = Path(tmp) / f"customers_{n}.json"
+            db_path = Path(tmp) / f"customers_{n}.db"
+
+            for backend in backends:
+                if backend == "json":
+                    if n > json_max:
+                        print(f"{n:>9} json    skipped (above --json-max {json_max})")
+                        continue
+                    with open(json_path, "w") as f:
+                        json.dump(list(synthetic_customers(n)), f)
+                    start = time.perf_counter()
+                    store = JSONCustomerStore(json_path, check_interval=1.0)
+                    len(store)
+                elif backend == "sqlite":
+                    build_sqlite(synthetic_customers(n), db_path)
+                    start = time.perf_counter()
+                    store = SQLiteCustomerStore(db_path)
+                else:
+                    raise ValueError(f"Unknown backend {backend}")
+                open_ms = (time.perf_counter() - start) * 1000
+
+                by_phone = time_lookups(store.get_by_phone, phones)
+                by_id = time_lookups(store.get_by_id, ids)
+                print(
+                    f"{n:>9} {backend:<7} open={open_ms:9.1f}ms  "
+                    f"phone p50={by_phone['p50_us']}us p99={by_phone['p99_us']}us  "
+                    f"id p50={by_id['p50_us']}us p99={by_id['p99_us']}us"
+                )
+
+            if n <= legacy_max and json_path.exists():
+                legacy = time_lookups(legacy_lookup(json_path), phones[:20])
+                print(f"{n:>9} legacy  phone p50={legacy['p50_us']}us p99={legacy['p99_us']}us (parse + scan per call)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,1000000,5000000")
+    parser.add_argument("--backends", default="json,sqlite")
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--json-max", type=int, default=1000000,
+                        help="Skip the in-memory JSON store above this many customers")
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="Also time the old parse-and-scan lookup up to this size")
+    args = parser.parse_args()
+    run(
+        sizes=[int(s) for s in args.sizes.split(",")],
+        backends=args.backends.split(","),
+        lookups=args.lookups,
+        json_max=args.json_max,
+        legacy_max=args.legacy_max,
+    )
+
+
+if __name__ == "__main__":
+    main()
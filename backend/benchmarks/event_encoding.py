@@ -0,0 +1,107 @@
+"""
+Event encoding: bytes per event and encode/decode throughput of the
+schema-described binary format (streaming/schema.py) against the JSON the
+producer used to send, raw and gzip-compressed per producer batch.
+
+    python -m benchmarks.event_encoding --events 50000
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import time
+import uuid
+
+from agents.sales import negotiate_loan
+from agents.underwriting import evaluate_loan
+from mock_servers.credit import get_credit_score
+from mock_servers.crm import get_customers
+from mock_servers.offer import get_offer
+from streaming import schema
+
+
+def message(event_type: str, session_id: str, function: str, args: dict, result: dict) -> dict:
+    # Same shape as the orchestrator's tool events
+    return {
+        "event_type": event_type,
+        "session_id": session_id,
+        "payload": {"event_id": uuid.uuid4().hex, "function": function, "args": args, "result": result,
+                    "duration_ms": round(random.uniform(0.1, 300), 3)},
+        "timestamp": time.time()
+    }
+
+
+def session_messages(customer: dict, session_id: str) -> list:
+    limit = customer["pre_approved_limit"]
+    amount = float(random.choice([0.5, 1.5, 3]) * limit)
+    offer, credit = get_offer(customer["id"]), get_credit_score(customer["id"])
+    verify = {
+        "verified": True, "message": "OTP Verified Successfully.", "customer_id": customer["id"],
+        "customer_name": customer["name"], "address": customer["address"],
+        "pre_approved_limit": offer["pre_approved_limit"], "credit_score": credit["credit_score"],
+        "offer": offer, "credit": credit
+    }
+    underwriting_args = {"credit_score": credit["credit_score"], "requested_amount": amount,
+                         "pre_approved_limit": float(limit), "monthly_salary": 0.0}
+    document_id = hashlib.sha256(session_id.encode()).hexdigest()
+    return [
+        message("OTP_SEND", session_id, "send_otp", {"phone": customer["phone"]},
+                {"status": "SUCCESS", "message": f"OTP sent to {customer['phone']}. Please enter the code."}),
+        message("OTP_VERIFY", session_id, "verify_otp", {"phone": customer["phone"], "code": "123456"}, verify),
+        message("NEGOTIATION", session_id, "negotiate_loan", {"requested_amount": amount, "pre_approved_limit": float(limit)},
+                negotiate_loan(amount, limit)),
+        message("UNDERWRITING", session_id, "evaluate_loan", underwriting_args, evaluate_loan(**underwriting_args)),
+        message("SANCTION_GENERATED", session_id, "generate_sanction",
+                {"customer_name": customer["name"], "amount": amount, "tenure_months": 24, "interest_rate": 12.0,
+                 "include_schedule": False},
+                {"success": True, "document_id": document_id, "document_url": f"/documents/{document_id}", "emi": 4707.35})
+    ]
+
+
+def rate(func, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def batch_gzip_bytes(values: list, batch: int) -> int:
+    # The producer compresses whole batches, not single events
+    return sum(len(gzip.compress(b"".join(values[i:i + batch]))) for i in range(0, len(values), batch))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=200, help="Events per compressed producer batch")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    customers = get_customers()
+    messages = []
+    while len(messages) < args.events:
+        messages.extend(session_messages(random.choice(customers), f"session_{len(messages)}"))
+    messages = messages[:args.events]
+
+    def to_json(value):
+        return json.dumps(value).encode("utf-8")
+
+    json_values = [to_json(m) for m in messages]
+    binary_values = [schema.encode(m) for m in messages]
+    assert all(schema.decode(value) == m for value, m in zip(binary_values, messages))
+
+    print(f"{len(messages)} events, schema version {schema.registry.latest().version}")
+    for name, values, encode, decode in (
+        ("json", json_values, to_json, json.loads),
+        ("binary", binary_values, schema.encode, schema.decode),
+    ):
+        size = sum(len(value) for value in values) / len(values)
+        gzipped = batch_gzip_bytes(values, args.batch) / len(values)
+        print(f"{name:>7}: {size:7.1f} B/event  {gzipped:6.1f} B/event gzip  "
+              f"encode {rate(encode, messages):>9.0f}/s  decode {rate(decode, values):>9.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
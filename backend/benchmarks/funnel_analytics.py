@@ -0,0 +1,105 @@
+"""
+Throughput of the keyed funnel analytics (streaming/local_runner.py) at
+increasing parallelism, over a generated file of agent events shaped like
+the producer's messages. Also checks every parallelism counts the same
+steps and decisions per window (latency averages may differ in the last
+digit, as partial sums are added in a different order).
+
+    python -m benchmarks.funnel_analytics --sessions 20000 --parallelism 1,2,4
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from streaming import local_runner
+
+
+def session_events(rnd: random.Random, session_id: str, started_at: float) -> list:
+    """One session's events; sessions drop out of the funnel at random steps."""
+    t = started_at
+    events = []
+
+    def emit(event_type, function, result, args=None, duplicate=False):
+        nonlocal t
+        t += rnd.uniform(2, 40)
+        payload = {"event_id": os.urandom(8).hex(), "function": function, "args": args or {}}
+        if duplicate:
+            payload.update({"duplicate_of": os.urandom(8).hex(), "cache_age_ms": 12.5})
+        else:
+            payload.update({"result": result, "duration_ms": round(rnd.uniform(1, 200), 3)})
+        events.append({"event_type": event_type, "session_id": session_id, "payload": payload, "timestamp": t})
+
+    phone = f"9{rnd.randrange(10 ** 9):09d}"
+    emit("OTP_SEND", "send_otp", {"status": "SUCCESS", "message": "OTP sent"}, {"phone": phone})
+    if rnd.random() < 0.2:
+        return events
+    if rnd.random() < 0.1:
+        emit("OTP_VERIFY", "verify_otp", {"verified": False, "message": "Invalid or Expired OTP."}, {"phone": phone})
+    limit = rnd.choice([100000, 200000, 500000])
+    emit("OTP_VERIFY", "verify_otp", {"verified": True, "customer_id": "CUST001", "pre_approved_limit": limit,
+                                      "credit_score": rnd.randint(600, 850)}, {"phone": phone, "code": "123456"})
+    if rnd.random() < 0.3:
+        emit("OFFER_CHECK", "get_offer", None, {"customer_id": "CUST001"}, duplicate=True)
+    if rnd.random() < 0.25:
+        return events
+    emit("NEGOTIATION", "negotiate_loan", {"status": "APPROVED_BASE_RATE", "interest_rate": 12.0})
+    if rnd.random() < 0.3:
+        emit("UNDERWRITING", "evaluate_loan", {"decision": "REQUEST_SALARY_SLIP"})
+    decision = "APPROVE" if rnd.random() < 0.7 else "REJECT"
+    emit("UNDERWRITING", "evaluate_loan", {"decision": decision})
+    if decision == "APPROVE" and rnd.random() < 0.9:
+        emit("SANCTION_GENERATED", "generate_sanction", {"success": True, "document_url": "/documents/x"})
+    return events
+
+
+def write_events(path: str, sessions: int, seed: int) -> int:
+    rnd = random.Random(seed)
+    start = 1_700_000_000.0
+    events = []
+    for index in range(sessions):
+        events.extend(session_events(rnd, f"session_{index}", start + rnd.uniform(0, 3600)))
+    # Interleave sessions as the topic would, keeping each session's own order
+    events.sort(key=lambda event: event["timestamp"])
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+    return len(events)
+
+
+def counts(summaries: list) -> list:
+    return [(summary["window_start"], {step: row["count"] for step, row in summary["steps"].items()}, summary["decisions"])
+            for summary in summaries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--parallelism", default="1,2,4")
+    parser.add_argument("--window-seconds", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "events.ndjson")
+        total = write_events(path, args.sessions, args.seed)
+        print(f"{total} events from {args.sessions} sessions ({os.path.getsize(path) / 1e6:.1f} MB), {os.cpu_count()} CPUs")
+
+        baseline = None
+        for parallelism in (int(value) for value in args.parallelism.split(",")):
+            start = time.perf_counter()
+            events, summaries = local_runner.run(path, parallelism, args.window_seconds)
+            elapsed = time.perf_counter() - start
+            if baseline is None:
+                baseline = counts(summaries)
+                overall = {step: sum(summary["steps"].get(step, {}).get("count", 0) for summary in summaries)
+                           for step in local_runner.analytics.FUNNEL_STEPS}
+                print(f"funnel totals: {overall}")
+            same = "same" if counts(summaries) == baseline else "DIFFERENT"
+            print(f"parallelism {parallelism}: {events / elapsed:>9.0f} events/s  {len(summaries)} windows ({same} counts as parallelism 1)")
+
+
+if __name__ == "__main__":
+    main()
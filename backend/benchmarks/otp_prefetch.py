@@ -0,0 +1,54 @@
+"""
+Post-verification lookups: sequential offer then credit calls (the old flow,
+one LLM hop each) against the concurrent prefetch inside verify_otp.
+
+    MOCK_OFFER_LATENCY_MS=80 MOCK_CREDIT_LATENCY_MS=120 python -m benchmarks.otp_prefetch
+"""
+import argparse
+import statistics
+import time
+
+from agents.verify import prefetch_profile
+from mock_servers.credit import get_credit_score
+from mock_servers.offer import get_offer
+from mock_servers.crm import get_customers
+from mock_servers.latency import LATENCY_MS
+
+
+def timed_ms(func, customer_ids) -> list:
+    timings = []
+    for customer_id in customer_ids:
+        start = time.perf_counter()
+        func(customer_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def sequential(customer_id: str):
+    get_offer(customer_id)
+    get_credit_score(customer_id)
+
+
+def run(lookups: int, llm_hop_ms: float):
+    customer_ids = [customer["id"] for customer in get_customers()]
+    customer_ids = (customer_ids * (lookups // len(customer_ids) + 1))[:lookups]
+    print(f"mock latency (ms): {LATENCY_MS}")
+
+    for name, func in (("sequential", sequential), ("prefetched", prefetch_profile)):
+        timings = timed_ms(func, customer_ids)
+        print(f"{name:>10}: p50 {statistics.median(timings):.2f}ms  max {max(timings):.2f}ms")
+
+    if llm_hop_ms:
+        print(f"model hops saved per verified customer: 2 (~{2 * llm_hop_ms:.0f}ms at {llm_hop_ms:.0f}ms per hop)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=50)
+    parser.add_argument("--llm-hop-ms", type=float, default=0.0, help="Typical model round-trip, to report the hops saved")
+    args = parser.parse_args()
+    run(args.lookups, args.llm_hop_ms)
+
+
+if __name__ == "__main__":
+    main()
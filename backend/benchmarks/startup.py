@@ -0,0 +1,133 @@
+"""
+Backend cold start: fresh processes that import `app` and then run its
+lifespan startup (LLM client, event producer), with a `-X importtime`
+breakdown of each phase by top-level package.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --runs 5 --history startup_history.ndjson
+
+With --history, each run's medians are appended to an NDJSON file along with
+the commit, and compared against the previous entry.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+# Runs in the measured process; importtime lines go to stderr, split by the marker
+PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+print("--- lifespan ---", file=sys.stderr, flush=True)
+
+async def startup():
+    async with app.app.router.lifespan_context(app.app):
+        pass
+
+asyncio.run(startup())
+print(json.dumps({"import_ms": (imported - start) * 1000, "lifespan_ms": (time.perf_counter() - imported) * 1000}))
+"""
+
+
+def parse_importtime(lines: list) -> dict:
+    """Self time in milliseconds per top-level package, from `-X importtime` output."""
+    packages = defaultdict(float)
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1000
+    return packages
+
+
+def run_once(env: dict) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{proc.stderr[-2000:]}")
+    lines = proc.stderr.splitlines()
+    marker = lines.index("--- lifespan ---")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result.update(wall_ms=wall_ms, import_packages=parse_importtime(lines[:marker]),
+                  lifespan_packages=parse_importtime(lines[marker + 1:]))
+    return result
+
+
+def median_packages(runs: list, key: str, top: int) -> dict:
+    names = {name for run in runs for name in run[key]}
+    medians = {name: statistics.median(run[key].get(name, 0.0) for run in runs) for name in names}
+    return {name: round(ms, 1) for name, ms in sorted(medians.items(), key=lambda item: -item[1])[:top]}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Packages listed per phase")
+    parser.add_argument("--llm-backend", default="fake", help="LLM_BACKEND for the measured processes")
+    parser.add_argument("--history", help="Append the medians to this NDJSON file and compare with its last entry")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        env = {**os.environ, "LLM_BACKEND": args.llm_backend,
+               "SESSION_SPILL_DIR": os.path.join(scratch, "sessions"),
+               "DOCUMENT_STORE_DIR": os.path.join(scratch, "documents"),
+               "UPLOAD_DIR": os.path.join(scratch, "uploads"),
+               "KAFKA_SPOOL_FILE": os.path.join(scratch, "spool", "events.ndjson")}
+        run_once(env)  # warm the filesystem and bytecode caches
+        runs = [run_once(env) for _ in range(args.runs)]
+
+    record = {
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "lifespan_ms": round(statistics.median(run["lifespan_ms"] for run in runs), 1),
+        "wall_ms": round(statistics.median(run["wall_ms"] for run in runs), 1),
+        "import_packages": median_packages(runs, "import_packages", args.top),
+        "lifespan_packages": median_packages(runs, "lifespan_packages", args.top),
+    }
+
+    print(f"{args.runs} runs, median: import app {record['import_ms']:.1f}ms, "
+          f"lifespan startup {record['lifespan_ms']:.1f}ms, process {record['wall_ms']:.1f}ms")
+    for phase in ("import", "lifespan"):
+        print(f"  {phase} (self time by package):")
+        for name, ms in record[f"{phase}_packages"].items():
+            print(f"    {name:<24} {ms:8.1f}ms")
+
+    if args.history:
+        history = Path(args.history)
+        previous = None
+        if history.exists():
+            lines = [line for line in history.read_text().splitlines() if line.strip()]
+            previous = json.loads(lines[-1]) if lines else None
+        if previous:
+            for key in ("import_ms", "lifespan_ms", "wall_ms"):
+                print(f"  {key}: {previous[key]:.1f} -> {record[key]:.1f} ({record[key] - previous[key]:+.1f}) "
+                      f"since {previous.get('commit') or 'last run'}")
+        with open(history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Async load generator for the chat backend.
+
+Drives many concurrent sessions through the full loan conversation on /chat
+(greeting, phone, OTP, amount, tenure) and /upload/salary_slip, then reports
+throughput, how many sessions reached an underwriting decision, and
+p50/p95/p99 latency per endpoint.
+
+Without --base-url the app is served in-process with the offline fake LLM
+(LLM_BACKEND=fake), so no Gemini key, server or network is needed:
+
+    python load_test.py --sessions 2000 --concurrency 500 --llm-latency-ms 300
+
+Against a running server, start it with LLM_BACKEND=fake (or a real key) and a
+fixed OTP_DEV_CODE that matches --otp (with a real key, OTP_DEV_CODE also
+needs LOAD_TEST_MODE=1):
+
+    OTP_DEV_CODE=123456 LLM_BACKEND=fake uvicorn app:app --port 8000
+    python load_test.py --base-url http://localhost:8000 --otp 123456
+
+With --workers N, N separate server processes are started on one shared
+state backend (a SQLite file by default) and the load generator balances
+turns across them, round-robin or by the X-Session-Affinity hint:
+
+    python load_test.py --workers 4 --balance affinity --llm-latency-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+DATA_FILE = Path(__file__).parent / "data" / "customers.json"
+COMPLETED_STAGES = ("DECIDED", "SANCTIONED")
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint: str, elapsed_ms: float, ok: bool):
+        self.samples[endpoint].append(elapsed_ms)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, wall_seconds: float) -> dict:
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            report[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "throughput_rps": round(len(ordered) / wall_seconds, 1),
+                "p50_ms": round(statistics.median(ordered), 1),
+                "p95_ms": round(ordered[max(int(len(ordered) * 0.95) - 1, 0)], 1),
+                "p99_ms": round(ordered[max(int(len(ordered) * 0.99) - 1, 0)], 1),
+            }
+        return report
+
+
+async def timed(recorder: LatencyRecorder, endpoint: str, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code == 200 and "error" not in (response.json().get("metadata") or {})
+    except Exception as e:
+        print(f"{endpoint} failed: {e!r}")
+        response, ok = None, False
+    recorder.record(endpoint, (time.perf_counter() - start) * 1000, ok)
+    return response
+
+
+class Balancer:
+    """
+    Stands in for a load balancer in front of several servers. "round-robin"
+    spreads every request; "affinity" sends a session back to the worker
+    named in the X-Session-Affinity header of its last response.
+    """
+
+    def __init__(self, clients: list, mode: str = "round-robin"):
+        self.clients = clients
+        self.mode = mode
+        self._next = itertools.count()
+        self._affinity = {}  # {session_id: (client index, hint)}
+
+    async def post(self, session_id: str, path: str, **kwargs):
+        index, hint = self._affinity.get(session_id, (None, None)) if self.mode == "affinity" else (None, None)
+        if index is None:
+            index = next(self._next) % len(self.clients)
+        if hint:
+            kwargs["headers"] = {**kwargs.get("headers", {}), "X-Session-Affinity": hint}
+        response = await self.clients[index].post(path, **kwargs)
+        self._affinity[session_id] = (index, response.headers.get("x-session-affinity"))
+        return response
+
+
+def synthetic_customers(count: int) -> list:
+    """
+    The stock customers plus one per simulated session with a phone of its
+    own, so concurrent sessions never send or consume each other's OTPs.
+    """
+    with open(DATA_FILE, "r") as f:
+        base = json.load(f)
+    return base + [{**base[index % len(base)], "id": f"LOAD{index:07d}", "phone": f"8{index:09d}"} for index in range(count)]
+
+
+async def run_session(client: Balancer, recorder: LatencyRecorder, index: int, customer: dict,
+                      otp: str, upload_ratio: float, rnd: random.Random) -> str:
+    """Runs one conversation and returns the funnel stage it ended in."""
+    session_id = f"load_{index}_{int(time.time())}"
+    needs_slip = rnd.random() < upload_ratio
+    limit = customer["pre_approved_limit"]
+    # Customers without a pre-approved limit still ask for something, and are declined
+    amount = max(int(limit * 1.5) if needs_slip else int(limit * 0.5), 10000)
+
+    stage = None
+
+    async def chat(message: str):
+        nonlocal stage
+        response = await timed(recorder, "/chat", client.post(session_id, "/chat", json={
+            "session_id": session_id, "user_id": f"load_user_{index}", "message": message
+        }))
+        if response is not None and response.status_code == 200:
+            stage = (response.json().get("metadata") or {}).get("stage", stage)
+
+    await chat("Hi, I am interested in a personal loan.")
+    await chat(f"My phone number is {customer['phone']}")
+    await chat(otp)
+    await chat(f"I need {amount} rupees.")
+    await chat("For 24 months.")
+    if needs_slip:
+        salary = int(amount / 10)
+        files = {"file": (f"salary_{salary}.pdf", b"%PDF-1.4 load test salary slip", "application/pdf")}
+        response = await timed(recorder, "/upload/salary_slip", client.post(
+            session_id, "/upload/salary_slip", files=files, data={"session_id": session_id}
+        ))
+        if response is not None and response.status_code == 200:
+            stage = response.json().get("stage", stage)
+    if stage == "AWAITING_CONFIRMATION":
+        await chat("Yes, please go ahead.")
+    return stage
+
+
+async def run(args):
+    with open(args.customers, "r") as f:
+        customers = json.load(f)
+    # Sessions sharing a phone would race for its OTP, so they take turns
+    phone_locks = defaultdict(asyncio.Lock)
+    stages = defaultdict(int)
+    if args.unique_phones:
+        # The last `sessions` customers were generated one per session
+        customers = customers[-args.sessions:]
+    rnd = random.Random(args.seed)
+    recorder = LatencyRecorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    if args.base_urls:
+        clients = [httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) for url in args.base_urls]
+    else:
+        import app
+        transport = httpx.ASGITransport(app=app.app)
+        clients = [httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout, limits=limits)]
+    balancer = Balancer(clients, args.balance)
+
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(index):
+        customer = customers[index] if args.unique_phones else rnd.choice(customers)
+        async with slots, phone_locks[customer["phone"]]:
+            stage = await run_session(balancer, recorder, index, customer, args.otp, args.upload_ratio, rnd)
+        stages[stage or "NONE"] += 1
+
+    try:
+        # Same checks the old verify script made before the conversation
+        for path in ["/mock/crm/customer/9876543210", "/mock/offer/CUST001", "/mock/credit/CUST001"]:
+            await timed(recorder, "/mock", clients[0].get(path))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(args.sessions)))
+        wall_seconds = time.perf_counter() - start
+
+        if len(clients) > 1:
+            for client in clients:
+                stats = (await client.get("/sessions/stats")).json()
+                print(f"worker {stats['worker_id']}: reloads={stats['reloads']} lock_waits={stats['lock_waits']} "
+                      f"affinity_hits={stats['affinity_hits']} affinity_misses={stats['affinity_misses']}")
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    workers = f", {len(clients)} workers ({args.balance})" if len(clients) > 1 else ""
+    # Every scripted conversation should end with an underwriting decision (and a letter if approved)
+    completed = sum(count for stage, count in stages.items() if stage in COMPLETED_STAGES)
+    print(f"{args.sessions} sessions, concurrency {args.concurrency}{workers}, {wall_seconds:.2f}s wall, "
+          f"{args.sessions / wall_seconds:.1f} sessions/s, {completed}/{args.sessions} reached a decision "
+          f"({', '.join(f'{stage} {count}' for stage, count in sorted(stages.items()))})")
+    report = recorder.report(wall_seconds)
+    for endpoint, row in report.items():
+        print(
+            f"{endpoint:<22} n={row['requests']:<7} err={row['errors']:<5} {row['throughput_rps']:>8} req/s  "
+            f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"sessions": args.sessions, "concurrency": args.concurrency, "workers": len(clients),
+                       "wall_seconds": wall_seconds, "completed_sessions": completed, "stages": dict(stages),
+                       "endpoints": report}, f, indent=2)
+    return report
+
+
+def start_workers(count: int, base_port: int, log_dir: str) -> list:
+    """Starts `count` single-process servers with the environment set up in main()."""
+    processes = []
+    for index in range(count):
+        log = open(os.path.join(log_dir, f"worker_{index}.log"), "w")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(base_port + index), "--log-level", "warning"],
+            cwd=Path(__file__).parent, env={**os.environ, "WORKER_ID": f"worker-{index}"}, stdout=log, stderr=subprocess.STDOUT
+        ))
+    urls = [f"http://127.0.0.1:{base_port + index}" for index in range(count)]
+    deadline = time.time() + 60
+    for url, process in zip(urls, processes):
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker at {url} exited; see {log_dir}")
+            try:
+                if httpx.get(f"{url}/ready", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"Worker at {url} did not start; see {log_dir}")
+            time.sleep(0.2)
+    return processes, urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", action="append", dest="base_urls",
+                        help="Server to load (repeat for several); omit to serve the app in-process with the fake LLM")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Start this many server processes sharing --state-backend and balance across them")
+    parser.add_argument("--balance", choices=["round-robin", "affinity"], default="round-robin")
+    parser.add_argument("--state-backend", help="STATE_BACKEND_URL for --workers (default: a SQLite file in the scratch dir)")
+    parser.add_argument("--base-port", type=int, default=8100)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--otp", default="123456", help="Must match the server's OTP_DEV_CODE")
+    parser.add_argument("--upload-ratio", type=float, default=0.3,
+                        help="Share of sessions asking above their limit and uploading a salary slip")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Fake LLM latency per round-trip (in-process or --workers)")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0,
+                        help="Share of fake LLM calls failing with a 429 (in-process or --workers)")
+    parser.add_argument("--mock-latency-ms", type=float, default=0.0,
+                        help="Artificial latency of each CRM, offer and credit lookup (in-process or --workers)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    args.customers, args.unique_phones = DATA_FILE, False
+    if not args.base_urls:
+        # Must be set before the app (and its singletons) are imported
+        scratch = tempfile.mkdtemp(prefix="loadtest_")
+        args.customers, args.unique_phones = os.path.join(scratch, "customers.json"), True
+        with open(args.customers, "w") as f:
+            json.dump(synthetic_customers(args.sessions), f)
+        os.environ.setdefault("CUSTOMER_STORE_PATH", args.customers)
+        os.environ.setdefault("LLM_BACKEND", "fake")
+        os.environ.setdefault("OTP_DEV_CODE", args.otp)
+        os.environ.setdefault("LOAD_TEST_MODE", "1")
+        # Many simulated sessions share each customer's phone
+        os.environ.setdefault("OTP_SEND_BURST", str(args.sessions))
+        os.environ.setdefault("FAKE_LLM_LATENCY_MS", str(args.llm_latency_ms))
+        os.environ.setdefault("FAKE_LLM_JITTER_MS", str(args.llm_jitter_ms))
+        os.environ.setdefault("FAKE_LLM_RATE_LIMIT_RATE", str(args.llm_rate_limit_rate))
+        for service in ("CRM", "OFFER", "CREDIT"):
+            os.environ.setdefault(f"MOCK_{service}_LATENCY_MS", str(args.mock_latency_ms))
+        os.environ.setdefault("SESSION_SPILL_DIR", os.path.join(scratch, "sessions"))
+        os.environ.setdefault("DOCUMENT_STORE_DIR", os.path.join(scratch, "documents"))
+        os.environ.setdefault("UPLOAD_DIR", os.path.join(scratch, "uploads"))
+        os.environ.setdefault("KAFKA_SPOOL_FILE", os.path.join(scratch, "spool", "events.ndjson"))
+
+    processes = []
+    if args.workers and not args.base_urls:
+        os.environ.setdefault("STATE_BACKEND_URL", args.state_backend or f"sqlite:///{os.path.join(scratch, 'state.db')}")
+        processes, args.base_urls = start_workers(args.workers, args.base_port, scratch)
+    try:
+        asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Offline stand-in for the `google.genai` client used by ChatSession.
+
+The fake chat answers from a script instead of calling Gemini. It invokes the
+configured tool functions the same way automatic function calling does and
+keeps a history of `types.Content`, so sessions can be spilled and restored.
+
+A script is JSON in one of two shapes:
+
+    {"rules": [{"match": "regex", "calls": [...], "reply": "..."}], "fallback": "..."}
+        The first rule whose regex matches the user message is used. Call
+        arguments and replies are `str.format` templates over the regex groups
+        ({0}, {1}, ...), the tool results (`results`, in call order) and
+        `context` (values extracted from earlier tool results in this chat).
+
+    {"turns": [{"user": "...", "calls": [...], "reply": "..."}]}
+        A recorded conversation replayed in order, one turn per message.
+
+Rules may also list context keys they require or must not have ("requires",
+"unless"), values to remember from the match ("remember"), follow-up calls
+("then", "then_if_approved") and alternative replies ("reply_on_failure",
+"reply_if_approved").
+
+Each call is {"name": "<tool function name>", "args": {...}}.
+`record_turns` builds the second shape from a session snapshot's history.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+import typing
+
+from google.genai import types
+
+from master import history as chat_history
+
+FAKE_LLM_SCRIPT = os.getenv("FAKE_LLM_SCRIPT")
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "0"))
+# Share of model calls that fail with a quota error, to exercise the scheduler's backoff
+FAKE_LLM_RATE_LIMIT_RATE = float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0"))
+
+UNDERWRITING_ARGS = {
+    "credit_score": "{context[credit_score]}",
+    "requested_amount": "{context[requested_amount]}",
+    "pre_approved_limit": "{context[pre_approved_limit]}",
+    "monthly_salary": "{context[salary]}"
+}
+SANCTION_CALL = {
+    "name": "generate_sanction",
+    "args": {
+        "customer_name": "{context[customer_name]}",
+        "amount": "{context[requested_amount]}",
+        "tenure_months": "{context[tenure_months]}",
+        "interest_rate": "{context[interest_rate]}"
+    }
+}
+APPROVED_REPLY = (
+    "Congratulations, your loan is approved! Your EMI is INR {context[emi]}. "
+    "Download your sanction letter here: {context[document_url]}"
+)
+
+# Follows the process in SYSTEM_INSTRUCTION closely enough to drive the full funnel
+DEFAULT_SCRIPT = {
+    "rules": [
+        {
+            "match": r"(?<!\d)(\d{10})(?!\d)",
+            "unless": ["customer_id"],
+            "calls": [{"name": "send_otp", "args": {"phone": "{1}"}}],
+            "reply": "{results[0][message]}"
+        },
+        {
+            "match": r"(?<!\d)(\d{6})(?!\d)",
+            "requires": ["phone"],
+            "unless": ["customer_id"],
+            "calls": [{"name": "verify_otp", "args": {"phone": "{context[phone]}", "code": "{1}"}}],
+            "reply": "You're verified, {context[customer_name]}! Your pre-approved limit is INR {context[pre_approved_limit]}. How much would you like to borrow?",
+            "reply_on_failure": "That OTP didn't work. Please try again."
+        },
+        {
+            "match": r"(?i)uploaded salary slip\. Extracted Salary: ([\d.]+)",
+            "requires": ["requested_amount"],
+            "calls": [{"name": "evaluate_loan", "args": UNDERWRITING_ARGS | {"monthly_salary": "{1}"}}],
+            "then_if_approved": [SANCTION_CALL],
+            "reply": "Thanks for the salary slip. Decision: {results[0][decision]} ({results[0][reason]})",
+            "reply_if_approved": APPROVED_REPLY
+        },
+        {
+            "match": r"(?i)(\d+)\s*months?",
+            "requires": ["requested_amount"],
+            "remember": {"tenure_months": "{1}"},
+            "calls": [{"name": "evaluate_loan", "args": UNDERWRITING_ARGS}],
+            "then_if_approved": [SANCTION_CALL],
+            "reply": "Decision: {results[0][decision]} ({results[0][reason]})",
+            "reply_if_approved": APPROVED_REPLY
+        },
+        {
+            "match": r"(?i)(?:rs\.?|inr)?\s*(\d{4,}(?:\.\d+)?)",
+            "requires": ["customer_id"],
+            "remember": {"requested_amount": "{1}"},
+            "calls": [{
+                "name": "negotiate_loan",
+                "args": {"requested_amount": "{1}", "pre_approved_limit": "{context[pre_approved_limit]}"}
+            }],
+            "reply": "{results[0][message]} For how many months would you like the loan?"
+        }
+    ],
+    "fallback": "Hello! I can help you with a personal loan. Could you share your registered phone number?"
+}
+
+# Tool results whose fields are remembered in the chat context for later templates
+CONTEXT_FIELDS = [
+    "customer_id", "customer_name", "pre_approved_limit", "credit_score",
+    "interest_rate", "decision", "emi", "document_url"
+]
+
+# Values otherwise taken from tool arguments, recovered from a history summary
+SUMMARY_FIELDS = ["phone", "requested_amount", "salary", "tenure_months"]
+
+
+class _SafeDict(dict):
+    def __missing__(self, key):
+        return 0
+
+
+class FakeRateLimitError(Exception):
+    """Looks like the SDK's APIError for an HTTP 429."""
+    code = 429
+    status = "RESOURCE_EXHAUSTED"
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int = 0, output_tokens: int = 0):
+        self.text = text
+        self.usage_metadata = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens
+        )
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+def _coerce(value: str, annotation):
+    # Templates always render to strings; convert to the tool's declared parameter type
+    if annotation in (int, float):
+        return annotation(float(value))
+    return value
+
+
+class FakeChat:
+    def __init__(self, client, config=None, history=None):
+        self.client = client
+        self.tools = {tool.__name__: tool for tool in (getattr(config, "tools", None) or []) if callable(tool)}
+        self.history = list(history or [])
+        self.context = _SafeDict()
+        self.turn = 0
+        self._rebuild_context()
+
+    def _rebuild_context(self):
+        # A restored session brings its history but not the context derived from it
+        for content in self.history:
+            for part in content.parts or []:
+                if part.function_call:
+                    self._absorb_args(part.function_call.name, part.function_call.args or {})
+                elif part.function_response:
+                    self._absorb_result((part.function_response.response or {}).get("result"))
+            if content.role == "user" and any(part.text for part in content.parts or []):
+                self.turn += 1
+                # A compacted history carries older facts only in its summary line
+                for part in content.parts:
+                    for key, value in chat_history.parse_summary(part.text).items():
+                        if key in CONTEXT_FIELDS or key in SUMMARY_FIELDS:
+                            self.context[key] = value
+                    # Values a rule remembered without passing them to a tool, e.g. a declined loan's tenure
+                    if part.text and "turns" not in self.client.script:
+                        matched = self._match_rule(part.text)
+                        if matched:
+                            self._remember(*matched, [])
+
+    def _absorb_args(self, name: str, args: dict):
+        if name == "send_otp":
+            self.context["phone"] = args.get("phone")
+        elif name == "negotiate_loan":
+            self.context["requested_amount"] = args.get("requested_amount")
+        elif name == "evaluate_loan":
+            self.context["salary"] = args.get("monthly_salary", 0)
+        elif name == "generate_sanction":
+            self.context["tenure_months"] = args.get("tenure_months")
+
+    def _absorb_result(self, result):
+        if isinstance(result, dict):
+            for field in CONTEXT_FIELDS:
+                if field in result:
+                    self.context[field] = result[field]
+
+    def get_history(self, curated: bool = False):
+        return list(self.history)
+
+    def _call(self, name: str, args: dict):
+        self.history.append(types.Content(role="model", parts=[
+            types.Part(function_call=types.FunctionCall(name=name, args=args))
+        ]))
+        self._absorb_args(name, args)
+        result = self.tools[name](**args)
+        self.history.append(types.Content(role="user", parts=[
+            types.Part(function_response=types.FunctionResponse(name=name, response={"result": result}))
+        ]))
+        self._absorb_result(result)
+        return result
+
+    def _render(self, template: str, groups, results) -> str:
+        return template.format(*groups, results=results, context=self.context)
+
+    def _match_rule(self, message: str):
+        text = message.replace(",", "")
+        for rule in self.client.script.get("rules", []):
+            if any(key not in self.context for key in rule.get("requires", [])):
+                continue
+            if any(key in self.context for key in rule.get("unless", [])):
+                continue
+            match = re.search(rule["match"], text)
+            if match:
+                return rule, [match.group(0), *match.groups()]
+        return None
+
+    def _remember(self, rule: dict, groups, results):
+        for key, template in rule.get("remember", {}).items():
+            self.context[key] = self._render(template, groups, results)
+
+    def _run_calls(self, calls, groups, results):
+        for call in calls:
+            hints = typing.get_type_hints(self.tools[call["name"]])
+            args = {
+                key: _coerce(self._render(value, groups, results), hints.get(key)) if isinstance(value, str) else value
+                for key, value in call.get("args", {}).items()
+            }
+            results.append(self._call(call["name"], args))
+
+    def _respond(self, message: str) -> str:
+        script = self.client.script
+        results = []
+
+        if "turns" in script:
+            turns = script["turns"]
+            turn = turns[min(self.turn, len(turns) - 1)] if turns else {"reply": ""}
+            self.turn += 1
+            for call in turn.get("calls", []):
+                results.append(self._call(call["name"], call.get("args", {})))
+            return turn.get("reply", "")
+
+        matched = self._match_rule(message)
+        if not matched:
+            return script.get("fallback", "")
+        rule, groups = matched
+        self._remember(rule, groups, results)
+        self._run_calls(rule.get("calls", []), groups, results)
+
+        first = results[0] if results else {}
+        if first.get("verified") is False or first.get("status") == "FAILED":
+            return self._render(rule.get("reply_on_failure", rule["reply"]), groups, results)
+        self._run_calls(rule.get("then", []), groups, results)
+        if first.get("decision") == "APPROVE" and rule.get("then_if_approved"):
+            self._run_calls(rule["then_if_approved"], groups, results)
+            return self._render(rule.get("reply_if_approved", rule["reply"]), groups, results)
+        return self._render(rule["reply"], groups, results)
+
+    def send_message(self, message):
+        message = str(message)
+        self.client.simulate_latency()
+        self.client.simulate_rate_limit()
+        prompt_tokens = sum(_estimate_tokens(str(content.parts)) for content in self.history) + _estimate_tokens(message)
+
+        self.history.append(types.Content(role="user", parts=[types.Part(text=message)]))
+        reply = self._respond(message)
+        self.history.append(types.Content(role="model", parts=[types.Part(text=reply)]))
+        return FakeResponse(reply, prompt_tokens, _estimate_tokens(reply))
+
+    def send_message_stream(self, message):
+        response = self.send_message(message)
+        for word in re.findall(r"\S+\s*", response.text):
+            yield FakeResponse(word)
+
+
+class _FakeChats:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model=None, config=None, history=None):
+        return FakeChat(self.client, config=config, history=history)
+
+
+class FakeClient:
+    """
+    Drop-in for `genai.Client` as far as ChatSession is concerned.
+    `latency_ms` (plus up to `jitter_ms`) is slept before every model round-trip,
+    and `rate_limit_rate` of the round-trips then fail with a 429.
+    """
+
+    def __init__(self, script: dict = None, latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_limit_rate: float = 0.0):
+        self.script = script or DEFAULT_SCRIPT
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_rate = rate_limit_rate
+        self.chats = _FakeChats(self)
+        self._random = random.Random()
+        self._random_lock = threading.Lock()
+
+    def simulate_latency(self):
+        delay_ms = self.latency_ms
+        if self.jitter_ms:
+            with self._random_lock:
+                delay_ms += self._random.uniform(0, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def simulate_rate_limit(self):
+        if not self.rate_limit_rate:
+            return
+        with self._random_lock:
+            limited = self._random.random() < self.rate_limit_rate
+        if limited:
+            raise FakeRateLimitError("429 RESOURCE_EXHAUSTED. Resource has been exhausted (e.g. check quota).")
+
+    @classmethod
+    def from_env(cls):
+        script = None
+        if FAKE_LLM_SCRIPT:
+            with open(FAKE_LLM_SCRIPT, "r") as f:
+                script = json.load(f)
+            if "history" in script:
+                # A spilled session snapshot: replay its conversation
+                script = {"turns": record_turns(script["history"])}
+        return cls(script=script, latency_ms=FAKE_LLM_LATENCY_MS, jitter_ms=FAKE_LLM_JITTER_MS,
+                   rate_limit_rate=FAKE_LLM_RATE_LIMIT_RATE)
+
+
+def record_turns(history: list) -> list:
+    """
+    Converts a chat history (dumped `types.Content` dicts) into replayable turns.
+    """
+    turns = []
+    for content in history:
+        parts = content.get("parts", [])
+        if content.get("role") == "user":
+            text = "".join(part.get("text", "") for part in parts)
+            if text:
+                turns.append({"user": text, "calls": [], "reply": ""})
+        elif turns:
+            for part in parts:
+                if "function_call" in part:
+                    call = part["function_call"]
+                    turns[-1]["calls"].append({"name": call["name"], "args": call.get("args", {})})
+                elif part.get("text"):
+                    turns[-1]["reply"] += part["text"]
+    return turns
@@ -0,0 +1,239 @@
+import re
+from typing import Optional
+
+# Funnel stages, in order. The stage is derived from the facts in `customer_data`.
+STAGE_START = "START"
+STAGE_OTP_SENT = "OTP_SENT"
+STAGE_VERIFIED = "VERIFIED"
+STAGE_AMOUNT = "AMOUNT_AGREED"
+STAGE_SALARY_SLIP = "AWAITING_SALARY_SLIP"
+STAGE_DECIDED = "DECIDED"
+# Approved, waiting for the customer to confirm the final terms before the letter is issued
+STAGE_CONFIRMING = "AWAITING_CONFIRMATION"
+STAGE_SANCTIONED = "SANCTIONED"
+
+SALARY_UPLOAD_MESSAGE = "[SYSTEM: User uploaded salary slip]"
+
+PHONE_PATTERN = re.compile(
+    r"^(?:(?:my\s+)?(?:phone|mobile)(?:\s+(?:number|no\.?))?(?:\s+is)?[:\s]*)?(?:\+?91[\s-]?)?(\d{10})\.?$",
+    re.IGNORECASE
+)
+OTP_PATTERN = re.compile(r"^(?:(?:the\s+)?(?:otp|code)(?:\s+is)?[:\s]*)?(\d{6})\.?$", re.IGNORECASE)
+AMOUNT_PATTERN = re.compile(
+    r"^(?:i\s+(?:need|want)\s+)?(?:rs\.?|inr|₹)?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|lakhs?|lacs?|l)?\s*(?:rupees|rs\.?|inr)?\.?$",
+    re.IGNORECASE
+)
+TENURE_PATTERN = re.compile(r"^(?:for\s+)?(\d{1,3})\s*(months?|mos?|years?|yrs?)\.?$", re.IGNORECASE)
+# Only an unqualified yes; anything else ("yes, but...", "no", "with the schedule") goes to the LLM
+CONFIRM_PATTERN = re.compile(
+    r"^(?:yes|yeah|yep|sure|ok(?:ay)?|confirm(?:ed)?|go ahead|proceed)"
+    r"(?:[\s,]+(?:please|go ahead|proceed|confirm(?:ed)?|thanks?|thank you))*[.!]?$",
+    re.IGNORECASE
+)
+
+AMOUNT_MULTIPLIERS = {"k": 1_000, "l": 100_000, "lac": 100_000, "lacs": 100_000, "lakh": 100_000, "lakhs": 100_000}
+
+
+def stage(customer_data: dict) -> str:
+    if customer_data.get("document_url"):
+        return STAGE_SANCTIONED
+    if customer_data.get("decision") == "REQUEST_SALARY_SLIP":
+        return STAGE_SALARY_SLIP
+    if customer_data.get("decision") == "APPROVE":
+        return STAGE_CONFIRMING
+    if customer_data.get("decision"):
+        return STAGE_DECIDED
+    if customer_data.get("requested_amount") and customer_data.get("interest_rate"):
+        return STAGE_AMOUNT
+    if customer_data.get("verified"):
+        return STAGE_VERIFIED
+    if customer_data.get("otp_sent"):
+        return STAGE_OTP_SENT
+    return STAGE_START
+
+
+def update_from_tool(customer_data: dict, name: str, arguments: dict, result) -> None:
+    """
+    Records the facts a tool call establishes, whichever path (LLM or fast path) made it.
+    """
+    if not isinstance(result, dict):
+        return
+
+    if name == "send_otp":
+        customer_data["phone"] = arguments.get("phone")
+        customer_data["otp_sent"] = result.get("status") == "SUCCESS"
+    elif name == "verify_otp" and result.get("verified"):
+        customer_data["phone"] = arguments.get("phone")
+        customer_data["verified"] = True
+        customer_data["customer_id"] = result.get("customer_id")
+        customer_data["customer_name"] = result.get("customer_name")
+        # Offer and credit data prefetched during verification
+        if result.get("pre_approved_limit") is not None:
+            customer_data["pre_approved_limit"] = result["pre_approved_limit"]
+        if result.get("credit_score") is not None:
+            customer_data["credit_score"] = result["credit_score"]
+    elif name == "get_offer" and "error" not in result:
+        customer_data["pre_approved_limit"] = result.get("pre_approved_limit")
+    elif name == "get_credit_score" and "error" not in result:
+        customer_data["credit_score"] = result.get("credit_score")
+    elif name == "negotiate_loan":
+        # New terms supersede any earlier decision
+        customer_data.pop("decision", None)
+        customer_data.pop("decision_reason", None)
+        customer_data["requested_amount"] = arguments.get("requested_amount")
+        customer_data["interest_rate"] = result.get("interest_rate")
+    elif name == "evaluate_loan":
+        customer_data["requested_amount"] = arguments.get("requested_amount")
+        customer_data["decision"] = result.get("decision")
+        customer_data["decision_reason"] = result.get("reason")
+    elif name == "generate_sanction" and result.get("success"):
+        customer_data["tenure_months"] = arguments.get("tenure_months")
+        customer_data["emi"] = result.get("emi")
+        customer_data["document_url"] = result.get("document_url")
+
+
+def describe(customer_data: dict) -> str:
+    """One-line summary of the funnel facts, for handing context to the LLM."""
+    keys = [
+        "phone", "verified", "customer_id", "customer_name", "pre_approved_limit", "credit_score",
+        "requested_amount", "interest_rate", "tenure_months", "salary", "decision", "emi", "document_url"
+    ]
+    facts = [f"{key}={customer_data[key]}" for key in keys if customer_data.get(key) not in (None, "", False)]
+    return f"stage={stage(customer_data)}" + (", " + ", ".join(facts) if facts else "")
+
+
+def parse_amount(text: str) -> Optional[float]:
+    match = AMOUNT_PATTERN.match(text)
+    if not match:
+        return None
+    amount = float(match.group(1).replace(",", ""))
+    if match.group(2):
+        amount *= AMOUNT_MULTIPLIERS[match.group(2).lower()]
+    return amount if amount > 0 else None
+
+
+def parse_tenure(text: str) -> Optional[int]:
+    match = TENURE_PATTERN.match(text)
+    if not match:
+        return None
+    months = int(match.group(1))
+    if match.group(2).lower().startswith("y"):
+        months *= 12
+    return months if months > 0 else None
+
+
+class FunnelEngine:
+    """
+    Serves structured turns (phone number, OTP, amount, tenure, salary slip upload)
+    by calling the worker agents directly. `handle` returns None for anything it does
+    not recognise, and the caller falls back to the LLM.
+
+    `tools` maps tool names to the (event-wrapped) tool functions.
+    """
+
+    def __init__(self, tools: dict):
+        self.tools = tools
+
+    def handle(self, customer_data: dict, message: str) -> Optional[str]:
+        text = message.strip()
+        current = stage(customer_data)
+
+        if current in (STAGE_START, STAGE_OTP_SENT):
+            match = OTP_PATTERN.match(text)
+            if match and current == STAGE_OTP_SENT:
+                return self._verify(customer_data, match.group(1))
+            match = PHONE_PATTERN.match(text)
+            if match:
+                return self._send_otp(match.group(1))
+        elif current == STAGE_CONFIRMING and CONFIRM_PATTERN.match(text):
+            return self._sanction(customer_data)
+        elif current in (STAGE_VERIFIED, STAGE_CONFIRMING) or (current == STAGE_DECIDED and customer_data.get("decision") == "REJECT"):
+            # While confirming, a new amount renegotiates instead
+            amount = parse_amount(text)
+            if amount is not None and customer_data.get("pre_approved_limit") is not None:
+                return self._negotiate(customer_data, amount)
+        elif current == STAGE_AMOUNT:
+            tenure = parse_tenure(text)
+            if tenure is not None and customer_data.get("credit_score") is not None:
+                customer_data["tenure_months"] = tenure
+                return self._underwrite(customer_data)
+        elif current == STAGE_SALARY_SLIP:
+            if text == SALARY_UPLOAD_MESSAGE and customer_data.get("salary") and customer_data.get("tenure_months"):
+                return self._underwrite(customer_data)
+        return None
+
+    def _send_otp(self, phone: str) -> str:
+        result = self.tools["send_otp"](phone=phone)
+        if "retry_after_seconds" in result:
+            return result["message"]
+        if result.get("status") != "SUCCESS":
+            return "I couldn't find that phone number in our records. Could you please double-check it?"
+        return f"I've sent a 6-digit OTP to {phone}. Please enter it here to continue."
+
+    def _verify(self, customer_data: dict, code: str) -> str:
+        result = self.tools["verify_otp"](phone=customer_data["phone"], code=code)
+        if "retry_after_seconds" in result:
+            return result["message"]
+        if not result.get("verified"):
+            return "That OTP is invalid or has expired. Please check the code and try again."
+
+        customer_id = result["customer_id"]
+        if customer_data.get("pre_approved_limit") is None:
+            self.tools["get_offer"](customer_id=customer_id)
+        if customer_data.get("credit_score") is None:
+            self.tools["get_credit_score"](customer_id=customer_id)
+        limit = customer_data.get("pre_approved_limit")
+        if limit is None:
+            return f"Thank you, {result['customer_name']}, you're verified! How much would you like to borrow?"
+        return (
+            f"Thank you, {result['customer_name']}, you're verified! Great news: you have a pre-approved "
+            f"personal loan limit of INR {limit:,.0f}. How much would you like to borrow?"
+        )
+
+    def _negotiate(self, customer_data: dict, amount: float) -> str:
+        result = self.tools["negotiate_loan"](
+            requested_amount=amount, pre_approved_limit=customer_data["pre_approved_limit"]
+        )
+        return f"{result['message']} For how many months would you like the loan?"
+
+    def _underwrite(self, customer_data: dict) -> str:
+        result = self.tools["evaluate_loan"](
+            credit_score=customer_data["credit_score"],
+            requested_amount=customer_data["requested_amount"],
+            pre_approved_limit=customer_data["pre_approved_limit"],
+            monthly_salary=customer_data.get("salary") or 0.0
+        )
+        decision = result.get("decision")
+        if decision == "REQUEST_SALARY_SLIP":
+            return (
+                "Since this amount is above your pre-approved limit, I'll need a quick look at your latest "
+                "salary slip. Please upload it and I'll take it from there."
+            )
+        if decision != "APPROVE":
+            return (
+                f"I'm sorry, we're unable to approve this application ({result.get('reason')}). "
+                "You may be eligible for a smaller amount. Would you like to try one?"
+            )
+
+        # Step 9 of the system instruction: the customer confirms before the letter is issued
+        return (
+            f"Good news! Your loan of INR {customer_data['requested_amount']:,.0f} for "
+            f"{customer_data['tenure_months']} months at {customer_data['interest_rate']}% p.a. is approved. "
+            "Shall I go ahead and issue your sanction letter?"
+        )
+
+    def _sanction(self, customer_data: dict) -> str:
+        sanction = self.tools["generate_sanction"](
+            customer_name=customer_data.get("customer_name") or "Customer",
+            amount=customer_data["requested_amount"],
+            tenure_months=customer_data["tenure_months"],
+            interest_rate=customer_data["interest_rate"]
+        )
+        if not sanction.get("success"):
+            return None
+        return (
+            f"Congratulations! Your loan of INR {customer_data['requested_amount']:,.0f} for "
+            f"{customer_data['tenure_months']} months at {customer_data['interest_rate']}% p.a. is sanctioned. "
+            f"Your monthly EMI is INR {sanction['emi']:,.2f}. "
+            f"You can download your sanction letter here: {sanction['document_url']}"
+        )
@@ -0,0 +1,62 @@
+"""
+Bounds the chat history resent with every model call.
+
+The last HISTORY_MAX_TURNS user turns (with their tool calls and replies) are
+kept verbatim. Everything older is dropped and replaced by a one-line summary
+of the funnel state, prepended to the first retained user turn.
+"""
+import os
+import re
+
+from master import funnel
+
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "6"))
+# Compaction only runs once this many extra turns have built up, so the prompt
+# prefix (and any provider-side prefix caching) stays stable between compactions
+HISTORY_COMPACT_SLACK = int(os.getenv("HISTORY_COMPACT_SLACK", "4"))
+
+SUMMARY_PREFIX = "[SYSTEM: Earlier conversation summarized. "
+SUMMARY_PATTERN = re.compile(r"^\[SYSTEM: Earlier conversation summarized\. (.*?)\]$", re.MULTILINE)
+
+
+def is_user_turn(content) -> bool:
+    """True for a user message, as opposed to a tool result sent back on the user's behalf."""
+    parts = content.parts or []
+    return content.role == "user" and any(part.text for part in parts) and not any(part.function_response for part in parts)
+
+
+def summary_text(customer_data: dict) -> str:
+    return f"{SUMMARY_PREFIX}{funnel.describe(customer_data)}]"
+
+
+def parse_summary(text: str) -> dict:
+    """Facts from a summary line, as {key: value string}; empty if `text` has none."""
+    match = SUMMARY_PATTERN.search(text or "")
+    if not match:
+        return {}
+    facts = {}
+    for pair in match.group(1).split(", "):
+        key, _, value = pair.partition("=")
+        if value:
+            facts[key] = value
+    return facts
+
+
+def compact(history: list, customer_data: dict, max_turns: int = HISTORY_MAX_TURNS,
+            slack: int = HISTORY_COMPACT_SLACK):
+    """
+    Returns the compacted history, or None when it is still within
+    `max_turns + slack` user turns and should be left untouched.
+    """
+    starts = [index for index, content in enumerate(history) if is_user_turn(content)]
+    if len(starts) <= max_turns + slack:
+        return None
+
+    from google.genai import types
+
+    kept = [content.model_copy(deep=True) for content in history[starts[-max_turns]:]]
+    first = kept[0]
+    # An older summary may still sit on this turn if max_turns changed between runs
+    parts = [part for part in first.parts if not (part.text or "").startswith(SUMMARY_PREFIX)]
+    first.parts = [types.Part(text=summary_text(customer_data))] + parts
+    return kept
@@ -0,0 +1,254 @@
+"""
+Admission control for model calls.
+
+Every Gemini round-trip asks the scheduler for a slot first. A call is
+admitted while fewer than LLM_MAX_IN_FLIGHT calls are running and the
+tokens-per-minute bucket covers its estimated size. Waiting calls are admitted
+by priority, which comes from the session's funnel stage, so customers who
+are about to convert are not stuck behind fresh greetings. A waiting call
+slowly gains priority as it waits, so nothing starves.
+
+A rate-limit error (HTTP 429 / RESOURCE_EXHAUSTED) holds back every new
+admission for a jittered, exponentially growing delay, then the call is
+queued again. Calls that cannot be admitted within LLM_QUEUE_TIMEOUT_SECONDS,
+or that are still rate limited after LLM_MAX_RETRIES, raise LLMBusy.
+"""
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+from master import funnel
+from utils.metrics import counter, gauge, histogram
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+# Input plus output tokens per minute across this process; 0 disables the budget
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+# Charged for a session's first call, before its real size is known
+LLM_TOKEN_ESTIMATE = int(os.getenv("LLM_TOKEN_ESTIMATE", "2000"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+# A waiting call moves up one priority level per this many seconds
+LLM_PRIORITY_AGING_SECONDS = float(os.getenv("LLM_PRIORITY_AGING_SECONDS", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+
+# Priority levels, most urgent first
+PRIORITIES = ("closing", "engaged", "verifying", "new")
+STAGE_PRIORITIES = {
+    funnel.STAGE_SANCTIONED: 0,
+    funnel.STAGE_DECIDED: 0,
+    funnel.STAGE_CONFIRMING: 0,
+    funnel.STAGE_SALARY_SLIP: 0,
+    funnel.STAGE_AMOUNT: 1,
+    funnel.STAGE_VERIFIED: 1,
+    funnel.STAGE_OTP_SENT: 2,
+    funnel.STAGE_START: 3
+}
+
+# Gemini reports how long to wait in the error details, e.g. 'retryDelay': '17s'
+RETRY_DELAY_PATTERN = re.compile(r"""retryDelay['"]?\s*[:=]\s*['"](\d+(?:\.\d+)?)s""")
+
+QUEUE_WAIT_SECONDS = histogram(
+    "llm_queue_wait_seconds", "Time a model call waits for admission", ["priority"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+SCHEDULER_EVENTS = counter("llm_scheduler_events_total", "Model call admissions, rate limits, retries and rejections", ["outcome"])
+
+
+class LLMBusy(Exception):
+    """The model is saturated: a call could not be admitted, or stayed rate limited."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def priority_for(customer_data: dict) -> int:
+    return STAGE_PRIORITIES.get(funnel.stage(customer_data), len(PRIORITIES) - 1)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    # google.genai.errors.APIError carries the HTTP code and status; checked by
+    # attribute so the SDK need not be imported here
+    return (getattr(error, "code", None) == 429 or getattr(error, "status", None) == "RESOURCE_EXHAUSTED"
+            or "RESOURCE_EXHAUSTED" in str(error))
+
+
+def retry_delay(error: Exception):
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE_SECONDS, cap: float = LLM_BACKOFF_MAX_SECONDS,
+                  rnd=random) -> float:
+    # "Full jitter": spreads the retries of calls that failed together
+    return rnd.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class _Ticket:
+    __slots__ = ("priority", "tokens", "seq", "enqueued_at")
+
+    def __init__(self, priority: int, tokens: int, seq: int, enqueued_at: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+
+
+class LLMScheduler:
+    """Safe to call from any thread; callers block until admitted."""
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS, aging_seconds: float = LLM_PRIORITY_AGING_SECONDS,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self.aging_seconds = aging_seconds
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.tokens = float(tokens_per_minute)
+        self.paused_until = 0.0
+        self.stats_counters = {"admitted": 0, "rate_limited": 0, "retried": 0, "rejected": 0}
+        self._updated_at = time.monotonic()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._random = random.Random()
+
+    def _count(self, outcome: str):
+        # Called with the condition held
+        self.stats_counters[outcome] += 1
+        SCHEDULER_EVENTS.inc(outcome=outcome)
+
+    def _refill(self, now: float):
+        if self.tokens_per_minute > 0:
+            self.tokens = min(float(self.tokens_per_minute),
+                              self.tokens + (now - self._updated_at) * self.tokens_per_minute / 60)
+        self._updated_at = now
+
+    def _rank(self, ticket: _Ticket, now: float):
+        waited = (now - ticket.enqueued_at) / self.aging_seconds if self.aging_seconds > 0 else 0.0
+        return ticket.priority - waited, ticket.seq
+
+    def _needed(self, ticket: _Ticket) -> float:
+        # A call larger than the whole budget waits for a full bucket rather than forever
+        return min(ticket.tokens, self.tokens_per_minute)
+
+    def _admissible(self, ticket: _Ticket, now: float) -> bool:
+        return (now >= self.paused_until and self.in_flight < self.max_in_flight
+                and (self.tokens_per_minute <= 0 or self.tokens >= self._needed(ticket)))
+
+    def _wake_in(self, ticket: _Ticket, now: float, deadline: float) -> float:
+        # Releases and admissions notify; a pause or an empty bucket only ends with time
+        wake = deadline
+        if self.paused_until > now:
+            wake = min(wake, self.paused_until)
+        elif self.tokens_per_minute > 0 and self.tokens < self._needed(ticket):
+            wake = min(wake, now + (self._needed(ticket) - self.tokens) * 60 / self.tokens_per_minute)
+        return max(wake - now, 0.001)
+
+    def acquire(self, priority: int, tokens: int, timeout: float = None) -> _Ticket:
+        """Blocks until the call may run; raises LLMBusy after `timeout` seconds."""
+        now = time.monotonic()
+        ticket = _Ticket(priority, tokens, next(self._seq), now)
+        deadline = now + (self.queue_timeout if timeout is None else timeout)
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._admissible(ticket, now) and min(self._waiting, key=lambda t: self._rank(t, now)) is ticket:
+                        break
+                    if now >= deadline:
+                        self._count("rejected")
+                        raise LLMBusy("The assistant is handling too many conversations right now",
+                                      retry_after=max(self.paused_until - now, 1.0))
+                    self._cond.wait(self._wake_in(ticket, now, deadline))
+            finally:
+                self._waiting.remove(ticket)
+                # The head of the queue changed
+                self._cond.notify_all()
+            self.in_flight += 1
+            self.tokens -= tokens
+            self._count("admitted")
+        QUEUE_WAIT_SECONDS.observe(now - ticket.enqueued_at, priority=PRIORITIES[priority])
+        return ticket
+
+    def release(self, ticket: _Ticket, used_tokens: int = None):
+        """Frees the call's slot and settles the budget against the tokens it really used."""
+        with self._cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self.tokens -= used_tokens - ticket.tokens
+            self._cond.notify_all()
+
+    def backoff(self, attempt: int, error: Exception = None) -> float:
+        """Holds back admissions after a rate-limit error; returns the delay."""
+        delay = backoff_delay(attempt, rnd=self._random)
+        hinted = retry_delay(error) if error is not None else None
+        if hinted is not None:
+            delay = max(delay, hinted)
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._count("rate_limited")
+        return delay
+
+    def run(self, call, priority: int, tokens: int, retryable=None):
+        """
+        Runs `call()` once admitted and returns its result. `call` returns
+        (result, tokens used or None). A rate-limited call is retried after a
+        backoff, unless `retryable()` says it has already had visible effects.
+        """
+        attempt = 0
+        while True:
+            ticket = self.acquire(priority, tokens)
+            used = None
+            try:
+                result, used = call()
+                return result
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                if attempt >= self.max_retries or (retryable is not None and not retryable()):
+                    raise LLMBusy(f"The model is rate limited: {e}", retry_after=delay) from e
+                print(f"Model call rate limited, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+                with self._cond:
+                    self._count("retried")
+                attempt += 1
+            finally:
+                self.release(ticket, used)
+
+    def queue_depth(self) -> dict:
+        with self._cond:
+            depth = {name: 0 for name in PRIORITIES}
+            for ticket in self._waiting:
+                depth[PRIORITIES[ticket.priority]] += 1
+        return depth
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                **self.stats_counters,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "waiting": len(self._waiting),
+                "tokens_per_minute": self.tokens_per_minute,
+                "tokens_available": round(self.tokens) if self.tokens_per_minute > 0 else None,
+                "paused_for_seconds": round(max(self.paused_until - time.monotonic(), 0.0), 3)
+            }
+
+
+# Global instance
+scheduler = LLMScheduler()
+
+gauge("llm_queue_depth", "Model calls waiting for admission", ["priority"],
+      function=lambda: {(name,): depth for name, depth in scheduler.queue_depth().items()})
+gauge("llm_in_flight", "Model calls running", function=lambda: scheduler.in_flight)
+gauge("llm_tokens_available", "Tokens left in this minute's budget", function=lambda: scheduler.stats()["tokens_available"] or 0)
@@ -1,12 +1,26 @@
 import os
-from google import genai
-from google.genai import types
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import json
 from agents import sales, verify, underwriting, sanction
 from mock_servers import crm, offer, credit
 from streaming.producer import producer
+from master.session_store import SessionStore
+from utils.state_backend import open_session_backend
+from master import funnel
+from master import history as chat_history
+from master.tool_cache import ToolCache
+from master.prompt_cache import PromptCache
+from master import llm_scheduler
+from utils.metrics import counter, histogram
+import contextvars
 import functools
+import inspect
+import threading
+import time
+import typing
+import uuid
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -17,13 +31,22 @@ if not api_key:
     load_dotenv() 
     api_key = os.getenv("GOOGLE_API_KEY")
 
-# Initialize Client
-client = None
-if api_key:
-    client = genai.Client(api_key=api_key)
+# "gemini" or "fake" (scripted offline stand-in, see master/fake_llm.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
 
-# Session storage
-sessions = {}
+# Deterministic handling of structured turns (phone, OTP, amount, tenure)
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "0") == "1"
+
+# Concurrency limits for chat turns
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+CHAT_TIMEOUT_SECONDS = float(os.getenv("CHAT_TIMEOUT_SECONDS", "60"))
+# Turns with a client message id outlive the request so a retry can pick up the
+# reply, but still give up eventually so a hung call cannot hold its id forever
+KEYED_TURN_TIMEOUT_SECONDS = float(os.getenv("KEYED_TURN_TIMEOUT_SECONDS", str(5 * CHAT_TIMEOUT_SECONDS)))
+
+# Gemini calls and every tool they trigger are synchronous, so turns run on a
+# bounded worker pool and never on the event loop.
+executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="chat-turn")
 
 # System Instruction
 SYSTEM_INSTRUCTION = """
@@ -33,7 +56,7 @@ You must be friendly, professional, and convincing. Use natural language.
 
 You have access to the following tools/functions:
 1. `send_otp(phone)`: Sends an OTP to verify the customer's phone number.
-2. `verify_otp(phone, code)`: Validates the OTP provided by the user. If valid, this also performs KYC lookups.
+2. `verify_otp(phone, code)`: Validates the OTP provided by the user. If valid, this also performs KYC lookups and returns the pre-approved limit and credit score.
 3. `check_offer(customer_id)`: Checks pre-approved limit.
 4. `negotiate_terms(amount, limit)`: Returns interest rate terms.
 5. `evaluate_application(credit_score, amount, limit, salary)`: Underwrites the loan.
@@ -44,20 +67,21 @@ Process:
 2. Call `send_otp(phone)`. Inform the customer that an OTP has been sent and ask them to enter it.
 3. Once the user provides the OTP, call `verify_otp(phone, code)`.
    - If verification fails (invalid OTP), ask them to try again.
-   - If verified, proceed to check their offer.
-4. Call `check_offer` to see their limit.
+   - If `send_otp` or `verify_otp` returns `retry_after_seconds`, the number is temporarily locked: relay the message and do not call the tool again before then.
+   - If verified, the result already includes `pre_approved_limit` and `credit_score`.
+4. Only if `pre_approved_limit` is missing from the verification result, call `get_offer` to see their limit.
 5. Inform them of their pre-approved limit enthusiastically. Ask how much they need.
 6. Once they state an amount, Call `negotiate_terms`.
    - If terms are base rate (12%), pitch it as a special offer.
    - If higher rate (14%), justify it (e.g., higher risk/amount).
 7. Ask for the tenure (in months).
 8. Perform underwriting using `evaluate_application`. You need the credit score (call internal mock data or ask user? The system has mock credit data).
-   - Actually, you should look up their credit score using `get_credit_score` (internal tool) before underwriting.
+   - Use the credit score from the verification result. Only call `get_credit_score` if it was missing.
    - If `evaluate_application` returns REQUEST_SALARY_SLIP, ask the user to upload their salary slip.
    - If REJECT, explain politely.
    - If APPROVE, proceed.
-9. If Approved, confirm final details and call `generate_sanction_letter`.
-10. Send the letter and close the sale.
+9. If Approved, confirm final details and call `generate_sanction_letter`. Set `include_schedule` if the customer wants the month-by-month repayment schedule in the letter.
+10. Share the letter's `document_url` so the customer can download it, and close the sale.
 
 Always maintain context. Remember what the user said.
 """
@@ -65,17 +89,90 @@ Always maintain context. Remember what the user said.
 # Tools Helper
 # The new SDK creates tools from functions automatically cleanly.
 
+TOOL_SECONDS = histogram("tool_duration_seconds", "Latency of each tool function call", ["tool"])
+LLM_SECONDS = histogram("llm_request_duration_seconds", "Latency of each Gemini round-trip, including tool hops", ["mode"])
+LLM_TOKENS = counter("llm_tokens_total", "Tokens reported by the model", ["kind"])
+QUEUE_WAIT_SECONDS = histogram(
+    "chat_turn_queue_wait_seconds", "Time a turn waits for earlier turns of the same session",
+    buckets=(0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+PROMPT_TOKENS = histogram(
+    "llm_prompt_tokens", "Input tokens of the last model call in a turn",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+)
+TURN_SECONDS = histogram("chat_turn_duration_seconds", "Latency of a chat turn by serving path", ["path"])
+
+# Session whose turn is running on the current thread, so tools can update its funnel state
+current_session = contextvars.ContextVar("current_session", default=None)
+# Callback receiving progress events for a streamed turn
+turn_listener = contextvars.ContextVar("turn_listener", default=None)
+
+# Progress messages shown to the user while a tool runs
+TOOL_LABELS = {
+    "send_otp": "Sending OTP",
+    "verify_otp": "Verifying OTP",
+    "get_offer": "Checking your pre-approved offer",
+    "get_credit_score": "Fetching your credit score",
+    "negotiate_loan": "Working out your interest rate",
+    "evaluate_loan": "Evaluating your application",
+    "generate_sanction": "Generating sanction letter"
+}
+
 def event_wrapper(func, event_type):
+    signature = inspect.signature(func)
+    name = func.__name__
+    label = TOOL_LABELS.get(name, name)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        result = func(*args, **kwargs)
-        # Publish event
-        payload = {
-            "function": func.__name__,
-            "args": args,
-            "result": result
-        }
-        producer.send_event("capital_connect_events", event_type, payload)
+        session = current_session.get()
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        cache = session.tool_cache if session is not None and ToolCache.cacheable(name) else None
+        cached = cache.get(name, arguments) if cache is not None else None
+
+        if session is not None:
+            # A model call that has run tools (the SDK runs them inside send_message) must not be resent
+            session.tool_calls += 1
+        listener = turn_listener.get()
+        if listener is not None:
+            listener("tool", {"name": name, "status": "started", "label": label})
+        if cached is not None:
+            result, original_event_id, age = cached
+        else:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            TOOL_SECONDS.observe(elapsed, tool=name)
+        if listener is not None:
+            listener("tool", {"name": name, "status": "finished", "label": label, "cached": cached is not None})
+        if session is not None:
+            funnel.update_from_tool(session.customer_data, name, arguments, result)
+            session.tool_cache.invalidate_after(name, result)
+
+        # Publish event; a repeat served from the cache is only marked as a duplicate of the original
+        event_id = uuid.uuid4().hex
+        if cached is not None:
+            payload = {
+                "event_id": event_id,
+                "function": name,
+                "args": dict(arguments),
+                "duplicate_of": original_event_id,
+                "cache_age_ms": round(age * 1000, 3)
+            }
+        else:
+            payload = {
+                "event_id": event_id,
+                "function": name,
+                "args": dict(arguments),
+                "result": result,
+                "duration_ms": round(elapsed * 1000, 3)
+            }
+            if cache is not None:
+                cache.put(name, arguments, result, event_id)
+        producer.send_event("capital_connect_events", event_type, payload,
+                            key=session.session_id if session is not None else None)
         return result
     return wrapper
 
@@ -89,35 +186,407 @@ tool_functions = [
     event_wrapper(sanction.generate_sanction, "SANCTION_GENERATED")
 ]
 
+tools_by_name = {tool.__name__: tool for tool in tool_functions}
+fast_path = funnel.FunnelEngine(tools_by_name)
+
+MODEL = "gemini-2.5-flash"
+# Upper bound on model <-> tool hops in one turn when tools are run here rather than by the SDK
+MAX_TOOL_HOPS = 10
+
+# Created by init_llm(), on the first chat or up front from the app's lifespan
+# hook, so importing this module does not load the Gemini SDK
+client = None
+prompt_cache = None
+_llm_lock = threading.Lock()
+
+def init_llm():
+    """Creates the LLM client and the shared prompt cache once, and returns the client."""
+    global client, prompt_cache
+    if prompt_cache is not None:
+        return client
+    with _llm_lock:
+        if prompt_cache is None:
+            if LLM_BACKEND == "fake":
+                from master.fake_llm import FakeClient
+                client = FakeClient.from_env()
+            elif api_key:
+                from google import genai
+                client = genai.Client(api_key=api_key)
+            prompt_cache = PromptCache(client, MODEL, SYSTEM_INSTRUCTION, tool_functions)
+    return client
+
+def llm_status() -> dict:
+    return {
+        "ready": client is not None,
+        "backend": LLM_BACKEND,
+        "initialized": prompt_cache is not None,
+        "error": None if client is not None or prompt_cache is None else "GOOGLE_API_KEY is not set"
+    }
+
+@functools.lru_cache(maxsize=1)
+def inline_config():
+    """Built once and shared by every session: the prefix sent inline when no cache is available."""
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        system_instruction=SYSTEM_INSTRUCTION,
+        tools=tool_functions,
+        temperature=0.7
+    )
+
+_cached_configs = {}
+
+def chat_config():
+    """
+    Config for new chats: the shared cached prefix when there is one, else the inline prefix.
+    Requests against a cache may not repeat its tools, so the SDK cannot run
+    them; ChatSession runs the tool calls itself in that case.
+    """
+    cache_name = prompt_cache.current()
+    if cache_name is None:
+        return inline_config()
+    config = _cached_configs.get(cache_name)
+    if config is None:
+        from google.genai import types
+
+        config = _cached_configs[cache_name] = types.GenerateContentConfig(
+            cached_content=cache_name,
+            temperature=0.7,
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
+        )
+    return config
+
+def _coerce_args(tool, args: dict) -> dict:
+    # The model sends JSON numbers; match the tool's declared int/float parameters
+    hints = typing.get_type_hints(tool)
+    return {
+        key: hints[key](value) if hints.get(key) in (int, float) and isinstance(value, (int, float)) else value
+        for key, value in args.items()
+    }
+
+def _run_tool_call(call):
+    """Runs one function call from the model and wraps the outcome the way automatic function calling does."""
+    from google.genai import types
+
+    tool = tools_by_name.get(call.name)
+    try:
+        if tool is None:
+            raise ValueError(f"Unknown function {call.name}")
+        response = {"result": tool(**_coerce_args(tool, call.args or {}))}
+    except Exception as e:
+        response = {"error": str(e)}
+    return types.Part.from_function_response(name=call.name, response=response)
+
+def _text_parts(response) -> str:
+    # `response.text` warns when function calls sit alongside the text
+    if not response.candidates or response.candidates[0].content is None:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts or [] if part.text and not part.thought)
+
+# Which path served each turn, to measure what the fast path saves
+turn_stats = {"fast": 0, "llm": 0, "fast_ms": 0.0, "llm_ms": 0.0}
+_turn_stats_lock = threading.Lock()
+
+def _record_turn(session, path: str, elapsed_ms: float, prompt_tokens: int = None):
+    with _turn_stats_lock:
+        turn_stats[path] += 1
+        turn_stats[f"{path}_ms"] += elapsed_ms
+    TURN_SECONDS.observe(elapsed_ms / 1000, path=path)
+    tokens = f" prompt_tokens={prompt_tokens}" if prompt_tokens is not None else ""
+    print(
+        f"Turn served: session={session.session_id} path={path} latency_ms={elapsed_ms:.1f} "
+        f"queue_ms={session.last_queue_wait_ms:.1f}{tokens} stage={funnel.stage(session.customer_data)}"
+    )
+
+def _record_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    if usage.prompt_token_count:
+        LLM_TOKENS.inc(usage.prompt_token_count, kind="prompt")
+        PROMPT_TOKENS.observe(usage.prompt_token_count)
+    if usage.candidates_token_count:
+        LLM_TOKENS.inc(usage.candidates_token_count, kind="output")
+    if getattr(usage, "cached_content_token_count", None):
+        LLM_TOKENS.inc(usage.cached_content_token_count, kind="cached")
+    return usage.prompt_token_count
+
+def _used_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return usage.total_token_count or (usage.prompt_token_count or 0) + (usage.candidates_token_count or 0) or None
+
 class ChatSession:
-    def __init__(self, session_id):
+    def __init__(self, session_id, customer_data: dict = None, history: list = None):
         self.session_id = session_id
-        self.customer_data = {}
-        
+        self.customer_data = customer_data or {}
+        self.last_active = time.time()
+        self.in_flight = 0
+        # Turns submitted and not yet finished, including ones waiting for a
+        # worker, and the future that resolves when the last of them has
+        # finished (event loop side only). The store never evicts a session with any.
+        self.queued = 0
+        self.last_queue_wait_ms = 0.0
+        self._last_turn = None
+        # Version of this state in the shared backend; -1 until a turn has synced it
+        self.state_version = -1
+        # Size of the last model call, charged against the token budget for the next one
+        self.last_call_tokens = 0
+        # Tool calls run for this session; tells the scheduler whether a failed model call had side effects
+        self.tool_calls = 0
+        self.tool_cache = ToolCache()
+        self.chat = self._create_chat(history)
+
+    def _create_chat(self, history: list = None):
         # Configure Chat with Tools
-        self.chat = client.chats.create(
-            model="gemini-2.5-flash",
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_INSTRUCTION,
-                tools=tool_functions,
-                temperature=0.7
+        llm = init_llm()
+        self.config = chat_config()
+        return llm.chats.create(model=MODEL, config=self.config, history=history)
+
+    def _prepare_chat(self):
+        """
+        Swaps in a new chat over the same history when it has outgrown the turn
+        limit (compacted) or the shared prompt prefix has changed.
+        """
+        compacted = chat_history.compact(self.chat.get_history(curated=True), self.customer_data)
+        if compacted is not None or chat_config() is not self.config:
+            self.chat = self._create_chat(compacted if compacted is not None else self.chat.get_history(curated=True))
+
+    def _round_trip(self, message, manual: bool, texts: list, on_event=None):
+        """
+        One model call. Appends the reply text to `texts` (streaming it to
+        `on_event` as it arrives) and returns (function calls to run here,
+        prompt tokens, total tokens used).
+        """
+        calls = []
+        prompt_tokens = used_tokens = None
+        if on_event is None:
+            response = self.chat.send_message(message)
+            prompt_tokens, used_tokens = _record_usage(response), _used_tokens(response)
+            calls = (response.function_calls or []) if manual else []
+            texts.append(_text_parts(response) if calls else response.text or "")
+        else:
+            usage_chunk = None
+            for chunk in self.chat.send_message_stream(message):
+                chunk_calls = (chunk.function_calls or []) if manual else []
+                calls.extend(chunk_calls)
+                text = _text_parts(chunk) if chunk_calls else chunk.text
+                if text:
+                    texts.append(text)
+                    on_event("text", text)
+                # Chunks carry the usage so far, so only the last one counts
+                if getattr(chunk, "usage_metadata", None) is not None:
+                    usage_chunk = chunk
+            if usage_chunk is not None:
+                prompt_tokens, used_tokens = _record_usage(usage_chunk), _used_tokens(usage_chunk)
+        return calls, prompt_tokens, used_tokens
+
+    def _send(self, prompt, on_event=None):
+        """
+        Sends the prompt and returns (reply, prompt tokens of the last call).
+        With a cached prefix, tool calls come back to us and are run here until the model answers in text.
+        Each model call waits for the scheduler, at the priority of the session's funnel stage.
+        """
+        manual = self.config.cached_content is not None
+        message = prompt
+        texts = []
+        prompt_tokens = None
+        for _ in range(MAX_TOOL_HOPS + 1):
+            hop_texts = []
+            tool_calls_before = self.tool_calls
+
+            def model_call():
+                calls, hop_prompt_tokens, used_tokens = self._round_trip(message, manual, hop_texts, on_event)
+                return (calls, hop_prompt_tokens, used_tokens), used_tokens
+
+            calls, hop_prompt_tokens, used_tokens = llm_scheduler.scheduler.run(
+                model_call, llm_scheduler.priority_for(self.customer_data), self.last_call_tokens or llm_scheduler.LLM_TOKEN_ESTIMATE,
+                # Text already streamed to the client, or tools already run, cannot be taken back
+                retryable=lambda: not hop_texts and self.tool_calls == tool_calls_before
             )
-        )
+            texts.extend(hop_texts)
+            prompt_tokens = hop_prompt_tokens or prompt_tokens
+            self.last_call_tokens = used_tokens or self.last_call_tokens
+            if not calls:
+                break
+            message = [_run_tool_call(call) for call in calls]
+        return "".join(texts), prompt_tokens
 
-    def process_message(self, message: str, attachment_path: str = None):
+    def snapshot(self) -> dict:
+        """
+        JSON-serializable state used to spill the session to disk.
+        """
+        return {
+            "customer_data": self.customer_data,
+            "history": [content.model_dump(mode="json", exclude_none=True) for content in self.chat.get_history(curated=True)]
+        }
+
+    @staticmethod
+    def _history(snapshot: dict) -> list:
+        from google.genai import types
+
+        return [types.Content.model_validate(content) for content in snapshot.get("history", [])]
+
+    @classmethod
+    def restore(cls, session_id: str, snapshot: dict):
+        return cls(session_id, customer_data=snapshot.get("customer_data"), history=cls._history(snapshot))
+
+    def load_snapshot(self, snapshot: dict):
+        """Replaces this session's state with a newer snapshot saved by another worker."""
+        history = self._history(snapshot)
+        self.customer_data = snapshot.get("customer_data") or {}
+        # Cached tool results may predate what the other worker did
+        self.tool_cache = ToolCache()
+        self.chat = self._create_chat(history)
+
+    def process_message(self, message: str, salary: float = None, on_event=None):
+        """
+        Runs one turn and returns the reply text.
+        If `on_event(kind, data)` is given, the reply is streamed: it receives
+        ("text", chunk) as text arrives and ("tool", {...}) around each tool call.
+        """
+        self.in_flight += 1
+        token = current_session.set(self)
+        listener_token = turn_listener.set(on_event)
+        try:
+            with sessions.turn(self):
+                return self._process_message(message, salary, on_event)
+        finally:
+            turn_listener.reset(listener_token)
+            current_session.reset(token)
+            self.in_flight -= 1
+            self.last_active = time.time()
+
+    def _process_message(self, message: str, salary: float = None, on_event=None):
         prompt = message
-        if attachment_path:
-            # If a file was uploaded, we tell the LLM
-            # Extract salary from filename for mock logic
-            from utils.file_upload import extract_salary_from_filename
-            salary = extract_salary_from_filename(attachment_path)
+        if salary is not None:
+            # If a salary slip was uploaded, we tell the LLM what it states
             self.customer_data['salary'] = salary
             prompt += f"\n[SYSTEM: User uploaded salary slip. Extracted Salary: {salary}]"
-        
-        response = self.chat.send_message(prompt)
-        return response.text
+
+        start = time.perf_counter()
+        if FAST_PATH_ENABLED:
+            reply = fast_path.handle(self.customer_data, message)
+            if reply is not None:
+                # Keep a transcript so the LLM can catch up if a later turn falls back to it
+                pending = self.customer_data.setdefault("pending_context", [])
+                pending.append(f"User: {message}\nAssistant: {reply}")
+                del pending[:-10]
+                if on_event is not None:
+                    on_event("text", reply)
+                _record_turn(self, "fast", (time.perf_counter() - start) * 1000)
+                return reply
+
+        pending = self.customer_data.pop("pending_context", None)
+        if pending:
+            prompt = (
+                "[SYSTEM: These turns were handled outside this chat. "
+                f"Current state: {funnel.describe(self.customer_data)}]\n"
+                + "\n".join(pending)
+                + f"\n[SYSTEM: End of handled turns.]\n{prompt}"
+            )
+
+        self._prepare_chat()
+        llm_start = time.perf_counter()
+        reply, prompt_tokens = self._send(prompt, on_event)
+        LLM_SECONDS.observe(time.perf_counter() - llm_start, mode="send" if on_event is None else "stream")
+        _record_turn(self, "llm", (time.perf_counter() - start) * 1000, prompt_tokens)
+        return reply
+
+    async def _submit(self, func, deadline: float):
+        """
+        Queues `func` behind this session's earlier turns and, once they have
+        finished, starts it on the worker pool and returns its future.
+        Turns of one session therefore run one at a time and in arrival order,
+        while different sessions run in parallel.
+        Raises asyncio.TimeoutError if the earlier turns outlast `deadline` (loop time).
+        """
+        loop = asyncio.get_running_loop()
+        previous, finished = self._last_turn, loop.create_future()
+        self._last_turn = finished
+        # Counted before the first await, so the session cannot be evicted while
+        # the turn waits for its predecessors or for a free worker
+        self.queued += 1
+        enqueued = time.perf_counter()
+        try:
+            if previous is not None and not previous.done():
+                await asyncio.wait_for(asyncio.shield(previous), timeout=max(deadline - loop.time(), 0))
+        except BaseException:
+            self.queued -= 1
+            # Gave up waiting: hand the slot on once the earlier turn is done
+            previous.add_done_callback(lambda _: finished.done() or finished.set_result(None))
+            raise
+
+        wait = time.perf_counter() - enqueued
+        self.last_queue_wait_ms = wait * 1000
+        QUEUE_WAIT_SECONDS.observe(wait)
+
+        def turn_done(_):
+            self.queued -= 1
+            finished.set_result(None)
+
+        future = loop.run_in_executor(executor, func)
+        # Released when the worker finishes, not when a caller stops waiting for it
+        future.add_done_callback(turn_done)
+        return future
+
+    async def process_message_async(self, message: str, salary: float = None, timeout: float = None):
+        """
+        Non-blocking variant of `process_message` for the async endpoints.
+        Raises asyncio.TimeoutError if the turn (including its wait in the session's queue)
+        does not finish within `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (CHAT_TIMEOUT_SECONDS if timeout is None else timeout)
+        future = await self._submit(functools.partial(self.process_message, message, salary), deadline)
+        return await asyncio.wait_for(asyncio.shield(future), timeout=max(deadline - loop.time(), 0))
+
+    async def stream_message(self, message: str, salary: float = None, timeout: float = None):
+        """
+        Async generator over the events of one turn: ("tool", {...}) and ("text", chunk)
+        as they happen, then ("done", {"reply", "ttfb_ms", "ttft_ms", "total_ms"}).
+        Raises asyncio.TimeoutError if the turn does not finish within `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        start = time.perf_counter()
+        deadline = loop.time() + (CHAT_TIMEOUT_SECONDS if timeout is None else timeout)
+
+        def on_event(kind, data):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, data))
+
+        def run_turn():
+            try:
+                on_event("done", self.process_message(message, salary, on_event=on_event))
+            except Exception as e:
+                on_event("error", e)
+
+        await self._submit(run_turn, deadline)
+
+        ttfb_ms = ttft_ms = None
+        while True:
+            kind, data = await asyncio.wait_for(events.get(), timeout=max(deadline - loop.time(), 0))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if ttfb_ms is None:
+                ttfb_ms = elapsed_ms
+            if kind == "error":
+                raise data
+            if kind == "done":
+                print(f"Streamed turn: session={self.session_id} ttfb_ms={ttfb_ms:.1f} ttft_ms={(ttft_ms or elapsed_ms):.1f} total_ms={elapsed_ms:.1f}")
+                yield "done", {
+                    "reply": data,
+                    "ttfb_ms": round(ttfb_ms, 1),
+                    "ttft_ms": round(ttft_ms if ttft_ms is not None else elapsed_ms, 1),
+                    "total_ms": round(elapsed_ms, 1)
+                }
+                return
+            if kind == "text" and ttft_ms is None:
+                ttft_ms = elapsed_ms
+            yield kind, data
+
+# Session storage
+sessions = SessionStore(create=ChatSession, restore=ChatSession.restore, backend=open_session_backend())
 
 def get_or_create_session(session_id: str):
-    if session_id not in sessions:
-        sessions[session_id] = ChatSession(session_id)
-    return sessions[session_id]
+    return sessions.get_or_create(session_id)
@@ -0,0 +1,152 @@
+"""
+One explicitly cached prompt prefix (system instruction + tool declarations)
+shared by every chat session.
+
+The prefix is created once per model and config version, found again by its
+display name after a restart or in another worker, extended before it
+expires, and recreated if it has gone. Whenever caching is unavailable
+(the fake client, a prefix below the model's minimum cacheable size, API
+errors) `current()` returns None and sessions send the prefix inline as before.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+# Extend the cache when less than this much of its lifetime is left
+PROMPT_CACHE_REFRESH_SECONDS = int(os.getenv("PROMPT_CACHE_REFRESH_SECONDS", "300"))
+# After a failure, wait this long before trying the API again
+PROMPT_CACHE_RETRY_SECONDS = int(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "300"))
+
+
+def _expires_at(cached) -> float:
+    if cached.expire_time is None:
+        return time.time() + PROMPT_CACHE_TTL_SECONDS
+    return cached.expire_time.replace(tzinfo=cached.expire_time.tzinfo or datetime.timezone.utc).timestamp()
+
+
+class PromptCache:
+    def __init__(self, client, model: str, system_instruction: str, tools: list):
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        from google.genai import types
+
+        self.declarations = [types.FunctionDeclaration.from_callable_with_api_option(callable=tool) for tool in tools]
+        # Any change to the prefix yields a new version, and so a new cache
+        fingerprint = json.dumps({
+            "model": model,
+            "system_instruction": system_instruction,
+            "tools": [declaration.model_dump(mode="json", exclude_none=True) for declaration in self.declarations]
+        }, sort_keys=True)
+        self.version = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+        self.display_name = f"capital-connect-{self.version}"
+        self.enabled = PROMPT_CACHE_ENABLED and hasattr(client, "caches")
+        self.name = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        self.stats = {"created": 0, "reused": 0, "refreshed": 0, "failures": 0}
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # Held for the API calls, so only one refresh runs at a time
+        self._refresh_lock = threading.Lock()
+
+    def current(self):
+        """
+        Name of a live cache holding the prefix, or None to send it inline.
+        Never calls the API: creating or extending the cache is handed to a
+        background thread, because chats are created on the event loop.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        if self.name is not None and now < self.expires_at - PROMPT_CACHE_REFRESH_SECONDS:
+            return self.name
+        self._refresh_in_background()
+        return self.name if self.name is not None and now < self.expires_at else None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.time() < self.retry_at:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True, name="prompt-cache-refresh").start()
+
+    def refresh(self):
+        """Finds, creates or extends the cache now (blocking). Run from the app's lifespan hook or in the background."""
+        if not self.enabled:
+            return None
+        try:
+            with self._refresh_lock:
+                now = time.time()
+                if self.name is not None and now < self.expires_at - PROMPT_CACHE_REFRESH_SECONDS:
+                    return self.name
+                try:
+                    if self.name is not None and now < self.expires_at:
+                        try:
+                            self._refresh()
+                            return self.name
+                        except Exception as e:
+                            print(f"Prompt cache refresh failed, recreating it: {e}")
+                    if not self._find():
+                        self._create()
+                    self.retry_at = 0.0
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    self.retry_at = now + PROMPT_CACHE_RETRY_SECONDS
+                    print(f"Prompt cache unavailable, sending the prompt inline: {e}")
+                    if now >= self.expires_at:
+                        self.name = None
+                return self.name
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _find(self) -> bool:
+        # Another worker, or this one before a restart, may already have created it
+        for cached in self.client.caches.list():
+            if cached.display_name == self.display_name and _expires_at(cached) > time.time() + PROMPT_CACHE_REFRESH_SECONDS:
+                self.name, self.expires_at = cached.name, _expires_at(cached)
+                self.stats["reused"] += 1
+                print(f"Reusing prompt cache {self.name} (version {self.version})")
+                return True
+        return False
+
+    def _create(self):
+        from google.genai import types
+
+        cached = self.client.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                display_name=self.display_name,
+                system_instruction=self.system_instruction,
+                tools=[types.Tool(function_declarations=self.declarations)],
+                ttl=f"{PROMPT_CACHE_TTL_SECONDS}s"
+            )
+        )
+        self.name, self.expires_at = cached.name, _expires_at(cached)
+        self.stats["created"] += 1
+        print(f"Created prompt cache {self.name} (version {self.version})")
+
+    def _refresh(self):
+        from google.genai import types
+
+        cached = self.client.caches.update(
+            name=self.name,
+            config=types.UpdateCachedContentConfig(ttl=f"{PROMPT_CACHE_TTL_SECONDS}s")
+        )
+        self.expires_at = _expires_at(cached)
+        self.stats["refreshed"] += 1
+
+    def describe(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "version": self.version,
+            "name": self.name,
+            "expires_in_seconds": round(self.expires_at - time.time()) if self.name else None,
+            **self.stats
+        }
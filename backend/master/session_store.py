@@ -0,0 +1,310 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.state_backend import SESSION_LOCK_TTL_SECONDS, WORKER_ID
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "900"))
+SESSION_SPILL_DIR = Path(os.getenv("SESSION_SPILL_DIR", str(Path(__file__).parent.parent / "sessions")))
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+SESSION_LOCK_POLL_SECONDS = 0.02
+
+
+class SessionStore:
+    """
+    Bounded LRU of live chat sessions.
+    Sessions idle for longer than `idle_ttl` or pushed out by `max_sessions` are
+    spilled to `spill_dir` as JSON snapshots and rehydrated on their next message.
+
+    `create(session_id)` builds a fresh session and `restore(session_id, snapshot)`
+    rebuilds one from the dict returned by its `snapshot()` method.
+
+    With a shared `backend` (see utils/state_backend.py) the backend holds the
+    state instead of the spill directory, and live sessions are only a cache:
+    each turn runs inside `turn(session)`, which locks the session across
+    workers, reloads it if another worker has moved it on, and saves it back.
+    Once `start()` is called, a daemon thread spills idle sessions and deletes
+    expired ones from the backend every `sweep_interval` seconds.
+    """
+
+    def __init__(self, create, restore, max_sessions: int = SESSION_MAX,
+                 idle_ttl: float = SESSION_IDLE_TTL_SECONDS, spill_dir=SESSION_SPILL_DIR, backend=None,
+                 sweep_interval: float = SESSION_SWEEP_INTERVAL_SECONDS):
+        self.create = create
+        self.restore = restore
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(exist_ok=True, parents=True)
+
+        self._sessions = OrderedDict()  # {session_id: session}, least recently used first
+        self._lock = threading.Lock()
+        self._building = {}  # {session_id: Event set once it is live}
+        self._spilling = {}  # {session_id: snapshot evicted but not yet on disk}
+
+        self.hits = 0
+        self.misses = 0
+        self.rehydrations = 0
+        self.evictions = 0
+        # Shared backend only: turns that found the session changed by another worker,
+        # and affinity hints that named this worker or another one
+        self.reloads = 0
+        self.lock_waits = 0
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        # Sessions deleted from the shared backend after SESSION_STATE_TTL_SECONDS
+        self.expired = 0
+
+        self.sweep_interval = sweep_interval
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def start(self):
+        """Starts the sweeper thread; called from the app's lifespan hook."""
+        if self._sweeper is None and self.sweep_interval > 0:
+            self._stop = threading.Event()
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(self._stop,), name="session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self, stop: threading.Event):
+        while not stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+                if self.backend is not None:
+                    expired = self.backend.sweep()
+                    with self._lock:
+                        self.expired += expired
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._sweeper = None
+
+    def _spill_path(self, session_id: str) -> Path:
+        # Session ids come from clients, so never use them as file names directly
+        digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return self.spill_dir / f"{digest}.json"
+
+    def get_or_create(self, session_id: str):
+        """
+        Returns the live session, rehydrating or creating it if needed.
+        Concurrent callers for the same id always get the same object: the
+        first builds it (outside the store lock, so other ids are not held up)
+        and the rest wait for it.
+        """
+        while True:
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is not None:
+                    self._sessions.move_to_end(session_id)
+                    self.hits += 1
+                    session.last_active = time.time()
+                    spills = self._evict(keep=session_id)
+                else:
+                    building = self._building.get(session_id)
+                    if building is None:
+                        building = self._building[session_id] = threading.Event()
+                        break
+            if session is not None:
+                self._write_spills(spills)
+                return session
+            building.wait()
+
+        session, rehydrated, spills = None, False, []
+        try:
+            session = self._load(session_id)
+            rehydrated = session is not None
+            if session is None:
+                session = self.create(session_id)
+        finally:
+            with self._lock:
+                del self._building[session_id]
+                if session is not None:
+                    if rehydrated:
+                        self.rehydrations += 1
+                    else:
+                        self.misses += 1
+                    self._sessions[session_id] = session
+                    session.last_active = time.time()
+                    spills = self._evict(keep=session_id)
+            building.set()
+        self._write_spills(spills)
+        return session
+
+    def _load(self, session_id: str):
+        if self.backend is not None:
+            # Loaded by the first turn, under the session lock
+            return None
+        with self._lock:
+            # Evicted moments ago and still being written: take it back from memory
+            snapshot = self._spilling.pop(session_id, None)
+        if snapshot is not None:
+            try:
+                return self.restore(session_id, snapshot)
+            except Exception as e:
+                print(f"Failed to rehydrate session {session_id}: {e}")
+                return None
+        path = self._spill_path(session_id)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                snapshot = json.load(f)
+            session = self.restore(session_id, snapshot)
+        except Exception as e:
+            print(f"Failed to rehydrate session {session_id}: {e}")
+            return None
+        path.unlink(missing_ok=True)
+        return session
+
+    def _spill(self, session_id: str, snapshot: dict):
+        path = self._spill_path(session_id)
+        tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            with self._lock:
+                # Skipped if the session came back (or was spilled again) while this was written
+                if self._spilling.get(session_id) is snapshot:
+                    os.replace(tmp_path, path)
+                    del self._spilling[session_id]
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _write_spills(self, spills: list):
+        """Writes the snapshots `_evict` took, outside the store lock."""
+        for session_id, snapshot in spills:
+            try:
+                self._spill(session_id, snapshot)
+            except Exception as e:
+                print(f"Failed to spill session {session_id}: {e}")
+                with self._lock:
+                    if self._spilling.get(session_id) is snapshot:
+                        del self._spilling[session_id]
+
+    def _evict(self, keep: str = None) -> list:
+        """
+        Drops cold sessions; called with the store lock held. Returns their
+        (session_id, snapshot) pairs, to be passed to `_write_spills` once the
+        lock is released.
+        """
+        now = time.time()
+        spills = []
+        for session_id, session in list(self._sessions.items()):
+            if session_id == keep:
+                # The session being handed to a caller stays live regardless of capacity
+                continue
+            over_capacity = len(self._sessions) > self.max_sessions
+            idle = now - session.last_active > self.idle_ttl
+            if not (over_capacity or idle):
+                # Entries are in LRU order, so nothing further along is colder
+                break
+            if session.in_flight or getattr(session, "queued", 0):
+                # Never spill a session in the middle of a turn or with turns submitted
+                continue
+            if self.backend is None:
+                try:
+                    snapshot = session.snapshot()
+                except Exception as e:
+                    print(f"Failed to spill session {session_id}: {e}")
+                else:
+                    self._spilling[session_id] = snapshot
+                    spills.append((session_id, snapshot))
+            del self._sessions[session_id]
+            self.evictions += 1
+        return spills
+
+    def sweep(self):
+        """Spills idle sessions without waiting for the next lookup."""
+        with self._lock:
+            spills = self._evict()
+        self._write_spills(spills)
+
+    @contextlib.contextmanager
+    def turn(self, session, timeout: float = SESSION_LOCK_TTL_SECONDS):
+        """
+        Brackets one turn of `session`. With a shared backend, waits up to
+        `timeout` seconds for the session's lock (held by a turn on another
+        worker), brings the session up to date, and saves it when the turn
+        succeeds. Without one this does nothing.
+        """
+        if self.backend is None:
+            yield
+            return
+
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        version = self.backend.acquire(session.session_id, owner)
+        if version is None:
+            with self._lock:
+                self.lock_waits += 1
+        while version is None:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Session {session.session_id} is busy on another worker")
+            time.sleep(SESSION_LOCK_POLL_SECONDS)
+            version = self.backend.acquire(session.session_id, owner)
+
+        saved = False
+        try:
+            if version != session.state_version:
+                snapshot, version = self.backend.load(session.session_id)
+                if snapshot is not None:
+                    session.load_snapshot(snapshot)
+                    with self._lock:
+                        self.reloads += 1
+                session.state_version = version
+            yield
+            version = self.backend.save(session.session_id, session.snapshot(), owner)
+            saved = True
+            if version is None:
+                # The lock expired mid-turn and another worker owns the session now
+                print(f"Session {session.session_id} changed elsewhere during a turn; this turn's state was not saved")
+                session.state_version = -1
+            else:
+                session.state_version = version
+        finally:
+            if not saved:
+                self.backend.release(session.session_id, owner)
+
+    def note_affinity(self, hint: str):
+        """Counts a client's X-Session-Affinity hint against this worker's id."""
+        with self._lock:
+            if hint == WORKER_ID:
+                self.affinity_hits += 1
+            else:
+                self.affinity_misses += 1
+
+    def __contains__(self, session_id: str):
+        if self.backend is not None:
+            return session_id in self._sessions or self.backend.load(session_id)[0] is not None
+        return session_id in self._sessions or self._spill_path(session_id).exists()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        return {
+            "live_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl_seconds": self.idle_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rehydrations": self.rehydrations,
+            "evictions": self.evictions,
+            "backend": type(self.backend).__name__ if self.backend is not None else "memory",
+            "worker_id": WORKER_ID,
+            "reloads": self.reloads,
+            "lock_waits": self.lock_waits,
+            "affinity_hits": self.affinity_hits,
+            "affinity_misses": self.affinity_misses,
+            "expired": self.expired,
+        }
@@ -0,0 +1,118 @@
+"""
+Per-session memoization of read-only tool calls.
+
+The model often repeats a lookup with the same arguments within a conversation
+(re-reading its context, or re-quoting after the user changes the tenure).
+Those repeats are answered from the session's cache instead of re-running the
+tool and re-publishing its event.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics import counter
+
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "1") == "1"
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "64"))
+
+# Seconds a result stays valid. Tools not listed here (send_otp, verify_otp,
+# generate_sanction) have side effects and are never cached.
+TOOL_CACHE_TTLS = {
+    "get_offer": 300,
+    "get_credit_score": 300,
+    "negotiate_loan": 600,
+    "evaluate_loan": 600
+}
+
+# A successful call to the key tool drops cached results of the listed tools
+INVALIDATED_BY = {
+    # A fresh verification means fresh offer and bureau data
+    "verify_otp": ("get_offer", "get_credit_score"),
+    # A sanctioned loan closes the application; any new one is quoted afresh
+    "generate_sanction": ("negotiate_loan", "evaluate_loan")
+}
+
+TOOL_CACHE_LOOKUPS = counter("tool_cache_lookups_total", "Per-session tool cache lookups", ["tool", "outcome"])
+
+# Totals for /sessions/stats, {tool: {"hit": n, "miss": n, "expired": n}}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(tool: str, outcome: str):
+    TOOL_CACHE_LOOKUPS.inc(tool=tool, outcome=outcome)
+    with _stats_lock:
+        counts = _stats.setdefault(tool, {"hit": 0, "miss": 0, "expired": 0})
+        counts[outcome] += 1
+
+
+def stats() -> dict:
+    with _stats_lock:
+        snapshot = {tool: dict(counts) for tool, counts in _stats.items()}
+    for counts in snapshot.values():
+        total = sum(counts.values())
+        counts["hit_rate"] = round(counts["hit"] / total, 4) if total else 0.0
+    return snapshot
+
+
+def cache_key(name: str, arguments: dict) -> tuple:
+    """Argument values normalized so 500000 and 500000.0, as the model may send either, share an entry."""
+    normalized = {
+        key: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+        for key, value in arguments.items()
+    }
+    return name, json.dumps(normalized, sort_keys=True, default=str)
+
+
+class ToolCache:
+    def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (result, event_id, stored_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(name: str) -> bool:
+        return TOOL_CACHE_ENABLED and name in TOOL_CACHE_TTLS
+
+    def get(self, name: str, arguments: dict):
+        """Returns (result, event_id of the original call, age in seconds), or None."""
+        key = cache_key(name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, event_id, stored_at = entry
+                age = time.time() - stored_at
+                if age <= TOOL_CACHE_TTLS[name]:
+                    self._entries.move_to_end(key)
+                    _count(name, "hit")
+                    return result, event_id, age
+                del self._entries[key]
+        _count(name, "expired" if entry is not None else "miss")
+        return None
+
+    def put(self, name: str, arguments: dict, result, event_id: str):
+        # Failed lookups are retried rather than remembered
+        if isinstance(result, dict) and "error" in result:
+            return
+        key = cache_key(name, arguments)
+        with self._lock:
+            self._entries[key] = (result, event_id, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_after(self, name: str, result):
+        """Applies INVALIDATED_BY for a completed call."""
+        tools = INVALIDATED_BY.get(name)
+        if not tools or not isinstance(result, dict):
+            return
+        if not (result.get("verified") or result.get("success")):
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in tools]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,6 +1,8 @@
 from .crm import get_customer_by_id
+from .latency import simulate
 
 def get_credit_score(customer_id: str):
+    simulate("credit")
     customer = get_customer_by_id(customer_id)
     if not customer:
         return {"error": "Customer not found"}
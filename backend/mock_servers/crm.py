@@ -1,24 +1,23 @@
-import json
-from pathlib import Path
 from typing import Optional
 
-# Load customer data
-DATA_FILE = Path(__file__).parent.parent / "data" / "customers.json"
+from utils.metrics import histogram
+from .customer_store import store
+from .latency import simulate
+
+CRM_LOOKUP_SECONDS = histogram(
+    "crm_lookup_duration_seconds", "Customer store lookup latency", ["key"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
 
 def get_customers():
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
+    return list(store.all())
 
 def get_customer_by_phone(phone: str) -> Optional[dict]:
-    customers = get_customers()
-    for cust in customers:
-        if cust["phone"] == phone:
-            return cust
-    return None
+    simulate("crm")
+    with CRM_LOOKUP_SECONDS.time(key="phone"):
+        return store.get_by_phone(phone)
 
 def get_customer_by_id(customer_id: str) -> Optional[dict]:
-    customers = get_customers()
-    for cust in customers:
-        if cust["id"] == customer_id:
-            return cust
-    return None
+    simulate("crm")
+    with CRM_LOOKUP_SECONDS.time(key="id"):
+        return store.get_by_id(customer_id)
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "customers.json"
+
+# Path to the customer base. A ``.db``/``.sqlite`` file selects the SQLite-backed store.
+CUSTOMER_STORE_PATH = os.getenv("CUSTOMER_STORE_PATH", str(DATA_FILE))
+# Minimum seconds between mtime checks on the JSON file (0 = check on every lookup).
+CUSTOMER_STORE_CHECK_INTERVAL = float(os.getenv("CUSTOMER_STORE_CHECK_INTERVAL", "1.0"))
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+
+class JSONCustomerStore:
+    """
+    Customer table loaded once from a JSON array.
+    Rows are kept as tuples with hash indexes on phone and id, and the file is
+    re-parsed only when its mtime changes.
+    """
+
+    def __init__(self, path, check_interval: float = CUSTOMER_STORE_CHECK_INTERVAL):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self.fields = ()
+        self.loads = 0
+        self._rows = []
+        self._by_phone = {}
+        self._by_id = {}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                self._load(mtime)
+
+    def _load(self, mtime):
+        with open(self.path, "r") as f:
+            customers = json.load(f)
+
+        fields = []
+        for cust in customers:
+            for key in cust:
+                if key not in fields:
+                    fields.append(key)
+
+        rows = []
+        by_phone = {}
+        by_id = {}
+        for idx, cust in enumerate(customers):
+            rows.append(tuple(cust.get(key) for key in fields))
+            # First match wins, as with the previous linear scan
+            by_phone.setdefault(cust.get("phone"), idx)
+            by_id.setdefault(cust.get("id"), idx)
+
+        # Swap in one step so concurrent readers never see a half-built index
+        self.fields, self._rows, self._by_phone, self._by_id = tuple(fields), rows, by_phone, by_id
+        self._mtime = mtime
+        self.loads += 1
+
+    def _record(self, idx) -> Optional[dict]:
+        if idx is None:
+            return None
+        return dict(zip(self.fields, self._rows[idx]))
+
+    def get_by_phone(self, phone: str) -> Optional[dict]:
+        self._maybe_reload()
+        return self._record(self._by_phone.get(phone))
+
+    def get_by_id(self, customer_id: str) -> Optional[dict]:
+        self._maybe_reload()
+        return self._record(self._by_id.get(customer_id))
+
+    def all(self) -> Iterator[dict]:
+        self._maybe_reload()
+        for row in self._rows:
+            yield dict(zip(self.fields, row))
+
+    def __len__(self):
+        self._maybe_reload()
+        return len(self._rows)
+
+
+class SQLiteCustomerStore:
+    """
+    Customer table served from an indexed SQLite file.
+    Nothing is parsed up front; the file is memory-mapped by SQLite and each
+    lookup is a single index probe. Use ``build_sqlite`` to create the file.
+    """
+
+    def __init__(self, path, mmap_size: int = 1 << 30):
+        self.path = Path(path)
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self.fields = tuple(
+            row[1] for row in self._conn().execute("PRAGMA table_info(customers)")
+        )
+        self._select = f"SELECT {', '.join(self.fields)} FROM customers"
+
+    def _conn(self):
+        # sqlite3 connections are bound to their creating thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+            self._local.conn = conn
+        return conn
+
+    def _one(self, column: str, value) -> Optional[dict]:
+        row = self._conn().execute(f"{self._select} WHERE {column} = ? LIMIT 1", (value,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.fields, row))
+
+    def get_by_phone(self, phone: str) -> Optional[dict]:
+        return self._one("phone", phone)
+
+    def get_by_id(self, customer_id: str) -> Optional[dict]:
+        return self._one("id", customer_id)
+
+    def all(self) -> Iterator[dict]:
+        for row in self._conn().execute(self._select):
+            yield dict(zip(self.fields, row))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+
+def build_sqlite(customers, db_path):
+    """
+    Writes an iterable of customer dicts to a SQLite file with phone and id indexes.
+    Accepts a list, a generator, or a path to a JSON file.
+    """
+    if isinstance(customers, (str, Path)):
+        with open(customers, "r") as f:
+            customers = json.load(f)
+
+    customers = iter(customers)
+    first = next(customers, None)
+    if first is None:
+        raise ValueError("No customers to write")
+    fields = list(first)
+
+    db_path = Path(db_path)
+    if db_path.exists():
+        db_path.unlink()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(f"CREATE TABLE customers ({', '.join(fields)})")
+    insert = f"INSERT INTO customers VALUES ({', '.join('?' for _ in fields)})"
+
+    def _rows():
+        yield tuple(first.get(key) for key in fields)
+        for cust in customers:
+            yield tuple(cust.get(key) for key in fields)
+
+    conn.executemany(insert, _rows())
+    conn.execute("CREATE INDEX idx_customers_phone ON customers (phone)")
+    conn.execute("CREATE INDEX idx_customers_id ON customers (id)")
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def open_store(path=CUSTOMER_STORE_PATH):
+    if Path(path).suffix.lower() in SQLITE_SUFFIXES:
+        return SQLiteCustomerStore(path)
+    return JSONCustomerStore(path)
+
+
+# Global instance
+store = open_store()
+
+if __name__ == "__main__":
+    # python -m mock_servers.customer_store data/customers.json data/customers.db
+    if len(sys.argv) != 3:
+        print("Usage: python -m mock_servers.customer_store <customers.json> <customers.db>")
+        sys.exit(1)
+    print(f"Wrote {build_sqlite(sys.argv[1], sys.argv[2])}")
@@ -0,0 +1,14 @@
+import os
+import time
+
+# Artificial per-call latency for the mock services, to measure what concurrency buys.
+# e.g. MOCK_OFFER_LATENCY_MS=80 MOCK_CREDIT_LATENCY_MS=120
+LATENCY_MS = {
+    service: float(os.getenv(f"MOCK_{service.upper()}_LATENCY_MS", "0"))
+    for service in ("crm", "offer", "credit")
+}
+
+def simulate(service: str):
+    delay_ms = LATENCY_MS.get(service, 0)
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000)
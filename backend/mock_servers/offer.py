@@ -1,6 +1,8 @@
 from .crm import get_customer_by_id
+from .latency import simulate
 
 def get_offer(customer_id: str):
+    simulate("offer")
     customer = get_customer_by_id(customer_id)
     if not customer:
         return {"error": "Customer not found"}
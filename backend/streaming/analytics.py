@@ -0,0 +1,172 @@
+"""
+Loan funnel analytics over the agent event stream.
+
+Per session, `advance` moves a small state dict through the funnel
+(OTP sent -> verified -> offer -> underwriting decision -> sanction) and
+returns one transition per step reached, with its latency. Transitions are
+then counted per tumbling window and step (`new_aggregate` / `add` / `merge`),
+and `summarize` turns a window's per-step aggregates into conversion rates
+and latencies.
+
+Plain Python without Flink or Kafka imports: flink_job.py runs these
+functions inside its operators and local_runner.py runs them over a file.
+"""
+import json
+import os
+from typing import Optional
+
+STEP_OTP_SENT = "OTP_SENT"
+STEP_VERIFIED = "VERIFIED"
+STEP_OFFER = "OFFER"
+STEP_DECISION = "DECISION"
+STEP_SANCTIONED = "SANCTIONED"
+FUNNEL_STEPS = (STEP_OTP_SENT, STEP_VERIFIED, STEP_OFFER, STEP_DECISION, STEP_SANCTIONED)
+
+# Underwriting outcomes that close the decision step; REQUEST_SALARY_SLIP does not
+FINAL_DECISIONS = ("APPROVE", "REJECT")
+
+FUNNEL_WINDOW_SECONDS = int(os.getenv("FUNNEL_WINDOW_SECONDS", "60"))
+
+
+def parse_event(raw) -> Optional[dict]:
+    """
+    An event from a JSON Kafka value, an NDJSON line or an already decoded
+    dict, or None if it is not one. Producer spool records
+    ({"topic", "key", "message"}) are unwrapped.
+    """
+    if isinstance(raw, dict):
+        event = raw
+    else:
+        try:
+            event = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+    if not isinstance(event, dict):
+        return None
+    if "message" in event and "event_type" not in event:
+        event = event["message"]
+    if not isinstance(event, dict) or "event_type" not in event or not isinstance(event.get("payload"), dict):
+        return None
+    return event
+
+
+def session_key(event: dict) -> str:
+    return event.get("session_id") or ""
+
+
+def funnel_steps(event: dict) -> list:
+    """Funnel steps an event shows the session has reached, in funnel order."""
+    payload = event["payload"]
+    # A repeat served from the tool cache proves nothing new
+    if "duplicate_of" in payload:
+        return []
+    result = payload.get("result")
+    if not isinstance(result, dict):
+        return []
+
+    event_type = event["event_type"]
+    if event_type == "OTP_SEND":
+        return [STEP_OTP_SENT] if result.get("status") == "SUCCESS" else []
+    if event_type == "OTP_VERIFY":
+        if not result.get("verified"):
+            return []
+        # Verification prefetches the pre-approved offer
+        return [STEP_VERIFIED, STEP_OFFER] if result.get("pre_approved_limit") is not None else [STEP_VERIFIED]
+    if event_type == "OFFER_CHECK":
+        return [STEP_OFFER] if result.get("pre_approved_limit") is not None else []
+    if event_type == "UNDERWRITING":
+        return [STEP_DECISION] if result.get("decision") in FINAL_DECISIONS else []
+    if event_type == "SANCTION_GENERATED":
+        return [STEP_SANCTIONED] if result.get("success") else []
+    return []
+
+
+def new_state() -> dict:
+    return {"reached": {}}  # {step: event timestamp}
+
+
+def advance(state: dict, event: dict) -> list:
+    """
+    Applies one event to a session's funnel state (in place) and returns a
+    transition dict for each step reached for the first time.
+    """
+    transitions = []
+    reached = state["reached"]
+    timestamp = float(event.get("timestamp") or 0.0)
+    for step in funnel_steps(event):
+        if step in reached:
+            continue
+        reached[step] = timestamp
+        started_at = reached.get(STEP_OTP_SENT, timestamp)
+        earlier = [reached[previous] for previous in FUNNEL_STEPS[:FUNNEL_STEPS.index(step)] if previous in reached]
+        transition = {
+            "session_id": session_key(event),
+            "step": step,
+            "timestamp": timestamp,
+            "since_start_ms": round((timestamp - started_at) * 1000, 3),
+            "since_previous_ms": round((timestamp - max(earlier)) * 1000, 3) if earlier else 0.0
+        }
+        if step == STEP_DECISION:
+            transition["decision"] = event["payload"]["result"]["decision"]
+        transitions.append(transition)
+    return transitions
+
+
+def window_start(timestamp: float, size_seconds: int = FUNNEL_WINDOW_SECONDS) -> float:
+    return timestamp - timestamp % size_seconds
+
+
+def new_aggregate() -> dict:
+    return {"count": 0, "since_start_ms_sum": 0.0, "since_start_ms_max": 0.0, "since_previous_ms_sum": 0.0, "decisions": {}}
+
+
+def add(aggregate: dict, transition: dict) -> dict:
+    aggregate["count"] += 1
+    aggregate["since_start_ms_sum"] += transition["since_start_ms"]
+    aggregate["since_start_ms_max"] = max(aggregate["since_start_ms_max"], transition["since_start_ms"])
+    aggregate["since_previous_ms_sum"] += transition["since_previous_ms"]
+    decision = transition.get("decision")
+    if decision:
+        aggregate["decisions"][decision] = aggregate["decisions"].get(decision, 0) + 1
+    return aggregate
+
+
+def merge(left: dict, right: dict) -> dict:
+    merged = new_aggregate()
+    for aggregate in (left, right):
+        merged["count"] += aggregate["count"]
+        merged["since_start_ms_sum"] += aggregate["since_start_ms_sum"]
+        merged["since_start_ms_max"] = max(merged["since_start_ms_max"], aggregate["since_start_ms_max"])
+        merged["since_previous_ms_sum"] += aggregate["since_previous_ms_sum"]
+        for decision, count in aggregate["decisions"].items():
+            merged["decisions"][decision] = merged["decisions"].get(decision, 0) + count
+    return merged
+
+
+def summarize(start: float, size_seconds: int, aggregates: dict) -> dict:
+    """
+    One output record for a window from its {step: aggregate}. Conversion is
+    each step's count over the sessions that started (OTP sent) in the window.
+    """
+    started = aggregates.get(STEP_OTP_SENT, new_aggregate())["count"]
+    steps = {}
+    for step in FUNNEL_STEPS:
+        aggregate = aggregates.get(step)
+        if aggregate is None or not aggregate["count"]:
+            continue
+        count = aggregate["count"]
+        steps[step] = {
+            "count": count,
+            "conversion": round(count / started, 4) if started else None,
+            "avg_since_start_ms": round(aggregate["since_start_ms_sum"] / count, 3),
+            "max_since_start_ms": round(aggregate["since_start_ms_max"], 3),
+            "avg_since_previous_ms": round(aggregate["since_previous_ms_sum"] / count, 3)
+        }
+    decisions = aggregates.get(STEP_DECISION, new_aggregate())["decisions"]
+    return {
+        "window_start": start,
+        "window_end": start + size_seconds,
+        "sessions_started": started,
+        "steps": steps,
+        "decisions": dict(sorted(decisions.items()))
+    }
@@ -1,43 +1,153 @@
 
+import os
+import sys
+
 from pyflink.datastream import StreamExecutionEnvironment
 from pyflink.datastream.connectors.kafka import KafkaSource, KafkaSink, KafkaRecordSerializationSchema, KafkaOffsetsInitializer
-from pyflink.common.serialization import SimpleStringSchema
-from pyflink.common import WatermarkStrategy
+from pyflink.datastream.functions import AggregateFunction, KeyedProcessFunction, MapFunction, ProcessAllWindowFunction, ProcessWindowFunction
+from pyflink.datastream.state import StateTtlConfig, ValueStateDescriptor
+from pyflink.datastream.window import TumblingEventTimeWindows
+from pyflink.common.serialization import ByteArraySchema, SimpleStringSchema
+from pyflink.common.watermark_strategy import TimestampAssigner
+from pyflink.common.time import Duration, Time
+from pyflink.common import Types, WatermarkStrategy
 import json
 
-def process_event(event_str):
-    try:
-        event = json.loads(event_str)
-        print(f"PROCESSING: {event['event_type']} - Payload: {event['payload']}")
-        # In a real scenario, this would update a database or call an external API.
-        # For now, we just log to stdout which appears in Flink TaskManager logs.
-        return json.dumps({"status": "processed", "original": event})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
+# The funnel logic and event schema are shared with the backend and shipped to the workers below
+STREAMING_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, STREAMING_DIR)
+import analytics  # noqa: E402
+import schema as event_schema  # noqa: E402
+
+KAFKA_BOOTSTRAP = os.getenv("FLINK_KAFKA_BOOTSTRAP", "kafka:29092")
+EVENTS_TOPIC = "capital_connect_events"
+FUNNEL_METRICS_TOPIC = os.getenv("FUNNEL_METRICS_TOPIC", "capital_connect_funnel_metrics")
+# Match the events topic's partition count; sessions are spread across them by key
+FLINK_PARALLELISM = int(os.getenv("FLINK_PARALLELISM", "4"))
+# How late (in event time) an event may arrive and still count in its window
+FUNNEL_OUT_OF_ORDERNESS_SECONDS = int(os.getenv("FUNNEL_OUT_OF_ORDERNESS_SECONDS", "5"))
+# Funnel state of sessions that stop sending events is dropped after this long
+FUNNEL_STATE_TTL_HOURS = int(os.getenv("FUNNEL_STATE_TTL_HOURS", "24"))
+
+
+class DecodeEvent(MapFunction):
+    """Binary (any registered schema version) or legacy JSON Kafka values to event dicts."""
+
+    def __init__(self, registry):
+        # Pickled with every schema version loaded, so workers need no registry files
+        self.registry = registry
+
+    def map(self, value):
+        try:
+            return analytics.parse_event(self.registry.decode(value))
+        except Exception:
+            return None
+
+
+class EventTimestamp(TimestampAssigner):
+    def extract_timestamp(self, value, record_timestamp) -> int:
+        return int(float(value.get("timestamp") or 0) * 1000)
+
+
+class TrackFunnel(KeyedProcessFunction):
+    """Keeps each session's funnel state and emits a transition per step reached."""
+
+    def open(self, runtime_context):
+        descriptor = ValueStateDescriptor("funnel", Types.PICKLED_BYTE_ARRAY())
+        descriptor.enable_time_to_live(StateTtlConfig.new_builder(Time.hours(FUNNEL_STATE_TTL_HOURS)).build())
+        self.state = runtime_context.get_state(descriptor)
+
+    def process_element(self, value, ctx):
+        state = self.state.value() or analytics.new_state()
+        transitions = analytics.advance(state, value)
+        if transitions:
+            self.state.update(state)
+        for transition in transitions:
+            yield transition
+
+
+class StepAggregate(AggregateFunction):
+    def create_accumulator(self):
+        return analytics.new_aggregate()
+
+    def add(self, value, accumulator):
+        return analytics.add(accumulator, value)
+
+    def get_result(self, accumulator):
+        return accumulator
+
+    def merge(self, acc_a, acc_b):
+        return analytics.merge(acc_a, acc_b)
+
+
+class TagStep(ProcessWindowFunction):
+    def process(self, key, context, elements):
+        for aggregate in elements:
+            yield (key, aggregate)
+
+
+class SummarizeWindow(ProcessAllWindowFunction):
+    def process(self, context, elements):
+        window = context.window()
+        size_seconds = (window.end - window.start) // 1000
+        yield json.dumps(analytics.summarize(window.start / 1000, size_seconds, dict(elements)))
+
 
 def main():
     env = StreamExecutionEnvironment.get_execution_environment()
-    env.set_parallelism(1)
+    env.set_parallelism(FLINK_PARALLELISM)
+    env.add_python_file(os.path.join(STREAMING_DIR, "analytics.py"))
+    env.add_python_file(os.path.join(STREAMING_DIR, "schema.py"))
 
     # Kafka Connections
     # Note: Requires flink-sql-connector-kafka jar to be present in Flink lib/
-    
+
     source = KafkaSource.builder() \
-        .set_bootstrap_servers("kafka:29092") \
-        .set_topics("capital_connect_events") \
+        .set_bootstrap_servers(KAFKA_BOOTSTRAP) \
+        .set_topics(EVENTS_TOPIC) \
         .set_group_id("flink_processor_group") \
         .set_starting_offsets(KafkaOffsetsInitializer.earliest()) \
-        .set_value_only_deserializer(SimpleStringSchema()) \
+        .set_value_only_deserializer(ByteArraySchema()) \
+        .build()
+
+    sink = KafkaSink.builder() \
+        .set_bootstrap_servers(KAFKA_BOOTSTRAP) \
+        .set_record_serializer(
+            KafkaRecordSerializationSchema.builder()
+            .set_topic(FUNNEL_METRICS_TOPIC)
+            .set_value_serialization_schema(SimpleStringSchema())
+            .build()
+        ) \
         .build()
 
-    stream = env.from_source(source, WatermarkStrategy.no_watermarks(), "Kafka Source")
+    watermarks = WatermarkStrategy \
+        .for_bounded_out_of_orderness(Duration.of_seconds(FUNNEL_OUT_OF_ORDERNESS_SECONDS)) \
+        .with_timestamp_assigner(EventTimestamp()) \
+        .with_idleness(Duration.of_seconds(30))
+    window = TumblingEventTimeWindows.of(Time.seconds(analytics.FUNNEL_WINDOW_SECONDS))
+
+    events = env.from_source(source, WatermarkStrategy.no_watermarks(), "Kafka Source") \
+        .map(DecodeEvent(event_schema.registry), output_type=Types.PICKLED_BYTE_ARRAY()) \
+        .filter(lambda event: event is not None) \
+        .assign_timestamps_and_watermarks(watermarks)
+
+    # The producer keys events by session_id, so one session's events arrive in order on one subtask
+    transitions = events \
+        .key_by(analytics.session_key, key_type=Types.STRING()) \
+        .process(TrackFunnel(), output_type=Types.PICKLED_BYTE_ARRAY())
 
-    # Simple processing
-    processed_stream = stream.map(process_event)
+    # Per-step window aggregates in parallel; only the handful of results per window meet in window_all
+    summaries = transitions \
+        .key_by(lambda transition: transition["step"], key_type=Types.STRING()) \
+        .window(window) \
+        .aggregate(StepAggregate(), window_function=TagStep(),
+                   accumulator_type=Types.PICKLED_BYTE_ARRAY(), output_type=Types.PICKLED_BYTE_ARRAY()) \
+        .window_all(window) \
+        .process(SummarizeWindow(), output_type=Types.STRING())
 
-    processed_stream.print()
+    summaries.sink_to(sink)
 
-    env.execute("CapitalConnectEventProcessor")
+    env.execute("CapitalConnectFunnelAnalytics")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,138 @@
+"""
+Runs the funnel analytics of flink_job.py over an NDJSON file of events
+(one producer message per line, or the producer's spool file) without Kafka
+or a Flink cluster, and prints one summary per tumbling window.
+
+Like the Flink job, events are partitioned by session_id: a reader routes
+each line to one of `--parallelism` worker processes, each of which keeps
+the funnel state for its own sessions and partial window aggregates. The
+partials are merged into the window summaries at the end.
+
+    python -m streaming.local_runner spool/events.ndjson --parallelism 4 --window-seconds 60
+"""
+import argparse
+import json
+import multiprocessing
+import re
+import sys
+import zlib
+
+from streaming import analytics
+
+BATCH_LINES = 2000
+
+# Routing only needs the key, which is much cheaper to find than parsing the line
+SESSION_ID_PATTERN = re.compile(r'"session_id":\s*"((?:[^"\\]|\\.)*)"')
+
+
+class FunnelPartition:
+    """Keyed funnel state and per-window, per-step aggregates for one partition."""
+
+    def __init__(self, window_seconds: int):
+        self.window_seconds = window_seconds
+        self.sessions = {}  # {session_id: funnel state}
+        self.windows = {}  # {window start: {step: aggregate}}
+        self.events = 0
+
+    def process(self, line: str):
+        event = analytics.parse_event(line)
+        if event is None:
+            return
+        self.events += 1
+        key = analytics.session_key(event)
+        state = self.sessions.get(key)
+        if state is None:
+            state = self.sessions[key] = analytics.new_state()
+        for transition in analytics.advance(state, event):
+            window = self.windows.setdefault(analytics.window_start(transition["timestamp"], self.window_seconds), {})
+            aggregate = window.get(transition["step"])
+            if aggregate is None:
+                aggregate = window[transition["step"]] = analytics.new_aggregate()
+            analytics.add(aggregate, transition)
+
+
+def partition_of(line: str, parallelism: int) -> int:
+    match = SESSION_ID_PATTERN.search(line)
+    # crc32 rather than hash(): it must agree across processes
+    return zlib.crc32(match.group(1).encode("utf-8")) % parallelism if match else 0
+
+
+def _worker(lines, results, window_seconds: int):
+    partition = FunnelPartition(window_seconds)
+    while True:
+        batch = lines.get()
+        if batch is None:
+            break
+        for line in batch:
+            partition.process(line)
+    results.put((partition.events, partition.windows))
+
+
+def merge_windows(partials, window_seconds: int) -> list:
+    merged = {}
+    for windows in partials:
+        for start, steps in windows.items():
+            window = merged.setdefault(start, {})
+            for step, aggregate in steps.items():
+                window[step] = analytics.merge(window[step], aggregate) if step in window else aggregate
+    return [analytics.summarize(start, window_seconds, merged[start]) for start in sorted(merged)]
+
+
+def run(path: str, parallelism: int = 1, window_seconds: int = analytics.FUNNEL_WINDOW_SECONDS):
+    """Returns (events processed, window summaries in time order)."""
+    if parallelism <= 1:
+        partition = FunnelPartition(window_seconds)
+        with open(path, "r") as f:
+            for line in f:
+                partition.process(line)
+        return partition.events, merge_windows([partition.windows], window_seconds)
+
+    # spawn, not fork: callers such as the app have live threads
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=64) for _ in range(parallelism)]
+    results = context.Queue()
+    workers = [context.Process(target=_worker, args=(queue, results, window_seconds), daemon=True) for queue in queues]
+    for worker in workers:
+        worker.start()
+
+    batches = [[] for _ in range(parallelism)]
+    with open(path, "r") as f:
+        for line in f:
+            index = partition_of(line, parallelism)
+            batch = batches[index]
+            batch.append(line)
+            if len(batch) >= BATCH_LINES:
+                queues[index].put(batch)
+                batches[index] = []
+    for queue, batch in zip(queues, batches):
+        if batch:
+            queue.put(batch)
+        queue.put(None)
+
+    partials = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return sum(events for events, _ in partials), merge_windows([windows for _, windows in partials], window_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="NDJSON file of events")
+    parser.add_argument("--parallelism", type=int, default=1)
+    parser.add_argument("--window-seconds", type=int, default=analytics.FUNNEL_WINDOW_SECONDS)
+    parser.add_argument("--output", help="Write the summaries here instead of stdout")
+    args = parser.parse_args()
+
+    events, summaries = run(args.path, args.parallelism, args.window_seconds)
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for summary in summaries:
+            out.write(json.dumps(summary) + "\n")
+    finally:
+        if args.output:
+            out.close()
+    print(f"{events} events, {len(summaries)} windows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
 
+import atexit
 import json
 import os
-from kafka import KafkaProducer
-from threading import Thread
+import queue
+import uuid
+from pathlib import Path
+from threading import Lock, Thread
 import time
+from streaming import schema as event_schema
+from utils.metrics import gauge, histogram
+
+EVENT_SEND_SECONDS = histogram("event_send_duration_seconds", "Time from enqueue (or send, in sync mode) to broker acknowledgement", ["mode"])
 
 KAFKA_BROKER = os.getenv("KAFKA_BROKER", "localhost:9092")
+# "batched" enqueues and sends in the background; "sync" flushes after every event
+KAFKA_PRODUCER_MODE = os.getenv("KAFKA_PRODUCER_MODE", "batched")
+KAFKA_QUEUE_SIZE = int(os.getenv("KAFKA_QUEUE_SIZE", "10000"))
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "50"))
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", str(64 * 1024)))
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "gzip") or None
+# "binary" encodes values with the versioned schema in streaming/schema.py; "json" sends plain JSON
+KAFKA_EVENT_FORMAT = os.getenv("KAFKA_EVENT_FORMAT", "binary")
+KAFKA_SPOOL_FILE = Path(os.getenv("KAFKA_SPOOL_FILE", str(Path(__file__).parent.parent / "spool" / "events.ndjson")))
+# An event the broker rejected this many times is moved to the dead-letter file instead of the spool
+KAFKA_MAX_DELIVERY_ATTEMPTS = int(os.getenv("KAFKA_MAX_DELIVERY_ATTEMPTS", "5"))
+KAFKA_DEAD_LETTER_FILE = Path(os.getenv("KAFKA_DEAD_LETTER_FILE", str(KAFKA_SPOOL_FILE.with_suffix(".dead.ndjson"))))
+# A rejected event waits base * 2^(attempts - 1) seconds, up to the cap, before it is replayed
+KAFKA_RETRY_BACKOFF_SECONDS = float(os.getenv("KAFKA_RETRY_BACKOFF_SECONDS", "1"))
+KAFKA_RETRY_BACKOFF_MAX_SECONDS = float(os.getenv("KAFKA_RETRY_BACKOFF_MAX_SECONDS", "300"))
 
 class EventProducer:
     _instance = None
@@ -14,39 +36,289 @@ class EventProducer:
         if cls._instance is None:
             cls._instance = super(EventProducer, cls).__new__(cls)
             cls._instance.producer = None
-            cls._instance.connect()
+            cls._instance.mode = KAFKA_PRODUCER_MODE
+            cls._instance.queue = queue.Queue(maxsize=KAFKA_QUEUE_SIZE)
+            cls._instance.spool_file = KAFKA_SPOOL_FILE
+            cls._instance.dead_letter_file = KAFKA_DEAD_LETTER_FILE
+            # Nothing in the spool is due before this (time.time()); 0 replays whatever a previous run left
+            cls._instance.next_replay_at = 0.0
+            cls._instance._spool_lock = Lock()
+            cls._instance._stats_lock = Lock()
+            cls._instance.counters = {
+                "enqueued": 0, "sent": 0, "failed": 0,
+                "spooled": 0, "replayed": 0, "dropped": 0, "dead_lettered": 0
+            }
+            cls._instance.send_latency_total_ms = 0.0
+            cls._instance.send_latency_max_ms = 0.0
+            cls._instance.started = False
+            cls._instance._start_lock = Lock()
         return cls._instance
 
+    def start(self):
+        """
+        Starts connecting to Kafka and, in batched mode, the background sender.
+        Called from the app's lifespan hook, or by the first event sent.
+        """
+        if self.started:
+            return
+        with self._start_lock:
+            if self.started:
+                return
+            self.connect()
+            if self.mode == "batched":
+                Thread(target=self._sender_loop, daemon=True).start()
+                atexit.register(self.close)
+            self.started = True
+
     def connect(self):
         def _connect_loop():
+            from kafka import KafkaProducer
+
             while not self.producer:
                 try:
                     self.producer = KafkaProducer(
                         bootstrap_servers=KAFKA_BROKER,
-                        value_serializer=lambda v: json.dumps(v).encode('utf-8')
+                        key_serializer=lambda k: k.encode('utf-8') if k is not None else None,
+                        value_serializer=self._serializer(),
+                        linger_ms=KAFKA_LINGER_MS,
+                        batch_size=KAFKA_BATCH_SIZE,
+                        compression_type=KAFKA_COMPRESSION
                     )
                     print("Connected to Kafka")
                 except Exception as e:
                     print(f"Failed to connect to Kafka ({e}), retrying in 5s...")
                     time.sleep(5)
-        
+
         # Connect in background to avoid blocking startup if Kafka is slow
         Thread(target=_connect_loop, daemon=True).start()
 
-    def send_event(self, topic: str, event_type: str, payload: dict):
+    @staticmethod
+    def _serializer():
+        if KAFKA_EVENT_FORMAT == "binary":
+            return event_schema.encode
+        return lambda v: json.dumps(v).encode('utf-8')
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.counters[name] += n
+
+    def send_event(self, topic: str, event_type: str, payload: dict, key: str = None):
+        """
+        `key` (the chat session id) picks the partition, so one session's
+        events stay in order for keyed consumers.
+        """
+        if not self.started:
+            self.start()
+        message = {
+            "event_type": event_type,
+            "session_id": key,
+            "payload": payload,
+            "timestamp": time.time()
+        }
+
+        if self.mode != "batched":
+            self._send_sync(topic, key, message)
+            return
+
+        # Never blocks the caller: the background sender does all broker I/O
+        try:
+            self.queue.put_nowait((topic, key, message, time.perf_counter()))
+            self._count("enqueued")
+        except queue.Full:
+            self._count("dropped")
+            print(f"Event queue full. Dropped event {event_type}")
+
+    def _send_sync(self, topic: str, key, message: dict):
         if self.producer:
+            self._maybe_replay_spool()
             try:
-                message = {
-                    "event_type": event_type,
-                    "payload": payload,
-                    "timestamp": time.time()
-                }
-                self.producer.send(topic, value=message)
-                self.producer.flush() 
-                print(f"Sent event {event_type} to {topic}")
+                start = time.perf_counter()
+                self.producer.send(topic, key=key, value=message)
+                self.producer.flush()
+                EVENT_SEND_SECONDS.observe(time.perf_counter() - start, mode="sync")
+                self._count("sent")
+                print(f"Sent event {message['event_type']} to {topic}")
             except Exception as e:
-                print(f"Error sending event: {e}")
+                self._on_error(topic, key, message, 0, e)
         else:
-            print(f"Kafka producer not ready. Dropped event {event_type}")
+            self._spool(topic, key, message)
+
+    def _sender_loop(self):
+        while True:
+            if self.producer:
+                self._maybe_replay_spool()
+            try:
+                topic, key, message, enqueued_at = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._dispatch(topic, key, message, enqueued_at)
+            except Exception as e:
+                print(f"Error dispatching event {message['event_type']}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _maybe_replay_spool(self):
+        if time.time() < self.next_replay_at:
+            return
+        try:
+            self._replay_spool()
+        except Exception as e:
+            # Never let a bad spool take the sender down with it
+            print(f"Error replaying spooled events: {e}")
+            self.next_replay_at = time.time() + KAFKA_RETRY_BACKOFF_SECONDS
+
+    def _dispatch(self, topic: str, key, message: dict, enqueued_at: float = None, attempts: int = 0):
+        """`attempts` counts earlier deliveries of this event that the broker rejected."""
+        if not self.producer:
+            self._spool(topic, key, message, attempts)
+            return
+        try:
+            # The KafkaProducer batches, compresses and lingers internally;
+            # delivery is confirmed asynchronously through the callbacks
+            future = self.producer.send(topic, key=key, value=message)
+            future.add_callback(self._on_sent, enqueued_at)
+            future.add_errback(self._on_error, topic, key, message, attempts)
+        except Exception as e:
+            self._on_error(topic, key, message, attempts, e)
+
+    def _on_sent(self, enqueued_at, _metadata):
+        self._count("sent")
+        if enqueued_at is not None:
+            latency_ms = (time.perf_counter() - enqueued_at) * 1000
+            EVENT_SEND_SECONDS.observe(latency_ms / 1000, mode="batched")
+            with self._stats_lock:
+                self.send_latency_total_ms += latency_ms
+                self.send_latency_max_ms = max(self.send_latency_max_ms, latency_ms)
+
+    def _on_error(self, topic, key, message, attempts, exc):
+        self._count("failed")
+        attempts += 1
+        print(f"Error sending event {message['event_type']} (attempt {attempts}/{KAFKA_MAX_DELIVERY_ATTEMPTS}): {exc}")
+        if attempts >= KAFKA_MAX_DELIVERY_ATTEMPTS:
+            self._dead_letter({"topic": topic, "key": key, "message": message, "attempts": attempts, "error": str(exc)})
+            return
+        delay = min(KAFKA_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), KAFKA_RETRY_BACKOFF_MAX_SECONDS)
+        self._spool(topic, key, message, attempts, retry_at=time.time() + delay)
+
+    def _append(self, path: Path, line: str, retry_at: float = None):
+        with self._spool_lock:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            with open(path, "a") as f:
+                f.write(line + "\n")
+            if retry_at is not None:
+                self.next_replay_at = min(self.next_replay_at, retry_at)
+
+    def _spool(self, topic: str, key, message: dict, attempts: int = 0, retry_at: float = 0.0):
+        """Appends an undeliverable event to the local spool for replay once connected and `retry_at` has passed."""
+        self._append(self.spool_file, json.dumps(
+            {"topic": topic, "key": key, "message": message, "attempts": attempts, "retry_at": retry_at}
+        ), retry_at)
+        self._count("spooled")
+
+    def _dead_letter(self, record: dict):
+        """Keeps an event the broker will not take, or a spool line that cannot be read, for inspection."""
+        self._append(self.dead_letter_file, json.dumps(record))
+        self._count("dead_lettered")
+        print(f"Moved an undeliverable event to {self.dead_letter_file}")
+
+    def _replay_name(self) -> Path:
+        return self.spool_file.with_name(f"{self.spool_file.name}.{os.getpid()}.{uuid.uuid4().hex}.replaying")
+
+    def _claim(self, path: Path):
+        """
+        Atomically renames `path` to a name only this call uses, so workers (or
+        request threads in sync mode) replaying at once never share a file.
+        Returns the claimed path, or None if someone else claimed it first.
+        """
+        claimed = self._replay_name()
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        return claimed
+
+    def _orphaned_replays(self) -> list:
+        # Replay files of a worker that died mid-replay carry its pid
+        orphans = []
+        for path in self.spool_file.parent.glob(f"{self.spool_file.name}.*.replaying"):
+            try:
+                pid = int(path.name[len(self.spool_file.name) + 1:].split(".")[0])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                orphans.append(path)
+            except (ValueError, OSError):
+                continue
+        return orphans
+
+    def _replay_spool(self):
+        now = time.time()
+        with self._spool_lock:
+            # Lowered again by anything spooled from here on
+            self.next_replay_at = now + KAFKA_RETRY_BACKOFF_MAX_SECONDS
+        # Move the spool aside first so events that fail again are re-spooled cleanly
+        claimed = [self._claim(path) for path in [self.spool_file, *self._orphaned_replays()]]
+        claimed = [path for path in claimed if path is not None]
+
+        replayed = 0
+        for replay_file in claimed:
+            with open(replay_file, "r") as f:
+                for line in f:
+                    if line.strip():
+                        replayed += self._replay_line(line.rstrip("\n"), now)
+            replay_file.unlink()
+        if replayed:
+            self._count("replayed", replayed)
+            print(f"Replayed {replayed} spooled events")
+
+    def _replay_line(self, line: str, now: float) -> int:
+        try:
+            record = json.loads(line)
+            topic, key, message = record["topic"], record.get("key"), record["message"]
+            attempts, retry_at = int(record.get("attempts", 0)), float(record.get("retry_at", 0.0))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # A corrupt or half-written line; keep it rather than retrying it forever
+            self._dead_letter({"line": line, "error": f"Unreadable spool line: {e}"})
+            return 0
+        if retry_at > now:
+            # Still backing off: put it back untouched
+            self._append(self.spool_file, line, retry_at)
+            return 0
+        try:
+            self._dispatch(topic, key, message, attempts=attempts)
+        except Exception as e:
+            self._on_error(topic, key, message, attempts, e)
+        return 1
+
+    def close(self, timeout: float = 5.0):
+        """Drains the in-memory queue and flushes pending batches."""
+        deadline = time.time() + timeout
+        while not self.queue.empty() and time.time() < deadline:
+            time.sleep(0.05)
+        if self.producer:
+            try:
+                self.producer.flush(timeout=max(deadline - time.time(), 0))
+            except Exception as e:
+                print(f"Error flushing events: {e}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            sent = self.counters["sent"]
+            stats = dict(self.counters)
+            stats.update({
+                "mode": self.mode,
+                "format": KAFKA_EVENT_FORMAT,
+                "started": self.started,
+                "connected": self.producer is not None,
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "send_latency_avg_ms": round(self.send_latency_total_ms / sent, 3) if sent else 0.0,
+                "send_latency_max_ms": round(self.send_latency_max_ms, 3),
+            })
+        return stats
 
 producer = EventProducer()
+
+gauge("event_queue_depth", "Events waiting in the producer's in-memory queue", function=lambda: producer.queue.qsize())
+gauge("events_total", "Producer event outcomes since start", ["outcome"],
+      function=lambda: {(name,): value for name, value in producer.counters.items()})
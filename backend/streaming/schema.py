@@ -0,0 +1,347 @@
+"""
+Compact binary encoding for capital_connect_events, described by versioned
+schemas.
+
+A message is a magic byte, the schema version as a varint, then the fields
+the schema names for its event type, in schema order. Each value is one tag
+byte followed by its data: varints for ints, 8-byte doubles, the index for
+strings listed as `symbols`, raw bytes for `hex` strings, nested records.
+Anything the schema does not describe (a new field, an unexpected type) is
+still carried as JSON, so decoding always returns the message as sent.
+
+Schemas live in a directory of `<subject>.v<N>.json` files, a local stand-in
+for a schema registry. Producers write with the latest version. Consumers
+decode any message with the version named in its header.
+JSON messages (anything starting with "{") are still decoded, so topics and
+spools written before this format are read unchanged.
+"""
+import json
+import os
+import struct
+import threading
+from pathlib import Path
+
+EVENT_SCHEMA_DIR = Path(os.getenv("EVENT_SCHEMA_DIR", str(Path(__file__).parent / "schemas")))
+EVENT_SCHEMA_SUBJECT = "capital_connect_events"
+
+MAGIC = 0xCE
+
+# Value tags
+ABSENT, NULL, FALSE, TRUE, INT, DOUBLE, STRING, SYMBOL, HEX, RECORD, JSON = range(11)
+
+_DOUBLE = struct.Struct("<d")
+_ABSENT = object()
+
+
+class SchemaError(Exception):
+    pass
+
+
+class Field:
+    __slots__ = ("name", "type", "symbols", "symbol_index", "fields", "names")
+
+    def __init__(self, spec: dict):
+        self.name = spec["name"]
+        self.type = spec["type"]
+        self.symbols = tuple(spec.get("symbols", ()))
+        self.symbol_index = {symbol: index for index, symbol in enumerate(self.symbols)}
+        self.fields = compile_fields(spec["fields"]) if self.type == "record" else None
+        self.names = frozenset(field.name for field in self.fields) if self.fields is not None else None
+
+
+def compile_fields(specs: list) -> tuple:
+    return tuple(Field(spec) for spec in specs)
+
+
+def _write_varint(out: bytearray, n: int):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, pos: int):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_bytes(out: bytearray, tag: int, raw: bytes):
+    out.append(tag)
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _hex_bytes(value: str):
+    """The bytes `value` spells in lowercase hex, or None if it would not round-trip."""
+    if len(value) % 2:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return raw if raw.hex() == value else None
+
+
+def _encode_value(out: bytearray, value, field):
+    kind = type(value)
+    if value is None:
+        out.append(NULL)
+    elif kind is bool:
+        out.append(TRUE if value else FALSE)
+    elif kind is int:
+        out.append(INT)
+        # zigzag, so small negative numbers stay short
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif kind is float:
+        out.append(DOUBLE)
+        out += _DOUBLE.pack(value)
+    elif kind is str:
+        index = field.symbol_index.get(value) if field is not None else None
+        if index is not None:
+            out.append(SYMBOL)
+            _write_varint(out, index)
+            return
+        raw = _hex_bytes(value) if field is not None and field.type == "hex" else None
+        if raw is not None:
+            _write_bytes(out, HEX, raw)
+        else:
+            _write_bytes(out, STRING, value.encode("utf-8"))
+    elif kind is dict and field is not None and field.fields is not None:
+        out.append(RECORD)
+        _encode_record(out, value, field)
+    else:
+        _write_bytes(out, JSON, json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _encode_record(out: bytearray, record: dict, field):
+    for child in field.fields:
+        value = record.get(child.name, _ABSENT)
+        if value is _ABSENT:
+            out.append(ABSENT)
+        else:
+            _encode_value(out, value, child)
+    extra = record.keys() - field.names
+    if extra:
+        _encode_value(out, {key: record[key] for key in extra}, None)
+    else:
+        out.append(ABSENT)
+
+
+def _decode_int(data, pos, field):
+    n, pos = _read_varint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+
+def _decode_symbol(data, pos, field):
+    index, pos = _read_varint(data, pos)
+    return field.symbols[index], pos
+
+
+def _decode_length_prefixed(convert):
+    def decode(data, pos, field):
+        length = data[pos]
+        if length < 0x80:
+            pos += 1
+        else:
+            length, pos = _read_varint(data, pos)
+        end = pos + length
+        return convert(data[pos:end]), end
+    return decode
+
+
+def _decode_unknown(data, pos, field):
+    raise SchemaError(f"Unknown value tag {data[pos - 1]}")
+
+
+# Indexed by tag
+_DECODERS = [_decode_unknown] * 256
+_DECODERS[NULL] = lambda data, pos, field: (None, pos)
+_DECODERS[FALSE] = lambda data, pos, field: (False, pos)
+_DECODERS[TRUE] = lambda data, pos, field: (True, pos)
+_DECODERS[INT] = _decode_int
+_DECODERS[DOUBLE] = lambda data, pos, field: (_DOUBLE.unpack_from(data, pos)[0], pos + 8)
+_DECODERS[SYMBOL] = _decode_symbol
+_DECODERS[STRING] = _decode_length_prefixed(lambda raw: raw.decode("utf-8"))
+_DECODERS[HEX] = _decode_length_prefixed(bytes.hex)
+_DECODERS[JSON] = _decode_length_prefixed(json.loads)
+
+
+def _decode_value(data, pos: int, tag: int, field):
+    return _DECODERS[tag](data, pos, field)
+
+
+def _decode_record(data, pos: int, field, record: dict, start: int = 0):
+    decoders = _DECODERS
+    for child in field.fields[start:] if start else field.fields:
+        tag = data[pos]
+        pos += 1
+        if tag != ABSENT:
+            record[child.name], pos = decoders[tag](data, pos, child)
+    tag = data[pos]
+    pos += 1
+    if tag != ABSENT:
+        extra, pos = decoders[tag](data, pos, None)
+        record.update(extra)
+    return record, pos
+
+
+_DECODERS[RECORD] = lambda data, pos, field: _decode_record(data, pos, field, {})
+
+
+class EventCodec:
+    """Encoder and decoder for one schema version."""
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.version = schema["version"]
+        self.header = bytes([MAGIC]) + _varint_bytes(self.version)
+        message = schema["message"]
+        if not message or message[0]["name"] != "event_type":
+            raise SchemaError("The first message field must be event_type")
+        events = schema.get("events", {})
+        # One message layout per event type: its payload carries typed args and result
+        self._layouts = {event_type: self._layout(message, schema["payload"], spec) for event_type, spec in events.items()}
+        self._untyped = self._layout(message, schema["payload"], {"args": [], "result": []})
+
+    @staticmethod
+    def _layout(message: list, payload: list, spec: dict) -> Field:
+        payload_fields = payload + [
+            {"name": "args", "type": "record", "fields": spec.get("args", [])},
+            {"name": "result", "type": "record", "fields": spec.get("result", [])}
+        ]
+        return Field({"name": "message", "type": "record",
+                      "fields": message + [{"name": "payload", "type": "record", "fields": payload_fields}]})
+
+    def encode(self, message: dict) -> bytes:
+        out = bytearray(self.header)
+        _encode_record(out, message, self._layouts.get(message.get("event_type"), self._untyped))
+        return bytes(out)
+
+    def decode(self, data, pos: int) -> dict:
+        # event_type comes first and selects the layout of everything after it
+        tag = data[pos]
+        record = {}
+        if tag != ABSENT:
+            record["event_type"], pos = _decode_value(data, pos + 1, tag, self._untyped.fields[0])
+        else:
+            pos += 1
+        layout = self._layouts.get(record.get("event_type"), self._untyped)
+        record, _ = _decode_record(data, pos, layout, record, start=1)
+        return record
+
+
+def _varint_bytes(n: int) -> bytes:
+    out = bytearray()
+    _write_varint(out, n)
+    return bytes(out)
+
+
+def _canonical(schema: dict) -> str:
+    # register() stamps these onto the stored copy
+    return json.dumps({key: value for key, value in schema.items() if key not in ("subject", "version")}, sort_keys=True)
+
+
+class SchemaRegistry:
+    """
+    Versioned schemas for one subject, kept as `<subject>.v<N>.json` files.
+    Versions are immutable once written; `register` adds a new one only when
+    the schema actually changed.
+    """
+
+    def __init__(self, directory=EVENT_SCHEMA_DIR, subject: str = EVENT_SCHEMA_SUBJECT):
+        self.directory = Path(directory)
+        self.subject = subject
+        self._codecs = {}  # {version: EventCodec}
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Shipped to stream workers with every version already loaded; codecs are rebuilt there
+        self.load_all()
+        return {"directory": str(self.directory), "subject": self.subject,
+                "schemas": {version: codec.schema for version, codec in self._codecs.items()}}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"], state["subject"])
+        self._codecs = {int(version): EventCodec(schema) for version, schema in state["schemas"].items()}
+
+    def _path(self, version: int) -> Path:
+        return self.directory / f"{self.subject}.v{version}.json"
+
+    def versions(self) -> list:
+        prefix = f"{self.subject}.v"
+        found = {version for version in self._codecs}
+        if self.directory.exists():
+            for path in self.directory.glob(f"{prefix}*.json"):
+                number = path.name[len(prefix):-len(".json")]
+                if number.isdigit():
+                    found.add(int(number))
+        return sorted(found)
+
+    def get(self, version: int) -> EventCodec:
+        codec = self._codecs.get(version)
+        if codec is None:
+            with self._lock:
+                codec = self._codecs.get(version)
+                if codec is None:
+                    try:
+                        with open(self._path(version), "r") as f:
+                            schema = json.load(f)
+                    except FileNotFoundError:
+                        raise SchemaError(f"Unknown {self.subject} schema version {version}") from None
+                    codec = self._codecs[version] = EventCodec(schema)
+        return codec
+
+    def load_all(self):
+        for version in self.versions():
+            self.get(version)
+
+    def latest(self) -> EventCodec:
+        if self._latest is None:
+            versions = self.versions()
+            if not versions:
+                raise SchemaError(f"No {self.subject} schemas in {self.directory}")
+            self._latest = self.get(versions[-1])
+        return self._latest
+
+    def register(self, schema: dict) -> int:
+        """Returns the version for `schema`, writing it as a new version if it differs from the latest."""
+        versions = self.versions()
+        if versions and _canonical(self.get(versions[-1]).schema) == _canonical(schema):
+            return versions[-1]
+        version = (versions[-1] if versions else 0) + 1
+        schema = {**schema, "subject": self.subject, "version": version}
+        self.directory.mkdir(exist_ok=True, parents=True)
+        # "x": two writers racing for one version number cannot overwrite each other
+        with open(self._path(version), "x") as f:
+            json.dump(schema, f, indent=2)
+        self._latest = None
+        return version
+
+    def encode(self, message: dict) -> bytes:
+        return self.latest().encode(message)
+
+    def decode(self, data) -> dict:
+        """A message from its binary encoding, or from JSON as written before it."""
+        if isinstance(data, str) or not data or data[0] != MAGIC:
+            return json.loads(data)
+        version, pos = _read_varint(data, 1)
+        return self.get(version).decode(data, pos)
+
+
+# Global instance
+registry = SchemaRegistry()
+
+
+def encode(message: dict) -> bytes:
+    return registry.encode(message)
+
+
+def decode(data) -> dict:
+    return registry.decode(data)
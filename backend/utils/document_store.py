@@ -0,0 +1,60 @@
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import Optional
+
+DOCUMENT_STORE_DIR = Path(os.getenv("DOCUMENT_STORE_DIR", str(Path(__file__).parent.parent / "documents")))
+
+DOCUMENT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+class DocumentStore:
+    """
+    Content-addressed store for generated documents.
+    A document's id is the SHA-256 of its bytes, so identical documents are stored once.
+    """
+
+    def __init__(self, root=DOCUMENT_STORE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True, parents=True)
+
+    def _path(self, document_id: str) -> Path:
+        # Fan out by prefix to keep directories small
+        return self.root / document_id[:2] / document_id
+
+    def put(self, data: bytes) -> str:
+        """Stores the bytes and returns their document id."""
+        document_id = hashlib.sha256(data).hexdigest()
+        path = self._path(document_id)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # Unique per call: threads storing the same bytes must not share a temp file
+            tmp_path = path.with_name(f"{document_id}.{uuid.uuid4().hex}.tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                # Another writer got there first with the same content
+                if not path.exists():
+                    raise
+            finally:
+                tmp_path.unlink(missing_ok=True)
+        return document_id
+
+    def path(self, document_id: str) -> Optional[Path]:
+        """Returns the file holding the document, or None for unknown or malformed ids."""
+        if not DOCUMENT_ID_PATTERN.match(document_id):
+            return None
+        path = self._path(document_id)
+        return path if path.exists() else None
+
+    def get(self, document_id: str) -> Optional[bytes]:
+        path = self.path(document_id)
+        if path is None:
+            return None
+        return path.read_bytes()
+
+# Global instance
+document_store = DocumentStore()
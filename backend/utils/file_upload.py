@@ -1,21 +1,110 @@
+import asyncio
+import hashlib
+import multiprocessing
 import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from fastapi import UploadFile
-import shutil
 from pathlib import Path
 
-UPLOAD_DIR = Path(__file__).parent.parent / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", str(Path(__file__).parent.parent / "uploads")))
+UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Processes parsing the text of large slips; 0 parses them on a thread instead
+SALARY_EXTRACT_WORKERS = int(os.getenv("SALARY_EXTRACT_WORKERS", "2"))
+# Slips up to this size are parsed on a thread: cheaper than a trip to another process
+SALARY_INLINE_BYTES = 256 * 1024
+SALARY_CACHE_SIZE = 4096
+
+# "Net Salary: 85,000", "Net Pay INR 1,20,000.00", "Gross Monthly Salary - 95000"
+SALARY_PATTERN = re.compile(
+    rb"(?i)(net\s+(?:monthly\s+)?(?:salary|pay)|take[\s-]home|gross\s+(?:monthly\s+)?(?:salary|pay))"
+    rb"[^0-9]{0,24}?((?:\d{1,3}(?:,\d{2,3})+|\d{4,8})(?:\.\d{1,2})?)"
+)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+@dataclass
+class StoredUpload:
+    sha256: str
+    path: Path
+    size: int
+    filename: str
+    # True when identical bytes were already stored
+    deduplicated: bool
+
+
+def _blob_path(digest: str) -> Path:
+    # Content-addressed, so client file names never reach the file system
+    return UPLOAD_DIR / "blobs" / digest[:2] / digest
+
+
+async def save_salary_slip(file: UploadFile, session_id: str, max_bytes: int = UPLOAD_MAX_BYTES) -> StoredUpload:
+    """
+    Streams the upload to disk chunk by chunk, hashing as it goes, and stores
+    it under its SHA-256 so identical slips are kept once.
+    Raises UploadTooLarge as soon as more than `max_bytes` have arrived.
+    """
+    tmp_dir = UPLOAD_DIR / "tmp"
+    tmp_dir.mkdir(exist_ok=True)
+    tmp_path = tmp_dir / f"{uuid.uuid4().hex}.part"
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Salary slip exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+
+        digest = hasher.hexdigest()
+        path = _blob_path(digest)
+        deduplicated = path.exists()
+        if not deduplicated:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    print(f"Stored salary slip for session {session_id}: sha256={digest[:12]} size={size} deduplicated={deduplicated}")
+    return StoredUpload(sha256=digest, path=path, size=size, filename=file.filename or "", deduplicated=deduplicated)
+
+
+def extract_salary_from_text(path: str):
+    """
+    Finds the salary stated in the slip: the PDF's text when pypdf is
+    installed, otherwise the raw bytes (plain-text slips, uncompressed PDFs).
+    Returns None when nothing salary-like is found.
+    """
+    data = None
+    try:
+        from pypdf import PdfReader
+        data = "\n".join(page.extract_text() or "" for page in PdfReader(path).pages).encode("utf-8")
+    except Exception:
+        # Not installed, or not a PDF it can read
+        pass
+    if not data:
+        with open(path, "rb") as f:
+            data = f.read()
+    match = SALARY_PATTERN.search(data)
+    if not match:
+        return None
+    return float(match.group(2).replace(b",", b""))
 
-def save_salary_slip(file: UploadFile, session_id: str) -> str:
-    # Create session directory
-    session_dir = UPLOAD_DIR / session_id
-    session_dir.mkdir(exist_ok=True, parents=True)
-    
-    file_path = session_dir / file.filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    return str(file_path)
 
 def extract_salary_from_filename(filename: str) -> float:
     # Mock logic: extract number from filename (e.g., salary_50000.pdf -> 50000)
@@ -29,3 +118,44 @@ def extract_salary_from_filename(filename: str) -> float:
         return 0.0
     except Exception:
         return 0.0
+
+
+_salary_cache = OrderedDict()  # {sha256: salary from the text, or None}
+_salary_cache_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if SALARY_EXTRACT_WORKERS > 0:
+                # spawn, not fork: the server process has live threads and sockets
+                _pool = ProcessPoolExecutor(SALARY_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="salary-extract")
+        return _pool
+
+
+async def extract_salary(upload: StoredUpload) -> float:
+    """
+    Salary for a stored slip, parsed from its text in the worker pool and
+    cached by content hash; falls back to the number in the file name.
+    """
+    with _salary_cache_lock:
+        cached = upload.sha256 in _salary_cache
+        salary = _salary_cache.get(upload.sha256)
+    if not cached:
+        if upload.size <= SALARY_INLINE_BYTES:
+            salary = await asyncio.to_thread(extract_salary_from_text, str(upload.path))
+        else:
+            loop = asyncio.get_running_loop()
+            salary = await loop.run_in_executor(_get_pool(), extract_salary_from_text, str(upload.path))
+        with _salary_cache_lock:
+            _salary_cache[upload.sha256] = salary
+            while len(_salary_cache) > SALARY_CACHE_SIZE:
+                _salary_cache.popitem(last=False)
+    if salary is None:
+        return extract_salary_from_filename(upload.filename)
+    return salary
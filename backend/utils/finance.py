@@ -0,0 +1,96 @@
+"""
+EMI and amortization maths shared by the underwriting and sanction agents.
+
+Scalar helpers work on plain floats and cache the annuity factor per
+(rate, tenure). The vectorized helpers take NumPy arrays and handle many loans
+in one pass; NumPy is imported on first use so the scalar path stays light.
+"""
+import functools
+
+
+@functools.lru_cache(maxsize=4096)
+def annuity_factor(annual_rate: float, tenure_months: int) -> float:
+    """EMI per unit of principal for a reducing-balance loan."""
+    r = annual_rate / 12 / 100
+    n = tenure_months
+    if r > 0:
+        growth = (1 + r) ** n
+        return r * growth / (growth - 1)
+    return 1 / n
+
+
+def emi(amount: float, annual_rate: float, tenure_months: int) -> float:
+    return amount * annuity_factor(annual_rate, tenure_months)
+
+
+def max_affordable_amount(monthly_salary: float, annual_rate: float, tenure_months: int,
+                          max_emi_ratio: float = 0.5) -> float:
+    """Largest principal whose EMI stays within `max_emi_ratio` of the monthly salary."""
+    return max_emi_ratio * monthly_salary / annuity_factor(annual_rate, tenure_months)
+
+
+def annuity_factors(annual_rates, tenure_months):
+    """Vectorized `annuity_factor` over arrays of rates and tenures."""
+    import numpy as np
+
+    r = np.asarray(annual_rates, dtype=np.float64) / 12 / 100
+    n = np.asarray(tenure_months, dtype=np.float64)
+    growth = (1 + r) ** n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(r > 0, r * growth / (growth - 1), 1 / n)
+
+
+def amortization_schedule(amounts, annual_rates, tenure_months) -> dict:
+    """
+    Month-by-month schedules for many loans at once.
+    Returns `month` (1..longest tenure) plus per-loan `emi` and (loans x months)
+    arrays of `interest`, `principal` and closing `balance`; months past a
+    loan's tenure are zero.
+    """
+    import numpy as np
+
+    amounts = np.atleast_1d(np.asarray(amounts, dtype=np.float64))
+    rates = np.broadcast_to(np.asarray(annual_rates, dtype=np.float64), amounts.shape)
+    tenures = np.broadcast_to(np.asarray(tenure_months, dtype=np.int64), amounts.shape)
+
+    r = (rates / 12 / 100)[:, None]
+    payments = amounts * annuity_factors(rates, tenures)
+    months = np.arange(1, int(tenures.max()) + 1)
+
+    # Closed-form balance after k payments, so no month-by-month Python loop
+    growth = (1 + r) ** months
+    with np.errstate(divide="ignore", invalid="ignore"):
+        paid_down = np.where(r > 0, payments[:, None] * (growth - 1) / r, payments[:, None] * months)
+    balance = amounts[:, None] * growth - paid_down
+    opening = np.concatenate([amounts[:, None], balance[:, :-1]], axis=1)
+    interest = opening * r
+    principal = payments[:, None] - interest
+
+    active = months <= tenures[:, None]
+    # Clear float residue on the final balance
+    balance = np.where(active & (balance > 1e-6), balance, 0.0)
+    interest = np.where(active, interest, 0.0)
+    principal = np.where(active, principal, 0.0)
+
+    return {"month": months, "emi": payments, "interest": interest, "principal": principal, "balance": balance}
+
+
+def schedule_rows(amount: float, annual_rate: float, tenure_months: int) -> list:
+    """Repayment schedule for one loan as rounded rows, e.g. for the sanction letter."""
+    schedule = amortization_schedule([amount], [annual_rate], [tenure_months])
+    payment = round(float(schedule["emi"][0]), 2)
+    return [
+        {
+            "month": int(month),
+            "emi": payment,
+            "principal": round(principal, 2),
+            "interest": round(interest, 2),
+            "balance": round(balance, 2)
+        }
+        for month, principal, interest, balance in zip(
+            schedule["month"].tolist(),
+            schedule["principal"][0].tolist(),
+            schedule["interest"][0].tolist(),
+            schedule["balance"][0].tolist()
+        )
+    ]
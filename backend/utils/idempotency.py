@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from utils.metrics import counter
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+IDEMPOTENT_REQUESTS = counter(
+    "idempotent_requests_total", "Requests carrying an idempotency key, by outcome", ["endpoint", "outcome"]
+)
+
+
+class IdempotencyCache:
+    """
+    Bounded TTL cache of responses keyed by client-supplied idempotency keys.
+
+    The first request with a key does the work; a retry while it is still
+    running waits for the same result ("joined"), and a retry after it has
+    completed gets the stored response ("replayed"). Failed work is forgotten
+    so the client can retry it. Lives on the event loop; not thread-safe.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {key: (future, completed_at or None)}
+        self.counts = {"new": 0, "joined": 0, "replayed": 0, "failed": 0}
+
+    def _count(self, endpoint: str, outcome: str):
+        self.counts[outcome] += 1
+        IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+
+    def _prune(self):
+        now = time.time()
+        # Completed entries are appended in completion order, so expired ones come first
+        for key, (future, completed_at) in list(self._entries.items()):
+            if completed_at is None:
+                continue
+            if now - completed_at <= self.ttl and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def claim(self, endpoint: str, key: tuple):
+        """
+        Returns (future, True) when the caller owns the work and must settle the
+        future with `complete` or `fail`, or (existing future, False) for a retry.
+        """
+        self._prune()
+        entry = self._entries.get(key)
+        if entry is not None:
+            future, completed_at = entry
+            self._count(endpoint, "replayed" if completed_at is not None else "joined")
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (future, None)
+        self._count(endpoint, "new")
+        return future, True
+
+    def complete(self, key: tuple, future, result):
+        if not future.done():
+            future.set_result(result)
+        if key in self._entries:
+            self._entries[key] = (future, time.time())
+            self._entries.move_to_end(key)
+
+    def fail(self, endpoint: str, key: tuple, future, exc: BaseException):
+        self._entries.pop(key, None)
+        self._count(endpoint, "failed")
+        if not future.done():
+            future.set_exception(exc)
+            # Retrieved here so an unawaited failure is not reported as lost
+            future.exception()
+
+    async def run(self, endpoint: str, key: tuple, work, timeout: float):
+        """
+        Awaits the response for `key`, starting `work()` (a coroutine factory) if
+        no request with this key is running or remembered. `timeout` bounds only
+        this caller's wait; the work carries on for retries to pick up.
+        """
+        future, owner = self.claim(endpoint, key)
+        if owner:
+            task = asyncio.ensure_future(work())
+
+            def settle(task):
+                if task.cancelled():
+                    self.fail(endpoint, key, future, asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self.fail(endpoint, key, future, task.exception())
+                else:
+                    self.complete(key, future, task.result())
+
+            task.add_done_callback(settle)
+        return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "ttl_seconds": self.ttl, **self.counts}
+
+
+# Global instance
+idempotency_cache = IdempotencyCache()
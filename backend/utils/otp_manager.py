@@ -1,30 +1,365 @@
+import heapq
+import hmac
+import os
 import random
+import sqlite3
+import threading
 import time
 import logging
+from pathlib import Path
+
+from utils.metrics import counter, gauge
+from utils.state_backend import STATE_BACKEND_URL, backend_kind, redis_client, sqlite_path
 
 # Configure logging to ensure OTPs appear in console
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fixed code for demos and load tests. Only honoured with the fake LLM or in an
+# explicit load-test mode, so a leftover setting cannot switch off verification
+OTP_DEV_CODE = os.getenv("OTP_DEV_CODE")
+LOAD_TEST_MODE = os.getenv("LOAD_TEST_MODE", "0") == "1"
+if OTP_DEV_CODE:
+    if os.getenv("LLM_BACKEND") != "fake" and not LOAD_TEST_MODE:
+        raise RuntimeError(
+            "OTP_DEV_CODE makes every OTP the same known code and is only allowed with "
+            "LLM_BACKEND=fake or LOAD_TEST_MODE=1. Unset it to start normally."
+        )
+    logger.warning("OTP_DEV_CODE is set: every OTP is a fixed, known code. Never run like this in production.")
+
+OTP_TTL_SECONDS = float(os.getenv("OTP_TTL_SECONDS", "300"))
+# A SQLite file shared by uvicorn workers; unset follows STATE_BACKEND_URL (in-process by default)
+OTP_STORE_PATH = os.getenv("OTP_STORE_PATH")
+OTP_SWEEP_INTERVAL_SECONDS = float(os.getenv("OTP_SWEEP_INTERVAL_SECONDS", "30"))
+# Token buckets per phone: up to BURST at once, then one more every REFILL_SECONDS
+OTP_SEND_BURST = int(os.getenv("OTP_SEND_BURST", "3"))
+OTP_SEND_REFILL_SECONDS = float(os.getenv("OTP_SEND_REFILL_SECONDS", "60"))
+OTP_VERIFY_FAILURE_BURST = int(os.getenv("OTP_VERIFY_FAILURE_BURST", "5"))
+OTP_VERIFY_FAILURE_REFILL_SECONDS = float(os.getenv("OTP_VERIFY_FAILURE_REFILL_SECONDS", "60"))
+
+OTP_EVENTS = counter("otp_events_total", "OTP sends and verifications, by outcome", ["outcome"])
+
+
+class OTPRateLimited(Exception):
+    def __init__(self, action: str, retry_after: float):
+        super().__init__(f"Too many OTP {action} attempts; retry in {retry_after:.0f}s")
+        self.action = action
+        self.retry_after = retry_after
+
+
+def refill(tokens: float, updated_at: float, now: float, capacity: int, refill_seconds: float) -> float:
+    """Tokens in a bucket last seen holding `tokens` at `updated_at`."""
+    if refill_seconds <= 0:
+        return float(capacity)
+    return min(float(capacity), tokens + (now - updated_at) / refill_seconds)
+
+
+def full_at(tokens: float, now: float, capacity: int, refill_seconds: float) -> float:
+    """When a bucket holding `tokens` at `now` is full again, and so can be forgotten."""
+    return now + max(0.0, capacity - tokens) * max(refill_seconds, 0.0)
+
+
+class MemoryOTPStore:
+    """
+    OTPs and rate-limit buckets held in this process.
+    Every record also sits in a min-heap keyed by the time it can be dropped
+    (expiry for OTPs, full refill for buckets), so `sweep` only looks at
+    records that are actually due. Superseded heap entries are skipped lazily.
+    """
+
+    def __init__(self):
+        self._otps = {}  # {phone: (code, expires_at)}
+        self._buckets = {}  # {key: (tokens, updated_at, full_at)}
+        self._heap = []  # [(due_at, kind, key)]
+        self._lock = threading.Lock()
+
+    def put(self, phone: str, code: str, expires_at: float):
+        with self._lock:
+            self._otps[phone] = (code, expires_at)
+            heapq.heappush(self._heap, (expires_at, "otp", phone))
+
+    def consume(self, phone: str, code: str, now: float) -> str:
+        """"valid" (and removes the OTP), "invalid", "expired" or "missing"."""
+        with self._lock:
+            record = self._otps.get(phone)
+            if record is None:
+                return "missing"
+            if now > record[1]:
+                del self._otps[phone]
+                return "expired"
+            if not hmac.compare_digest(record[0], code):
+                return "invalid"
+            del self._otps[phone]
+            return "valid"
+
+    def discard(self, phone: str):
+        with self._lock:
+            self._otps.pop(phone, None)
+
+    def take(self, key: str, capacity: int, refill_seconds: float, now: float, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens from the bucket; 0 when allowed, otherwise the seconds
+        until enough have refilled (nothing is taken then). `cost=0` only checks.
+        """
+        with self._lock:
+            tokens, updated_at, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = refill(tokens, updated_at, now, capacity, refill_seconds)
+            if tokens < max(cost, 1.0):
+                return (max(cost, 1.0) - tokens) * refill_seconds
+            if cost:
+                tokens -= cost
+                due = full_at(tokens, now, capacity, refill_seconds)
+                self._buckets[key] = (tokens, now, due)
+                heapq.heappush(self._heap, (due, "bucket", key))
+            return 0.0
+
+    def sweep(self, now: float) -> int:
+        removed = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, kind, key = heapq.heappop(self._heap)
+                records = self._otps if kind == "otp" else self._buckets
+                record = records.get(key)
+                # Only drop the record this entry was pushed for, not a newer one
+                if record is not None and record[-1] == due:
+                    del records[key]
+                    removed += kind == "otp"
+        return removed
+
+    def __len__(self):
+        return len(self._otps)
+
+
+class SQLiteOTPStore:
+    """
+    OTPs and rate-limit buckets in a SQLite file, shared by every worker
+    process pointed at it. Read-modify-write steps run in IMMEDIATE
+    transactions, so two workers cannot both accept one code or both spend
+    the last token. Expiry columns are indexed so sweeps are range deletes.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS otps (phone TEXT PRIMARY KEY, code TEXT, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_otps_expires_at ON otps (expires_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS otp_buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL, full_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_otp_buckets_full_at ON otp_buckets (full_at)")
+
+    def _conn(self):
+        # sqlite3 connections are bound to their creating thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def put(self, phone: str, code: str, expires_at: float):
+        self._conn().execute("INSERT OR REPLACE INTO otps VALUES (?, ?, ?)", (phone, code, expires_at))
+
+    def consume(self, phone: str, code: str, now: float) -> str:
+        conn = self._transaction()
+        try:
+            row = conn.execute("SELECT code, expires_at FROM otps WHERE phone = ?", (phone,)).fetchone()
+            if row is None:
+                outcome = "missing"
+            elif now > row[1]:
+                outcome = "expired"
+            elif not hmac.compare_digest(row[0], code):
+                outcome = "invalid"
+            else:
+                outcome = "valid"
+            if outcome in ("expired", "valid"):
+                conn.execute("DELETE FROM otps WHERE phone = ?", (phone,))
+            conn.execute("COMMIT")
+            return outcome
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def discard(self, phone: str):
+        self._conn().execute("DELETE FROM otps WHERE phone = ?", (phone,))
+
+    def take(self, key: str, capacity: int, refill_seconds: float, now: float, cost: float = 1.0) -> float:
+        conn = self._transaction()
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM otp_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else refill(row[0], row[1], now, capacity, refill_seconds)
+            if tokens < max(cost, 1.0):
+                conn.execute("COMMIT")
+                return (max(cost, 1.0) - tokens) * refill_seconds
+            if cost:
+                tokens -= cost
+                conn.execute(
+                    "INSERT OR REPLACE INTO otp_buckets VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, full_at(tokens, now, capacity, refill_seconds))
+                )
+            conn.execute("COMMIT")
+            return 0.0
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def sweep(self, now: float) -> int:
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM otps WHERE expires_at <= ?", (now,)).rowcount
+        conn.execute("DELETE FROM otp_buckets WHERE full_at <= ?", (now,))
+        return removed
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM otps").fetchone()[0]
+
+
+# Lua keeps each read-modify-write atomic on the Redis server
+_REDIS_CONSUME = """
+local record = redis.call('HMGET', KEYS[1], 'code', 'expires_at')
+if not record[1] then return 'missing' end
+if tonumber(ARGV[2]) > tonumber(record[2]) then
+  redis.call('DEL', KEYS[1]); redis.call('ZREM', KEYS[2], ARGV[3]); return 'expired'
+end
+if record[1] ~= ARGV[1] then return 'invalid' end
+redis.call('DEL', KEYS[1]); redis.call('ZREM', KEYS[2], ARGV[3])
+return 'valid'
+"""
+_REDIS_TAKE = """
+local capacity, refill_seconds, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = capacity
+if bucket[1] then
+  tokens = tonumber(bucket[1])
+  if refill_seconds > 0 then
+    tokens = math.min(capacity, tokens + (now - tonumber(bucket[2])) / refill_seconds)
+  else
+    tokens = capacity
+  end
+end
+local needed = math.max(cost, 1)
+if tokens < needed then return tostring((needed - tokens) * refill_seconds) end
+if cost > 0 then
+  tokens = tokens - cost
+  redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+  redis.call('PEXPIRE', KEYS[1], math.max(1, math.ceil((capacity - tokens) * refill_seconds * 1000)))
+end
+return '0'
+"""
+
+
+class RedisOTPStore:
+    """
+    OTPs and rate-limit buckets in Redis, shared by every worker on every host.
+    Records carry native expiries; a sorted set of OTP expiries backs the
+    pending count and lets `sweep` drop entries Redis has already expired.
+    """
+
+    def __init__(self, client, prefix: str = "capital_connect:otp:"):
+        self.client = client
+        self.prefix = prefix
+        self.index = f"{prefix}expiries"
+        self._consume = client.register_script(_REDIS_CONSUME)
+        self._take = client.register_script(_REDIS_TAKE)
+
+    def put(self, phone: str, code: str, expires_at: float):
+        key = f"{self.prefix}{phone}"
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={"code": code, "expires_at": repr(expires_at)})
+        pipe.pexpireat(key, int(expires_at * 1000) + 1)
+        pipe.zadd(self.index, {phone: expires_at})
+        pipe.execute()
+
+    def consume(self, phone: str, code: str, now: float) -> str:
+        outcome = self._consume(keys=[f"{self.prefix}{phone}", self.index], args=[code, repr(now), phone])
+        return outcome.decode() if isinstance(outcome, bytes) else outcome
+
+    def discard(self, phone: str):
+        pipe = self.client.pipeline()
+        pipe.delete(f"{self.prefix}{phone}")
+        pipe.zrem(self.index, phone)
+        pipe.execute()
+
+    def take(self, key: str, capacity: int, refill_seconds: float, now: float, cost: float = 1.0) -> float:
+        return float(self._take(keys=[f"{self.prefix}bucket:{key}"], args=[capacity, refill_seconds, repr(now), cost]))
+
+    def sweep(self, now: float) -> int:
+        return self.client.zremrangebyscore(self.index, "-inf", now)
+
+    def __len__(self):
+        return self.client.zcard(self.index)
+
+
+def open_store(path=OTP_STORE_PATH, url=STATE_BACKEND_URL):
+    if path:
+        return SQLiteOTPStore(path)
+    kind = backend_kind(url)
+    if kind == "sqlite":
+        # Same file as the sessions, in tables of its own
+        return SQLiteOTPStore(sqlite_path(url))
+    if kind == "redis":
+        return RedisOTPStore(redis_client(url))
+    return MemoryOTPStore()
+
+
 class OTPManager:
-    _instance = None
-    
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(OTPManager, cls).__new__(cls)
-            cls._instance.otps = {} # {phone: {"code": str, "expiry": float}}
-        return cls._instance
-
-    def generate_otp(self, phone: str, expiry_seconds: int = 300) -> str:
-        """Generates a 6-digit OTP, stores it with expiry, and 'sends' it via console."""
-        code = f"{random.randint(0, 999999):06d}"
-        expiry = time.time() + expiry_seconds
-        
-        self.otps[phone] = {
-            "code": code,
-            "expiry": expiry
-        }
-        
+    """
+    Issues and checks OTPs. Safe to call from any thread.
+
+    Sends and failed verifications are each limited per phone by a token
+    bucket. Once a phone runs out of verification attempts its pending OTP is
+    discarded, so guessing has to wait for the bucket and a fresh send.
+    Once `start()` is called, a daemon thread drops expired OTPs every
+    `sweep_interval` seconds.
+    """
+
+    def __init__(self, store=None, ttl: float = OTP_TTL_SECONDS, sweep_interval: float = OTP_SWEEP_INTERVAL_SECONDS):
+        self.store = store if store is not None else MemoryOTPStore()
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def start(self):
+        """Starts the sweeper thread; called from the app's lifespan hook."""
+        if self._sweeper is None and self.sweep_interval > 0:
+            self._stop = threading.Event()
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(self._stop,), name="otp-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self, stop: threading.Event):
+        while not stop.wait(self.sweep_interval):
+            try:
+                expired = self.store.sweep(time.time())
+                if expired:
+                    OTP_EVENTS.inc(expired, outcome="swept")
+            except Exception as e:
+                print(f"OTP sweep failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._sweeper = None
+
+    def generate_otp(self, phone: str, expiry_seconds: float = None) -> str:
+        """
+        Generates a 6-digit OTP, stores it with expiry, and 'sends' it via console.
+        Raises OTPRateLimited when the phone has used up its sends.
+        """
+        now = time.time()
+        retry_after = self.store.take(f"send:{phone}", OTP_SEND_BURST, OTP_SEND_REFILL_SECONDS, now)
+        if retry_after:
+            OTP_EVENTS.inc(outcome="send_rate_limited")
+            raise OTPRateLimited("send", retry_after)
+
+        code = OTP_DEV_CODE or f"{random.SystemRandom().randint(0, 999999):06d}"
+        self.store.put(phone, code, now + (expiry_seconds or self.ttl))
+        OTP_EVENTS.inc(outcome="sent")
+
         self._send_otp(phone, code)
         return code
 
@@ -35,21 +370,33 @@ class OTPManager:
         logger.info(message) # Ensure it hits logs
 
     def validate_otp(self, phone: str, code: str) -> bool:
-        """Validates the OTP. Checks existence, equality, and expiry."""
-        if phone not in self.otps:
-            return False
-            
-        record = self.otps[phone]
-        
-        if time.time() > record["expiry"]:
-            del self.otps[phone] # Cleanup expired
-            return False
-            
-        if record["code"] == code:
-            del self.otps[phone] # Consumed
+        """
+        Validates the OTP. Checks existence, equality, and expiry; a valid code is consumed.
+        Raises OTPRateLimited when the phone has used up its failed attempts.
+        """
+        now = time.time()
+        key = f"verify:{phone}"
+        retry_after = self.store.take(key, OTP_VERIFY_FAILURE_BURST, OTP_VERIFY_FAILURE_REFILL_SECONDS, now, cost=0)
+        if retry_after:
+            OTP_EVENTS.inc(outcome="verify_rate_limited")
+            raise OTPRateLimited("verification", retry_after)
+
+        outcome = self.store.consume(phone, str(code).strip(), now)
+        OTP_EVENTS.inc(outcome=outcome)
+        if outcome == "valid":
             return True
-            
+        if outcome == "invalid":
+            self.store.take(key, OTP_VERIFY_FAILURE_BURST, OTP_VERIFY_FAILURE_REFILL_SECONDS, now)
+            if self.store.take(key, OTP_VERIFY_FAILURE_BURST, OTP_VERIFY_FAILURE_REFILL_SECONDS, now, cost=0):
+                # Out of attempts: this code can no longer be guessed
+                self.store.discard(phone)
         return False
 
+    def pending(self) -> int:
+        return len(self.store)
+
+
 # Global instance
-otp_manager = OTPManager()
+otp_manager = OTPManager(open_store())
+
+gauge("otp_pending", "OTPs issued and not yet used or swept", function=otp_manager.pending)
@@ -1,52 +1,204 @@
 import io
-import base64
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import os
+import functools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-def create_sanction_letter(customer_name: str, amount: float, tenure: int, interest_rate: float, emi: float):
-    """
-    Generates a sanction letter PDF and returns the base64 encoded string.
-    """
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
+# Worker processes for full (non-template) renders and batches; 0 renders in the calling process
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+
+SCHEDULE_COLUMNS = [("Month", 80), ("EMI", 170), ("Principal", 270), ("Interest", 370), ("Balance", 470)]
+SCHEDULE_ROWS_PER_PAGE = 40
+
+# Per-customer lines of the letter and the width of their slot in the cached template
+TEMPLATE_FIELDS = {"date": 16, "greeting": 72, "amount": 56, "tenure": 32, "rate": 40, "emi": 56}
 
+def letter_fields(customer_name: str, amount: float, tenure: int, interest_rate: float, emi: float) -> dict:
+    return {
+        "date": f"Date: {datetime.now().strftime('%Y-%m-%d')}",
+        "greeting": f"Dear {customer_name},",
+        "amount": f"Sanctioned Amount: INR {amount:,.2f}",
+        "tenure": f"Tenure: {tenure} months",
+        "rate": f"Interest Rate: {interest_rate}% p.a.",
+        "emi": f"Monthly EMI: INR {emi:,.2f}"
+    }
+
+def draw_letter(c, fields: dict, height: float):
     # Header
     c.setFont("Helvetica-Bold", 20)
     c.drawString(50, height - 50, "NBFC Personal Loan Sanction Letter")
-    
+
     # Date
     c.setFont("Helvetica", 12)
-    c.drawString(50, height - 80, f"Date: {datetime.now().strftime('%Y-%m-%d')}")
-    
+    c.drawString(50, height - 80, fields["date"])
+
     # Customer Details
-    c.drawString(50, height - 120, f"Dear {customer_name},")
+    c.drawString(50, height - 120, fields["greeting"])
     c.drawString(50, height - 140, "We are pleased to inform you that your personal loan has been sanctioned.")
-    
+
     # Loan Details
     c.setFont("Helvetica-Bold", 14)
     c.drawString(50, height - 180, "Loan Details:")
     c.setFont("Helvetica", 12)
-    
-    details = [
-        f"Sanctioned Amount: INR {amount:,.2f}",
-        f"Tenure: {tenure} months",
-        f"Interest Rate: {interest_rate}% p.a.",
-        f"Monthly EMI: INR {emi:,.2f}"
-    ]
-    
+
     y = height - 210
-    for detail in details:
-        c.drawString(80, y, detail)
+    for key in ("amount", "tenure", "rate", "emi"):
+        c.drawString(80, y, fields[key])
         y -= 20
-        
+
     # Footer
     c.drawString(50, y - 40, "Terms and conditions apply.")
     c.drawString(50, y - 60, "This is a computer-generated document and does not require a signature.")
-    
+
+def draw_schedule(c, schedule: list, height: float):
+    """Draws repayment schedule rows (see utils.finance.schedule_rows) on new pages."""
+    for start in range(0, len(schedule), SCHEDULE_ROWS_PER_PAGE):
+        c.showPage()
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(50, height - 50, "Repayment Schedule")
+        c.setFont("Helvetica-Bold", 10)
+        for title, x in SCHEDULE_COLUMNS:
+            c.drawRightString(x + 60, height - 80, title)
+        c.setFont("Helvetica", 10)
+        y = height - 98
+        for row in schedule[start:start + SCHEDULE_ROWS_PER_PAGE]:
+            c.drawRightString(SCHEDULE_COLUMNS[0][1] + 60, y, str(row["month"]))
+            for key, (_, x) in zip(("emi", "principal", "interest", "balance"), SCHEDULE_COLUMNS[1:]):
+                c.drawRightString(x + 60, y, f"{row[key]:,.2f}")
+            y -= 16
+
+def render_full(customer_name: str, amount: float, tenure: int, interest_rate: float, emi: float,
+                schedule: list = None) -> bytes:
+    """Draws the whole letter with ReportLab."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter, invariant=1)
+    width, height = letter
+
+    draw_letter(c, letter_fields(customer_name, amount, tenure, interest_rate, emi), height)
+    if schedule:
+        draw_schedule(c, schedule, height)
+
     c.save()
-    
-    buffer.seek(0)
-    pdf_bytes = buffer.read()
-    return base64.b64encode(pdf_bytes).decode('utf-8')
+
+    return buffer.getvalue()
+
+def _pdf_literal(text: str):
+    """Escapes text the way ReportLab writes it into a (...) string, or None if it is not WinAnsi."""
+    try:
+        data = text.encode("cp1252")
+    except UnicodeEncodeError:
+        return None
+    out = bytearray()
+    for byte in data:
+        if byte in b"()\\":
+            out += b"\\" + bytes([byte])
+        elif byte < 32 or byte > 126:
+            out += b"\\%03o" % byte
+        else:
+            out.append(byte)
+    return bytes(out)
+
+@functools.lru_cache(maxsize=1)
+def _template():
+    """
+    Renders the letter once with fixed-width placeholders and an uncompressed
+    page stream, and returns the PDF bytes with each placeholder's offset.
+    Stamping a same-length value leaves every xref offset and stream /Length valid.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    markers = {name: f"{{{name}}}".ljust(width, "~") for name, width in TEMPLATE_FIELDS.items()}
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter, invariant=1, pageCompression=0)
+    draw_letter(c, markers, letter[1])
+    c.save()
+    pdf = buffer.getvalue()
+
+    slots = []
+    for name, marker in markers.items():
+        needle = b"(" + marker.encode("ascii") + b")"
+        offset = pdf.find(needle)
+        if offset < 0 or pdf.find(needle, offset + 1) >= 0:
+            raise RuntimeError(f"Sanction letter template has no unique slot for {name}")
+        slots.append((name, offset + 1, TEMPLATE_FIELDS[name]))
+    return pdf, slots
+
+def stamp_template(fields: dict):
+    """Fills the cached template, or returns None if a value does not fit its slot."""
+    pdf, slots = _template()
+    out = bytearray(pdf)
+    for name, offset, width in slots:
+        literal = _pdf_literal(fields[name])
+        if literal is None or len(literal) > width:
+            return None
+        # Trailing spaces are invisible in a left-aligned line
+        out[offset:offset + width] = literal.ljust(width)
+    return bytes(out)
+
+def render_sanction_letter(customer_name: str, amount: float, tenure: int, interest_rate: float, emi: float,
+                           schedule: list = None) -> bytes:
+    """
+    Generates a sanction letter PDF and returns its bytes, with the repayment schedule appended when given.
+    Plain letters are stamped into the cached template; letters with a schedule, or values that do not
+    fit the template, are drawn in full.
+    Output is deterministic for the same inputs on the same day, so identical letters share a document id.
+    """
+    if not schedule:
+        pdf = stamp_template(letter_fields(customer_name, amount, tenure, interest_rate, emi))
+        if pdf is not None:
+            return pdf
+    return render_full(customer_name, amount, tenure, interest_rate, emi, schedule)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process has live threads and sockets
+            _pool = ProcessPoolExecutor(PDF_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def render_sanction_letter_offloaded(customer_name: str, amount: float, tenure: int, interest_rate: float,
+                                     emi: float, schedule: list = None) -> bytes:
+    """
+    Same as `render_sanction_letter`, but full renders run in the worker pool so
+    they hold neither the server's GIL nor its threads' CPU time.
+    Template stamps stay in-process; they are cheaper than the round trip.
+    """
+    if not schedule:
+        pdf = stamp_template(letter_fields(customer_name, amount, tenure, interest_rate, emi))
+        if pdf is not None:
+            return pdf
+    if PDF_RENDER_WORKERS <= 0:
+        return render_full(customer_name, amount, tenure, interest_rate, emi, schedule)
+    return _get_pool().submit(render_full, customer_name, amount, tenure, interest_rate, emi, schedule).result()
+
+def _render_timed(letters: list) -> list:
+    results = []
+    for kwargs in letters:
+        start = time.perf_counter()
+        pdf = render_sanction_letter(**kwargs)
+        results.append((pdf, (time.perf_counter() - start) * 1000))
+    return results
+
+def render_batch(letters: list, chunk_size: int = 256) -> list:
+    """
+    Renders many letters, each given as `render_sanction_letter` keyword
+    arguments, across the worker pool. Returns (pdf bytes, render ms) per
+    letter in input order; the time covers rendering only, not queueing.
+    """
+    chunks = [letters[i:i + chunk_size] for i in range(0, len(letters), chunk_size)]
+    if PDF_RENDER_WORKERS <= 0 or len(chunks) <= 1:
+        mapped = map(_render_timed, chunks)
+    else:
+        mapped = _get_pool().map(_render_timed, chunks)
+    return [result for chunk in mapped for result in chunk]
@@ -0,0 +1,209 @@
+"""
+Shared state for running several workers (uvicorn --workers, or several
+hosts behind a load balancer).
+
+STATE_BACKEND_URL selects where chat sessions (history and customer_data)
+and OTPs live:
+
+- unset or ``memory://``: in this process, as before (sessions spill to disk)
+- ``sqlite:///path/to/state.db``: a SQLite file shared by the workers of one host
+- ``redis://host:6379/0``: Redis, shared across hosts (needs the ``redis`` package)
+
+The SQLite backend implements the same operations as the Redis one, so it
+doubles as a local stand-in for Redis.
+
+Session backends keep a version per session and a per-session lock with a
+TTL. A worker holds the lock for the length of one turn. If the version
+moved since the worker last saw the session, it reloads the session first.
+It saves the new state when the turn ends.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "memory://")
+# Sessions untouched for this long are deleted from the shared backend
+SESSION_STATE_TTL_SECONDS = int(os.getenv("SESSION_STATE_TTL_SECONDS", str(7 * 24 * 3600)))
+# A worker that dies mid-turn blocks its session at most this long
+SESSION_LOCK_TTL_SECONDS = float(os.getenv("SESSION_LOCK_TTL_SECONDS", "120"))
+
+# Returned to clients as a session-affinity hint (X-Session-Affinity)
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def backend_kind(url: str = STATE_BACKEND_URL) -> str:
+    scheme = urlparse(url or "memory://").scheme or "memory"
+    if scheme not in ("memory", "sqlite", "redis", "rediss"):
+        raise ValueError(f"Unsupported STATE_BACKEND_URL scheme: {scheme}")
+    return "redis" if scheme == "rediss" else scheme
+
+
+def sqlite_path(url: str) -> Path:
+    # sqlite:///relative.db and sqlite:////absolute/path.db, as in SQLAlchemy URLs
+    return Path(url[len("sqlite:///"):])
+
+
+def redis_client(url: str):
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("STATE_BACKEND_URL points at Redis but the 'redis' package is not installed") from None
+    return redis.Redis.from_url(url)
+
+
+class SQLiteSessionBackend:
+    """Session state and locks in one SQLite table, shared by every process using the file."""
+
+    def __init__(self, path, ttl: float = SESSION_STATE_TTL_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.ttl = ttl
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, version INTEGER, snapshot TEXT, "
+            "updated_at REAL, lock_owner TEXT, lock_expires REAL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+
+    def _conn(self):
+        # sqlite3 connections are bound to their creating thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, session_id: str, owner: str, lock_ttl: float = SESSION_LOCK_TTL_SECONDS):
+        """Takes the session's lock; returns its current version, or None if another owner holds it."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT version, lock_owner, lock_expires FROM sessions WHERE session_id = ?",
+                               (session_id,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO sessions VALUES (?, 0, NULL, ?, ?, ?)", (session_id, now, owner, now + lock_ttl))
+                version = 0
+            elif row[1] is not None and row[1] != owner and row[2] > now:
+                version = None
+            else:
+                conn.execute("UPDATE sessions SET lock_owner = ?, lock_expires = ? WHERE session_id = ?",
+                             (owner, now + lock_ttl, session_id))
+                version = row[0]
+            conn.execute("COMMIT")
+            return version
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self, session_id: str):
+        """Returns (snapshot dict or None, version)."""
+        row = self._conn().execute("SELECT snapshot, version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None, 0
+        return (json.loads(row[0]) if row[0] else None), row[1]
+
+    def save(self, session_id: str, snapshot: dict, owner: str):
+        """Stores the snapshot and releases the lock; returns the new version, or None if the lock was lost."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = conn.execute(
+                "UPDATE sessions SET snapshot = ?, version = version + 1, updated_at = ?, lock_owner = NULL, lock_expires = 0 "
+                "WHERE session_id = ? AND lock_owner = ?",
+                (json.dumps(snapshot), time.time(), session_id, owner)
+            ).rowcount
+            version = conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()[0] if updated else None
+            conn.execute("COMMIT")
+            return version
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, session_id: str, owner: str):
+        self._conn().execute("UPDATE sessions SET lock_owner = NULL, lock_expires = 0 WHERE session_id = ? AND lock_owner = ?",
+                             (session_id, owner))
+
+    def ping(self):
+        self._conn().execute("SELECT 1").fetchone()
+
+    def sweep(self) -> int:
+        now = time.time()
+        return self._conn().execute("DELETE FROM sessions WHERE updated_at < ? AND lock_expires < ?",
+                                    (now - self.ttl, now)).rowcount
+
+
+# Owner-checked writes for Redis: a worker whose lock expired must not clobber the next owner
+_REDIS_SAVE = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then return -1 end
+redis.call('HSET', KEYS[1], 'snapshot', ARGV[2])
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('DEL', KEYS[2])
+return version
+"""
+_REDIS_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RedisSessionBackend:
+    """
+    Session state as a Redis hash (version, snapshot) with a native TTL, and
+    its lock as a separate SET NX PX key.
+    """
+
+    def __init__(self, client, ttl: float = SESSION_STATE_TTL_SECONDS, prefix: str = "capital_connect:session:"):
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._save = client.register_script(_REDIS_SAVE)
+        self._release = client.register_script(_REDIS_RELEASE)
+
+    def _keys(self, session_id: str):
+        key = f"{self.prefix}{session_id}"
+        return key, f"{key}:lock"
+
+    def acquire(self, session_id: str, owner: str, lock_ttl: float = SESSION_LOCK_TTL_SECONDS):
+        key, lock = self._keys(session_id)
+        if not self.client.set(lock, owner, nx=True, px=int(lock_ttl * 1000)):
+            return None
+        version = self.client.hget(key, "version")
+        return int(version) if version is not None else 0
+
+    def load(self, session_id: str):
+        snapshot, version = self.client.hmget(self._keys(session_id)[0], "snapshot", "version")
+        return (json.loads(snapshot) if snapshot else None), int(version or 0)
+
+    def save(self, session_id: str, snapshot: dict, owner: str):
+        key, lock = self._keys(session_id)
+        version = self._save(keys=[key, lock], args=[owner, json.dumps(snapshot), self.ttl])
+        return None if version == -1 else int(version)
+
+    def release(self, session_id: str, owner: str):
+        self._release(keys=[self._keys(session_id)[1]], args=[owner])
+
+    def ping(self):
+        self.client.ping()
+
+    def sweep(self) -> int:
+        # Keys expire on their own
+        return 0
+
+
+def open_session_backend(url: str = STATE_BACKEND_URL):
+    """The shared session backend for `url`, or None to keep sessions in this process."""
+    kind = backend_kind(url)
+    if kind == "sqlite":
+        return SQLiteSessionBackend(sqlite_path(url))
+    if kind == "redis":
+        return RedisSessionBackend(redis_client(url))
+    return None